@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+annotation_benchmark.py - Time of annotating a VCF in parallel shards.
+
+Runs the shard scheduler of annotation with growing numbers of workers on a
+synthetic VCF. sed stages stand in for SnpEff and SnpSift, so what is timed is
+the splitting, the piping between stages, the scheduling and the merging.
+Run from the root of the repository:
+
+	python3 benchmarks/annotation_benchmark.py [nb_variants]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metallaxis import annotation
+
+# the same chain shape as SnpEff then SnpSift with dbSNP and ClinVar
+stub_stages = [["sed", "-e", "/^#/!s/$/;ANN=G|missense_variant|MODERATE/", "{input}"],
+			   ["sed", "-e", "/^#/!s/$/;RS=1234/", "{input}"],
+			   ["sed", "-e", "/^#/!s/$/;CLNSIG=Benign/", "{input}"]]
+
+
+def write_vcf(vcf_file, nb_variants, seed=1):
+	random_generator = random.Random(seed)
+	with open(vcf_file, 'w') as vcf_write_obj:
+		vcf_write_obj.write("##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+		position = 10000
+		for variant_nb in range(nb_variants):
+			position += random_generator.randint(1, 2000)
+			vcf_write_obj.write("\t".join(["1", str(position), ".", random_generator.choice("ACGT"), random_generator.choice("ACGT"),
+										   str(random_generator.randint(10, 1000)), "PASS",
+										   "DP=" + str(random_generator.randint(1, 30000))]) + "\n")
+
+
+def main(nb_variants):
+	with tempfile.TemporaryDirectory() as benchmark_dir:
+		vcf_file = os.path.join(benchmark_dir, "benchmark.vcf")
+		write_vcf(vcf_file, nb_variants)
+		print("workers\tshards\tseconds\tvariants_per_second")
+		for nb_workers in (1, 2, 4, 8):
+			start_time = time.perf_counter()
+			annotation.annotate_sharded(vcf_file, os.path.join(benchmark_dir, "annotated.vcf"), stub_stages, 64,
+										nb_workers=nb_workers, working_dir=benchmark_dir)
+			seconds = time.perf_counter() - start_time
+			print("%d\t%d\t%.3f\t%.0f" % (nb_workers, nb_workers * 2, seconds, nb_variants / seconds))
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+bloom_benchmark.py - Speed of looking variants up in the Bloom filter of dbSNP.
+
+Builds a filter from a synthetic dbSNP-like VCF, then looks up chunks of
+synthetic variants, half of them known, as ingest does for every chunk of a
+VCF. Run from the root of the repository:
+
+	python3 benchmarks/bloom_benchmark.py [nb_known_variants]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metallaxis import bloom
+
+
+def random_variants(nb_variants, seed):
+	random_generator = random.Random(seed)
+	chroms = [str(chrom_nb) for chrom_nb in range(1, 23)] + ["X", "Y", "MT"]
+	return [(random_generator.choice(chroms), random_generator.randint(1, 2 * 10 ** 8), random_generator.choice("ACGT"),
+			 random_generator.choice(["A", "C", "G", "T", "A,G", "TTA"])) for variant_nb in range(nb_variants)]
+
+
+def write_vcf(vcf_file, variants):
+	with open(vcf_file, 'w') as vcf_write_obj:
+		vcf_write_obj.write("##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+		for chrom, pos, ref, alt in variants:
+			vcf_write_obj.write("\t".join([chrom, str(pos), ".", ref, alt, ".", "PASS", "."]) + "\n")
+
+
+def main(nb_known_variants, chunk_size=10000):
+	known_variants = random_variants(nb_known_variants, seed=1)
+	novel_variants = random_variants(nb_known_variants, seed=2)
+	lookup_variants = [variant for variant_pair in zip(known_variants, novel_variants) for variant in variant_pair]
+	with tempfile.TemporaryDirectory() as benchmark_dir:
+		vcf_file = os.path.join(benchmark_dir, "dbsnp.vcf")
+		filter_file = os.path.join(benchmark_dir, "dbsnp.bloom")
+		write_vcf(vcf_file, known_variants)
+
+		start_time = time.perf_counter()
+		bloom.build_bloom_filter(vcf_file, filter_file)
+		build_seconds = time.perf_counter() - start_time
+
+		start_time = time.perf_counter()
+		nb_found = 0
+		with bloom.BloomFilter(filter_file) as bloom_filter:
+			for chunk_start in range(0, len(lookup_variants), chunk_size):
+				chroms, positions, refs, alts = zip(*lookup_variants[chunk_start:chunk_start + chunk_size])
+				nb_found += bloom_filter.contains_variants(chroms, positions, refs, alts).sum()
+		lookup_seconds = time.perf_counter() - start_time
+
+	print("known_variants\tbuild_seconds\tlookups\tlookups_per_second\tfound")
+	print("%d\t%.3f\t%d\t%.0f\t%d" % (nb_known_variants, build_seconds, len(lookup_variants),
+									  len(lookup_variants) / lookup_seconds, nb_found))
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
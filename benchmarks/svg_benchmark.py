@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+svg_benchmark.py - Time and memory of drawing many rectangles in SVG.
+
+Compares a scene of one Rectangle object per rectangle with a scene of a
+single Rectangles path, for growing numbers of rectangles, as the karyogram
+and the variant density track draw thousands of bins. Run from the root of
+the repository:
+
+	python3 benchmarks/svg_benchmark.py [max_power_of_ten]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metallaxis import SVGClasses
+
+
+def rectangles(nb_rectangles):
+	# fractional positions, as bins of a contig scaled to the drawing's width
+	return [(50 + rectangle_nb * 0.37, 10, 0.37, 8) for rectangle_nb in range(nb_rectangles)]
+
+
+def draw_rect_objects(nb_rectangles):
+	scene = SVGClasses.Scene("benchmark")
+	for x, y, width, height in rectangles(nb_rectangles):
+		scene.add(SVGClasses.Rectangle([x, y], height, width, [200, 60, 60]))
+	return scene.svg_string()
+
+
+def draw_rectangles_path(nb_rectangles):
+	scene = SVGClasses.Scene("benchmark")
+	scene.add(SVGClasses.Rectangles(rectangles(nb_rectangles), [200, 60, 60]))
+	return scene.svg_string()
+
+
+def measure(draw_function, nb_rectangles):
+	"""
+	Returns the time in seconds, the peak memory in Mb and the size in Mb of the
+	SVG of a drawing.
+	"""
+	tracemalloc.start()
+	start_time = time.perf_counter()
+	svg = draw_function(nb_rectangles)
+	seconds = time.perf_counter() - start_time
+	peak_memory = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return seconds, peak_memory / (1024 * 1024), len(svg) / (1024 * 1024)
+
+
+def main(max_power):
+	print("rectangles\tmethod\tseconds\tpeak_mb\tsvg_mb")
+	for power in range(3, max_power + 1):
+		nb_rectangles = 10 ** power
+		for method, draw_function in (("Rectangle objects", draw_rect_objects), ("Rectangles path", draw_rectangles_path)):
+			seconds, peak_memory, svg_size = measure(draw_function, nb_rectangles)
+			print("%d\t%s\t%.3f\t%.1f\t%.1f" % (nb_rectangles, method, seconds, peak_memory, svg_size))
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+vcf_stats_benchmark.py - Time of computing the statistics of a VCF.
+
+Compares the vectorised statistics of vcf_stats with the line by line
+counting loop they replaced, on a synthetic VCF with 1000 Genomes like INFO
+columns. Run from the root of the repository:
+
+	python3 benchmarks/vcf_stats_benchmark.py [nb_variants]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metallaxis import vcf_stats
+
+
+def write_vcf(vcf_file, nb_variants, seed=1):
+	"""
+	Writes a VCF of nb_variants SNPs, indels and multi-allelic variants over
+	the 22 autosomes and X.
+	"""
+	random_generator = random.Random(seed)
+	with open(vcf_file, 'w') as vcf_write_obj:
+		vcf_write_obj.write("##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n")
+		chroms = [str(chrom_nb) for chrom_nb in range(1, 23)] + ["X"]
+		for chrom in chroms:
+			position = 10000
+			for variant_nb in range(nb_variants // len(chroms)):
+				position += random_generator.randint(1, 2000)
+				ref = random_generator.choice("ACGT") if random_generator.random() < 0.85 else random_generator.choice(["AT", "GCA", "T"])
+				alt = random_generator.choice(["A", "C", "G", "T", "A,G", "TTA", "<DEL>"])
+				info = ("AC=" + str(random_generator.randint(1, 50)) + ";AF=" + str(round(random_generator.random(), 4)) + ";AN=5008;NS=2504;DP=" +
+						str(random_generator.randint(1, 30000)) + ";EAS_AF=0.01;AMR_AF=0.02;AFR_AF=0.0;EUR_AF=0.05;SAS_AF=0.01;AA=.|||;VT=SNP")
+				qual = str(random_generator.randint(10, 1000)) if random_generator.random() < 0.9 else "."
+				vcf_write_obj.write("\t".join([chrom, str(position), ".", ref, alt, qual, random_generator.choice(["PASS", "PASS", "q10"]), info,
+											   "GT", "0|1"]) + "\n")
+
+
+def is_number_bool(sample):
+	try:
+		float(sample)
+	except:
+		return False
+	return True
+
+
+def add_to_dict_iterator(dictionary, key, iterator_value):
+	if key not in dictionary:
+		dictionary[key] = 0
+		dictionary[key] = dictionary[key] + iterator_value
+	else:
+		dictionary[key] = dictionary[key] + iterator_value
+
+
+def count_line_by_line(vcf_file, chrom_col=0, ref_col=3, alt_col=4):
+	"""
+	The two passes of the counting loop that vcf_stats replaced, as they were.
+	"""
+	variant_stats = {}
+	length_of_all_indels = 0
+	variant_stats["Total_SNP_Count"] = 0
+	variant_stats["Total_Indel_Count"] = 0
+	list_chromosomes = set()
+	ALT_Types = set()
+
+	alt_types_only_snp = True
+	with open(vcf_file) as decompressed_out:
+		for line in decompressed_out:
+			if not line.startswith('#'):
+				line = line.split("\t")
+				alt = str(line[alt_col])
+				if set(alt).issubset(set('ACTG')) and len(alt) != 1:
+					alt_types_only_snp = False
+
+	with open(vcf_file) as decompressed_out:
+		for line in decompressed_out:
+			if not line.startswith('#'):
+				line = line.split("\t")
+
+				my_chrom = line[chrom_col]
+				if is_number_bool(my_chrom):
+					if int(my_chrom) < 10:
+						my_chrom = '0' + str(my_chrom)
+				else:
+					my_chrom = str(my_chrom)
+				line[chrom_col] = my_chrom
+				list_chromosomes.add(line[chrom_col])
+
+				alt = str(line[alt_col])
+				if alt_types_only_snp is True:
+					ALT_Types.add(alt)
+					add_to_dict_iterator(variant_stats, line[alt_col] + "_Alt_Count", 1)
+
+				if len(line[ref_col]) == len(line[alt_col]):
+					variant_stats["Total_SNP_Count"] += 1
+					add_to_dict_iterator(variant_stats, line[chrom_col] + "_Chrom_SNP_Count", 1)
+					add_to_dict_iterator(variant_stats, line[chrom_col] + "_Chrom_Variant_Count", 1)
+				else:
+					variant_stats["Total_Indel_Count"] += 1
+					add_to_dict_iterator(variant_stats, line[chrom_col] + "_Chrom_Indel_Count", 1)
+					add_to_dict_iterator(variant_stats, line[chrom_col] + "_Chrom_Variant_Count", 1)
+					length_of_all_indels += len(line[alt_col])
+	return variant_stats
+
+
+def main(nb_variants, nb_runs=3):
+	with tempfile.TemporaryDirectory() as benchmark_dir:
+		vcf_file = os.path.join(benchmark_dir, "benchmark.vcf")
+		write_vcf(vcf_file, nb_variants)
+		print("method\tseconds")
+		for method, count_function in (("line by line", lambda: count_line_by_line(vcf_file)),
+									   ("vcf_stats", lambda: vcf_stats.compute_stats(vcf_file, 1, 10000))):
+			# the best of a few runs, as other processes slow some of them down
+			run_times = []
+			for run_nb in range(nb_runs):
+				start_time = time.perf_counter()
+				count_function()
+				run_times.append(time.perf_counter() - start_time)
+			print("%s\t%.3f" % (method, min(run_times)))
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 300000)
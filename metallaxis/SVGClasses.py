@@ -8,10 +8,52 @@ is to construct a scene, add objects to it, and then write it to a file
 to display it.
 """
 
+import io
+import os
+
 display_prog = 'display'  # Command to execute to display images.
 
+# vertical space taken by each lane of genes
+lane_height = 14
+
+
+def svg_header(height, width):
+	# add 50 to width so that annotation doesn't get cut off
+	return ["<?xml version=\"1.0\"?>\n",
+	        "<svg xmlns=\"http://www.w3.org/2000/svg\" height=\"%d\" width=\"%d\" >\n" % (height, (width + 50)),
+	        "<style>",
+	        ".te polygon {fill-opacity:0.7}",
+	        ".te text {visibility: hidden; stroke-width: 0px; font-size: 8pt; font-family: sans-serif;}",
+	        ".te:hover polygon {fill-opacity: 1;}",
+	        ".te:hover text {visibility: visible;}",
+	        ".allele rect {fill-opacity:0.7}",
+	        ".allele text {visibility: hidden; stroke-width: 0px; font-size: 8pt; font-family: sans-serif;}",
+	        ".allele:hover rect {fill-opacity: 1;}",
+	        ".allele:hover text {visibility: visible;}",
+	        ".density rect {fill-opacity:0.7}",
+	        ".density text {visibility: hidden; stroke-width: 0px; font-size: 8pt; font-family: sans-serif;}",
+	        ".density:hover rect {fill-opacity: 1;}",
+	        ".density:hover text {visibility: visible;}",
+	        "</style>",
+	        " <g style=\"fill-opacity:1.0; stroke:black;\n",
+	        "  stroke-width:1;\">\n"]
+
+
+svg_footer = " </g>\n</svg>\n"
+
+
+def svg_number(value):
+	"""
+	Formats a coordinate with up to 2 decimals, so that shapes placed at
+	fractional positions don't snap to whole pixels and leave gaps or overlaps.
+	"""
+	number = ("%.2f" % value).rstrip('0').rstrip('.')
+	return "0" if number == "-0" else number
+
 
 class Scene:
+	__slots__ = ('name', 'items', 'height', 'width', 'svgname')
+
 	def __init__(self, name="svg", height=150, width=750):
 		self.name = name
 		self.items = []
@@ -22,34 +64,33 @@ class Scene:
 	def add(self, item):
 		self.items.append(item)
 
+	def iter_svg(self):
+		"""
+		Generator returning the SVG document piece by piece.
+		"""
+		yield from svg_header(self.height, self.width)
+		for item in self.items:
+			yield from item.strarray()
+		yield svg_footer
+
 	def strarray(self):
-		# add 50 to width so that annotation doesn't get cut off
-		var = ["<?xml version=\"1.0\"?>\n",
-		       "<svg xmlns=\"http://www.w3.org/2000/svg\" height=\"%d\" width=\"%d\" >\n" % (self.height, (self.width + 50)),
-                       "<style>",
-                       ".te polygon {fill-opacity:0.7}",
-                       ".te text {visibility: hidden; stroke-width: 0px; font-size: 8pt; font-family: sans-serif;}",
-                       ".te:hover polygon {fill-opacity: 1;}",
-                       ".te:hover text {visibility: visible;}",
-                       ".allele rect {fill-opacity:0.7}",
-                       ".allele text {visibility: hidden; stroke-width: 0px; font-size: 8pt; font-family: sans-serif;}",
-                       ".allele:hover rect {fill-opacity: 1;}",
-                       ".allele:hover text {visibility: visible;}",
-                       "</style>",
-		       " <g style=\"fill-opacity:1.0; stroke:black;\n",
-		       "  stroke-width:1;\">\n"]
-		for item in self.items: var += item.strarray()
-		var += [" </g>\n</svg>\n"]
-		return var
+		return list(self.iter_svg())
+
+	def write_to(self, stream):
+		stream.writelines(self.iter_svg())
+
+	def svg_string(self):
+		svg_buffer = io.StringIO()
+		self.write_to(svg_buffer)
+		return svg_buffer.getvalue()
 
 	def write_svg(self, filename=None):
 		if filename:
 			self.svgname = filename
 		else:
 			self.svgname = self.name + ".svg"
-		file = open(self.svgname, 'w')
-		file.writelines(self.strarray())
-		file.close()
+		with open(self.svgname, 'w') as file:
+			self.write_to(file)
 		return
 
 	def display(self, prog=display_prog):
@@ -58,6 +99,8 @@ class Scene:
 
 
 class Line:
+	__slots__ = ('start', 'end')
+
 	def __init__(self, start, end):
 		self.start = start  # xy tuple
 		self.end = end  # xy tuple
@@ -69,6 +112,8 @@ class Line:
 
 
 class Circle:
+	__slots__ = ('center', 'radius', 'color')
+
 	def __init__(self, center, radius, color):
 		self.center = center  # xy tuple
 		self.radius = radius  # xy tuple
@@ -82,6 +127,8 @@ class Circle:
 
 
 class TE:
+	__slots__ = ('origin', 'name', 'current_annotation', 'point_right', 'point_left', 'fill', 'strokeWidth', 'stroke')
+
 	def __init__(self, origin, name, current_impact,current_annotation, type=""):
 		self.origin = [origin, 95]
 		self.name = name
@@ -115,21 +162,22 @@ class TE:
 		return
 
 	def strarray(self):
-		self.obj = ["  <polygon points=\"%d,%d %d,%d %d,%d \" style=\"fill:%s\" stroke=\"%s\" stroke-width=\"%s\" />\n" % (self.point_right[0], self.point_right[1], self.point_left[0], self.point_left[1], self.origin[0], self.origin[1], self.fill, self.stroke, self.strokeWidth)]
+		obj = ["  <polygon points=\"%d,%d %d,%d %d,%d \" style=\"fill:%s\" stroke=\"%s\" stroke-width=\"%s\" />\n" % (self.point_right[0], self.point_right[1], self.point_left[0], self.point_left[1], self.origin[0], self.origin[1], self.fill, self.stroke, self.strokeWidth)]
 
 		if self.name != ".":
-			self.label = Text([self.point_left[0], 70], self.name, 8).strarray()
+			label = Text([self.point_left[0], 70], self.name, 8).strarray()
 		else:
-			self.label = Text([self.point_left[0], 70], " ", 8).strarray()
+			label = Text([self.point_left[0], 70], " ", 8).strarray()
 
 		if self.current_annotation is not None:
-			self.label += Text([self.point_left[0], 60], self.current_annotation, 8, fontColor="#2062ba", fontWeight=700).strarray()
+			label += Text([self.point_left[0], 60], self.current_annotation, 8, fontColor="#2062ba", fontWeight=700).strarray()
 
-		self.obj = ['<g class="te">'] + self.obj + self.label + ['</g>']
-		return self.obj
+		return ['<g class="te">'] + obj + label + ['</g>']
 
 
 class Rectangle:
+	__slots__ = ('origin', 'height', 'width', 'color', 'opacity')
+
 	def __init__(self, origin, height, width, color, opacity=None):
 		self.origin = origin
 		self.height = height
@@ -142,13 +190,35 @@ class Rectangle:
 		return
 
 	def strarray(self):
-		return ["  <rect x=\"%d\" y=\"%d\" height=\"%d\"\n" % \
-		        (self.origin[0], self.origin[1], self.height),
-		        "    width=\"%d\" style=\"fill:%s;,fill-opacity:%s\" />\n" % \
-		        (self.width, colorstr(self.color), self.opacity)]
+		return ["  <rect x=\"%s\" y=\"%s\" height=\"%s\"\n" % \
+		        (svg_number(self.origin[0]), svg_number(self.origin[1]), svg_number(self.height)),
+		        "    width=\"%s\" style=\"fill:%s;,fill-opacity:%s\" />\n" % \
+		        (svg_number(self.width), colorstr(self.color), self.opacity)]
+
+
+class Rectangles:
+	"""
+	Many rectangles of the same color, written as the subpaths of a single
+	<path> element rather than one <rect> each. Accepts an iterable of
+	(x, y, width, height) tuples.
+	"""
+	__slots__ = ('rectangles', 'color', 'opacity')
+
+	def __init__(self, rectangles, color, opacity=1):
+		self.rectangles = rectangles
+		self.color = color
+		self.opacity = opacity
+
+	def strarray(self):
+		path_data = " ".join("M%s %sh%sv%sh%sz" % (svg_number(x), svg_number(y), svg_number(width), svg_number(height), svg_number(-width))
+							 for x, y, width, height in self.rectangles)
+		return ["  <path d=\"%s\"\n" % path_data,
+		        "    style=\"fill:%s;fill-opacity:%s;stroke:none\" />\n" % (colorstr(self.color), self.opacity)]
 
 
 class Text:
+	__slots__ = ('origin', 'text', 'size', 'fontColor', 'fontStyle', 'fontWeight')
+
 	def __init__(self, origin, text, size=6, fontColor="#303030", fontStyle="normal", fontWeight=100):
 		self.origin = origin
 		self.text = text
@@ -165,11 +235,24 @@ class Text:
 		        "  </text>\n"]
 
 
+class Script:
+	__slots__ = ('code',)
+
+	def __init__(self, code):
+		self.code = code
+
+	def strarray(self):
+		return ["  <script type=\"application/ecmascript\"><![CDATA[\n", self.code, "  ]]></script>\n"]
+
+
 class Allele:
-	def __init__(self, start, end, name, biotype, description, color_num=1):
+	__slots__ = ('y', 'rect', 'name', 'start', 'end', 'biotype', 'description')
+
+	def __init__(self, start, end, name, biotype, description, color_num=1, lane=0):
 		rectangle_width = end - start
 		color_list = [[171, 138, 222], [221, 136, 187], [206, 146, 135], [222, 213, 138], [206, 146, 135]]
-		self.rect = Rectangle([start, 95], 10, rectangle_width, color_list[color_num], 0.4)
+		self.y = 95 + lane * lane_height
+		self.rect = Rectangle([start, self.y], 10, rectangle_width, color_list[color_num], 0.4)
 		self.name = name
 		self.start = start
 		self.end = end
@@ -180,14 +263,47 @@ class Allele:
 		return (self.end - self.start)
 
 	def strarray(self):
-		self.label = Text([self.start, 117], self.name, 8, fontWeight=700, fontColor="#303030").strarray()
+		label = Text([self.start, self.y + 22], self.name, 8, fontWeight=700, fontColor="#303030").strarray()
 		if self.biotype != None:
-		    self.label += Text([self.start, 127], self.biotype, 8, fontColor="#6c79c5").strarray()
+		    label += Text([self.start, self.y + 32], self.biotype, 8, fontColor="#6c79c5").strarray()
 		if self.description != None:
-		    self.label += Text([self.start, 137], self.description, 8, fontColor="#787a88", fontStyle="italic").strarray()
+		    label += Text([self.start, self.y + 42], self.description, 8, fontColor="#787a88", fontStyle="italic").strarray()
+
+		return ['<g class="allele">'] + self.rect.strarray() + label + ['</g>']
+
+
+class DensityBar:
+	__slots__ = ('rect', 'start', 'label')
 
-		self.obj = ['<g class="allele">'] + self.rect.strarray() + self.label + ['</g>']
-		return self.obj
+	def __init__(self, start, width, height, label, color):
+		self.rect = Rectangle([start, 95 - height], height, width, color)
+		self.start = start
+		self.label = label
+
+	def strarray(self):
+		return ['<g class="density">'] + self.rect.strarray() + Text([self.start, 40], self.label, 8).strarray() + ['</g>']
+
+
+def pack_lanes(intervals, max_lanes, gap=2):
+	"""
+	Assigns each (start, end) interval to the first lane in which it doesn't
+	overlap the previous interval, and returns the list of lanes in the same
+	order as intervals. Intervals that fit in no lane go in the last one.
+	"""
+	lane_ends = []
+	lanes = [0] * len(intervals)
+	for interval_nb in sorted(range(len(intervals)), key=lambda interval_nb: intervals[interval_nb][0]):
+		start, end = intervals[interval_nb]
+		for lane, lane_end in enumerate(lane_ends):
+			if lane_end + gap <= start:
+				break
+		else:
+			lane = len(lane_ends) if len(lane_ends) < max_lanes else max_lanes - 1
+			if lane == len(lane_ends):
+				lane_ends.append(end)
+		lane_ends[lane] = max(lane_ends[lane], end)
+		lanes[interval_nb] = lane
+	return lanes
 
 
 def colorstr(rgb): return "#%x%x%x" % (int(rgb[0] / 16), int(rgb[1] / 16), int(rgb[2] / 16))
@@ -1,33 +1,30 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import requests
 import os
 import yaml  # for reading settings file
-import pathlib  # for making the folder where we store data
-import platform  # for determining OS and therefore where to store data
 import re
 import sys
+
+# the commands of the headless command line must not load Qt nor matplotlib
+if __name__ == '__main__' and len(sys.argv) > 1:
+	from metallaxis import cli
+	if sys.argv[1] in cli.commands:
+		sys.exit(cli.main(sys.argv[1:]))
+
+import time  # to measure redraw latency of the variant graphic
 from shutil import copyfile  # for save analysis
+from collections import OrderedDict  # for the cache of rendered variant graphics
+from concurrent.futures import ThreadPoolExecutor  # to compute statistics of filtered variants in the background
 
-import magic  # to detect filetype from file header
 import numpy as np  # to handle arrays and NaN
 import pandas as pd  # to handle dataframes
 import sqlite3  # handle sqlite db
-import wget  # to download from FTP
-
-# to handle compressed VCFs
-import lzma
-import bz2
-import gzip
 
 import matplotlib  # to plot graphs
 
 matplotlib.use("Qt5Agg")  # to make matplotlib behave nicely with PyQT5
 
-# to read selected lines of files (reduce RAM usage for big files)
-from itertools import islice
-
 # to build graphical interface
 from PyQt5 import QtCore, QtWidgets, uic
 from PyQt5.QtGui import QDesktopServices, QIcon
@@ -35,14 +32,40 @@ from PyQt5.QtWidgets import QApplication, QCheckBox, QMessageBox, QDesktopWidget
 from PyQt5.QtSvg import QSvgWidget
 
 from PyQt5 import QtCore, QtGui, QtSvg
-from PyQt5.QtWebEngineWidgets import QWebEngineView
+from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEnginePage
 
 # Import SVG Drawing Classes
 from metallaxis import SVGClasses
+# Index of regions already annotated by ENSEMBL
+from metallaxis import interval_index
+# Spatial index of gene positions
+from metallaxis import gene_index
+# Cache of ENSEMBL responses shared between sessions
+from metallaxis import ensembl_cache
+# Background fetching of genes around loaded variants
+from metallaxis import gene_prefetch
+# Pooled client for the ENSEMBL REST API
+from metallaxis import ensembl_client
+# Gene models imported from local GTF/GFF3 files
+from metallaxis import gene_models
+# Whole genome overview of variant density
+from metallaxis import karyogram
+# Vectorised VCF statistics
+from metallaxis import vcf_stats
+# Statistics of the variants matching a table filter
+from metallaxis import subset_stats
+# Constant memory estimates of distinct counts and quantiles
+from metallaxis import approximate_stats
+# Conversion of VCFs into session databases, shared with the command line
+from metallaxis import pipeline
+# Intersection, difference and union of the variants of saved analyses
+from metallaxis import session_compare
 
 # for plotting graphs
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.pyplot as plt
+import io  # to render plots to PNG in memory
 
 plt.style.use('seaborn')
 
@@ -51,19 +74,10 @@ import signal
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-# Determine where to store temporary Metallaxis Data
-home_dir = os.path.expanduser('~')
-if platform.system() == "Linux":
-	config_directory = home_dir + "/.metallaxis/"
-elif platform.system() == "Darwin":
-	config_directory = home_dir + "/Library/Caches/Metallaxis/"
-elif platform.system() == "Windows":
-	config_directory = os.path.expandvars(r'%APPDATA%\Metallaxis\\')
-
-# make data folder and parent folders if they don't exist
-pathlib.Path(config_directory).mkdir(parents=True, exist_ok=True)
-
-config_file = os.path.join(config_directory, "metallaxis_config.yaml")
+# settings and caches are stored in the same place as on the command line
+config_directory = pipeline.config_directory
+config_file = pipeline.config_file
+ensembl_cache_file = pipeline.ensembl_cache_file
 
 # Interface XML files
 current_file_path = __file__
@@ -72,12 +86,6 @@ MetGUIui = os.path.join(current_file_dir, "gui/MetallaxisGui.ui")
 MetSETui = os.path.join(current_file_dir, "gui/MetallaxisSettings.ui")
 MetPROGui = os.path.join(current_file_dir, "gui/MetallaxisProgress.ui")
 
-# Annotation executables
-snpsift_jar = os.path.join(current_file_dir, "annotation/SnpSift.jar")
-snpeff_jar = os.path.join(current_file_dir, "annotation/SnpEff.jar")
-
-# vector image locations
-svg_output_name = os.path.join(current_file_dir, 'variant_pic.svg')
 
 def throw_warning_message(warning_message):
 	"""
@@ -109,71 +117,32 @@ def throw_error_message(error_message):
 
 
 def read_config(config_file):
-	with open(config_file, 'r') as configf:
-		try:
-			config = yaml.safe_load(configf)
-			return config
-		except yaml.YAMLError as exc:
-			throw_error_message(exc)
-			return False
+	try:
+		return pipeline.load_config(config_file)
+	except yaml.YAMLError as exc:
+		throw_error_message(str(exc))
+		return False
 
 
-def decompress_vcf(type_of_compression, vcf_input_filename, headonly_bool=False, vcf_output_filename=None):
+class GuiPipelineHooks(pipeline.PipelineHooks):
 	"""
-	Decompresses or not, a file in argument (accepts xz/gz/bz2), and returns
-	either the head of the decompressed file, or the filename of the decompressed
-	VCF depending on the provided boolean argument: "headonly_bool".
+	Shows the progress of the pipeline in the progress bar, and its warnings
+	and errors as dialogs.
 	"""
-	if type_of_compression == "":
-		decompressed_file_object = open(vcf_input_filename, mode="rb")
-	else:
-		decompressed_file_object = eval(type_of_compression).open(vcf_input_filename, mode="rb")
+	def progress(self, percent, message):
+		MetallaxisGui.progress_bar(percent, message)
 
-	if headonly_bool is True:
-		decompressed_file_head = list(islice(decompressed_file_object, 100))
-		decompressed_file_object.close()
-		return decompressed_file_head
-	else:
-		with open(vcf_output_filename, "wb") as decompressed_out:
-			decompressed_out.write(decompressed_file_object.read())
-		decompressed_file_object.close()
-		return vcf_output_filename
+	def warning(self, message):
+		throw_warning_message(message)
 
+	def error(self, message):
+		throw_error_message(message)
 
-def is_number_bool(sample):
-	try:
-		float(sample)
-	except:
-		return False
-	return True
-
+	def detected_filetype(self, filetype):
+		MetallaxisGui.detected_filetype_label.setText(filetype)
 
-def set_col_to_numeric_if_isdigit(column, chunk, numeric_columns_list):
-	"""
-	Determines which columns of a given chunk are ints or floats, and removes
-	them from a list of columns if they are neither.
-	"""
-
-	def del_col(column):
-		if column in numeric_columns_list:
-			numeric_columns_list.remove(column)
-
-	for row in chunk[column]:
-		row = str(row)
-		if "," in row:
-			del_col(column)
-		if ";" in row:
-			del_col(column)
-		if "|" in row:
-			del_col(column)
-		if "True" in row:
-			del_col(column)
-		if "False" in row:
-			del_col(column)
-		if bool(re.match('^[0-9]+$', row)) is False:
-			if is_number_bool(row) is False:
-				if column in numeric_columns_list:
-					numeric_columns_list.remove(column)
+	def loaded_file(self, filename):
+		MetallaxisGui.loaded_vcf_lineedit.setText(filename)
 
 
 def load_sqlite(sqlite_filename):
@@ -186,6 +155,9 @@ def load_sqlite(sqlite_filename):
 		# Verify file exists and return its read object
 		MetallaxisGui.loaded_vcf_lineedit.setText(os.path.abspath(sqlite_filename))
 		loaded_db_connection = sqlite3.connect(sqlite_filename)
+		# the viewer and overview read from the loaded session from now on
+		global db_connection
+		db_connection = loaded_db_connection
 		complete_sqlite_file = pd.read_sql("SELECT * FROM df", loaded_db_connection)
 		return complete_sqlite_file
 
@@ -194,555 +166,37 @@ def load_sqlite(sqlite_filename):
 		exist. You specified : " + str(sqlite_filename))
 
 
-def verify_file(selected_vcf):
-	"""
-	Verify that given VCF is a valid file, that exists, and has a non-null filesize.
-	Accepts a VCF as entry, returns a boolean: true if file exists, false if not.
-	"""
-	# Verify that the file exists
-	if not os.path.isfile(selected_vcf):
-		throw_error_message("Selected file does not \
-	exist. You specified : " + str(selected_vcf))
-		return False
-
-	# Verify that the file isn't empty
-	if not os.path.getsize(selected_vcf) > 0:
-		throw_error_message("Selected file is empty. \
-	You specified : " + str(selected_vcf))
-		return False
-
-	# Return True to continue, as VCF matched neither of our tests
-	return True
-
-
-def verify_vcf(decompressed_file_head):
-	# verify is conform to VCFv4.1 specification:
-	# The header line names the 8 fixed, mandatory columns. These columns are as follows:
-	# CHROM
-	# POS
-	# - (Integer, Required)
-	# ID
-	# - No identifier should be present in more than one data record
-	# REF
-	# - must be one of A,C,G,T,N (case insensitive). Multiple bases are permitted
-	# ALT
-	# - must be one of A,C,G,T,N (case insensitive). Multiple bases are permitted
-	# - or an angle-bracketed ID String (“<ID>”)
-	# - or a breakend replacement string as described in the section on
-	# breakends.
-	# - If there are no alternative alleles, then the missing value should be used.
-	# QUAL
-	# - float or Integer
-	# FILTER
-	# INFO
-
-	line_num = 0
-	variant_num = 0
-	global metadata_num  # make global as this will be used in database_encode
-	# make a list of mandatory columns in VCF we need to find for a VCF to be valid
-	expected_columns = ['#CHROM', 'POS', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
-
-	for line in decompressed_file_head:
-		line_num = line_num + 1
-		if line.startswith(b'#'):  # lines with # are metadata
-			if line.startswith(b'#CHROM'):
-				# verify header is conform to vcf 4.1 spec
-				# decode byte object to utf-8 string, then split by tab to get each column
-				header_line_cols = line.decode('UTF-8')
-				header_line_cols = header_line_cols.rstrip()  # remove trailing/leading whitespace
-				header_line_cols = header_line_cols.split("\t")
-				# get index of each column name
-				global chrom_col, id_col, pos_col, ref_col, alt_col, qual_col
-				chrom_col = [i for i, s in enumerate(header_line_cols) if '#CHROM' in s][0]
-				id_col = [i for i, s in enumerate(header_line_cols) if 'ID' in s][0]
-				pos_col = [i for i, s in enumerate(header_line_cols) if 'POS' in s][0]
-				ref_col = [i for i, s in enumerate(header_line_cols) if 'REF' in s][0]
-				alt_col = [i for i, s in enumerate(header_line_cols) if 'ALT' in s][0]
-				qual_col = [i for i, s in enumerate(header_line_cols) if 'QUAL' in s][0]
-
-				# verify that VCF has all required columns
-				if not all(column in header_line_cols for column in expected_columns):
-					throw_error_message("VCF not valid: VCF doesn't not contain all required columns. Contains: " + str(
-						header_line_cols))
-					return False
-
-		else:
-			# if line is not part of header, split by tab to get columns
-			# and verify that each column, in each line is conform to VCFv4.1
-			split_line = line.decode('UTF-8').split("\t")
-			for column in split_line:
-				column = column.strip()
-
-				# Verify that POS column only contains digits
-				if column == split_line[pos_col]:
-					if not column.isdigit():
-						throw_error_message("VCF not valid: column 'POS' doesn't only contain digits: " + str(column))
-						return False
-
-				# Verify that REF column only contains ACGTN
-				elif column == split_line[ref_col]:
-					allowed_chars = set('ACGTN')
-					if not set(column.upper()).issubset(allowed_chars):
-						throw_error_message(
-							"VCF not valid: column 'REF' doesn't only contain A,C,G,T,N: " + str(column))
-						return False
-
-				# Verify that ALT column only contains ACGTN or <ID>
-				elif column == split_line[alt_col]:
-					if not column.startswith("<") and column.endswith(">"):
-						allowed_chars = set('ACGTN')
-						if not set(column).issubset(allowed_chars):
-							throw_error_message(
-								"VCF not valid: column 'ALT' doesn't only contain A,C,G,T,N or <ID>: " + str(column))
-							return False
-
-				# Verify that QUAL column only contains number (float or int) or "."
-				elif column == split_line[qual_col]:
-					if column.isdigit():
-						break
-					elif column == ".":
-						break
-					else:
-						allowed_chars = set('123456789.')
-						if not set(column).issubset(allowed_chars):
-							try:
-								float(column)
-
-							except ValueError:
-								throw_error_message(
-									"VCF not valid: column 'QUAL' doesn't only contain digits: " + str(column))
-								return False
-			variant_num += 1
-
-		# set global variable to be total number of lines of metadata (will be used to extract just the data in database_encode()
-		metadata_num = int(line_num - variant_num)
-
-	# return Error or warning depending on variant numbers
-	if variant_num == 0:
-		throw_error_message("VCF is empty, there are no variants at all in this vcf, please use a different vcf")
-		return False
-	elif variant_num < 5:
-		# TODO: uncomment the lines below, and remove "return TRUE"
-		return True
-	# throw_error_message("VCF contains too few variants to analyse, please use a different vcf")
-	# return False
-	elif 5 < variant_num < 30:
-		# TODO: Uncomment the below as is just to speed up development that I removed GUI
-		# throw_warning_message("VCF contains very few variants, only rudimentary statistics can be performed")
-		return True
-	else:
-		# if more than 35 variants then VCF is fine, return without any alert
-		return True
-
 
-def parse_vcf(vcf_input_filename):
+class KaryogramPage(QWebEnginePage):
 	"""
-	Takes a VCF in input, runs both file and VCF verifications, decompresses it, and extracts metadata  and statistics
-	Accepts a string of a VCF filename in input.
-	Returns a tuple of a metadata dictionary, a statistics dictionary, and the filename of the decompressed VCF.
+	Web page of the karyogram, which turns the navigations its script makes
+	when a bin is clicked into a bin_clicked signal.
 	"""
-	# Verify that the selected VCF is a valid file (ie. that it exists, and has a non-null size)
-	MetallaxisGui.progress_bar(3, "Verifying VCF: verifying that file is valid")
-	file_is_valid = verify_file(vcf_input_filename)
-	if not file_is_valid:
-		return
-
-	vcf_filetype = magic.from_file(vcf_input_filename)
-	# Decompress selected vcf
-	if "XZ" in vcf_filetype:
-		MetallaxisGui.detected_filetype_label.setText("xz compressed VCF")
-		decompressed_file_head = decompress_vcf("lzma", vcf_input_filename, headonly_bool=True)
-
-	elif "bzip2" in vcf_filetype:
-		MetallaxisGui.detected_filetype_label.setText("bz2 compressed VCF")
-		decompressed_file_head = decompress_vcf("bz2", vcf_input_filename, headonly_bool=True)
-
-	elif "gzip" in vcf_filetype:
-		MetallaxisGui.detected_filetype_label.setText("gz compressed VCF")
-		decompressed_file_head = decompress_vcf("gzip", vcf_input_filename, headonly_bool=True)
-
-	elif "Variant Call Format" in vcf_filetype:
-		MetallaxisGui.detected_filetype_label.setText("uncompressed VCF")
-		decompressed_file_head = decompress_vcf("", vcf_input_filename, headonly_bool=True)
-
-	else:
-		throw_error_message("Selected file must be a VCF file")
-		return
-
-	# now we have a returned decompressed file object verify if
-	# contents are valid vcf
-	MetallaxisGui.progress_bar(8, "Verifying VCF: verifying that file is a valid VCF")
-	vcf_is_valid = verify_vcf(decompressed_file_head)
-	if not vcf_is_valid:
-		return
-
-	MetallaxisGui.progress_bar(9, "Decompressing VCF")
-	if "XZ" in vcf_filetype:
-		decompressed_file = decompress_vcf("lzma", vcf_input_filename, vcf_output_filename=vcf_output_filename)
-
-	elif "bzip2" in vcf_filetype:
-		decompressed_file = decompress_vcf("bz2", vcf_input_filename, vcf_output_filename=vcf_output_filename)
-
-	elif "gzip" in vcf_filetype:
-		decompressed_file = decompress_vcf("gzip", vcf_input_filename, vcf_output_filename=vcf_output_filename)
-
-	elif "Variant Call Format" in vcf_filetype:
-		decompressed_file = decompress_vcf("", vcf_input_filename, vcf_output_filename=vcf_output_filename)
-
-	MetallaxisGui.loaded_vcf_lineedit.setText(os.path.abspath(vcf_input_filename))
-
-	# Calculate counts of different variant types
-	def add_to_dict_iterator(dictionary, key, iterator_value):
-		"""
-		iterates a key in a dictionary. for a given dictionary name and key name it will add iterator_value
-		to the value of the key, unless it doesn't exist in which case it will create it.
-		"""
-		if key not in dictionary:
-			# add empty list to dict as key
-			dictionary[key] = 0
-			dictionary[key] = dictionary[key] + iterator_value
-		else:
-			# append value to list
-			dictionary[key] = dictionary[key] + iterator_value
-
-	variant_stats = {}
-	length_of_all_indels = 0
-	variant_stats["Total_SNP_Count"] = 0
-	variant_stats["Total_Indel_Count"] = 0
-	global list_chromosomes, ALT_Types
-	list_chromosomes = set()  # use set instead of list so it won't store duplicate values
-	ALT_Types = set()  # use set instead of list so it won't store duplicate values
-
-	# If VCF only has SNP then collect data on distribution of different nucleotides
-	alt_types_only_snp = True
-	with open(decompressed_file) as decompressed_out:
-		for line in decompressed_out:
-			if not line.startswith('#'):
-				line = line.split("\t")
-				alt = str(line[alt_col])
-				if set(alt).issubset(set('ACTG')) and len(alt) != 1:
-					alt_types_only_snp = False
-
-	with open(decompressed_file) as decompressed_out:
-		for line in decompressed_out:
-			if not line.startswith('#'):
-				line = line.split("\t")
-
-				# Convert CHR 1 to be CHR 01 for correct sorting
-				my_chrom = line[chrom_col]
-				if is_number_bool(my_chrom):
-					if int(my_chrom) < 10:
-						my_chrom = '0' + str(my_chrom)
-				else:
-					my_chrom = str(my_chrom)
-				line[chrom_col] = my_chrom
-				list_chromosomes.add(line[chrom_col])
-
-				alt = str(line[alt_col])
-				# if our alt types are only SNP or transposable elements
-				# then count them
-				if alt_types_only_snp is True:
-					ALT_Types.add(alt)
-					add_to_dict_iterator(
-						variant_stats, line[alt_col] + "_Alt_Count", 1)
-
-				if len(line[ref_col]) == len(line[alt_col]):
-					variant_stats["Total_SNP_Count"] += 1
-					add_to_dict_iterator(variant_stats, line[chrom_col] + "_Chrom_SNP_Count", 1)
-					add_to_dict_iterator(variant_stats, line[chrom_col] + "_Chrom_Variant_Count", 1)
-				else:
-					variant_stats["Total_Indel_Count"] += 1
-					add_to_dict_iterator(variant_stats, line[chrom_col] + "_Chrom_Indel_Count", 1)
-					add_to_dict_iterator(variant_stats, line[chrom_col] + "_Chrom_Variant_Count", 1)
-					length_of_all_indels += len(line[alt_col])
-
-	total_chrom_snp_count, total_chrom_indel_count = 0, 0
-	for key, value in variant_stats.items():
-		if "_Chrom_SNP_Count" in key:
-			total_chrom_snp_count += value
-		if "_Chrom_Indel_Count" in key:
-			total_chrom_indel_count += value
-
-	if length_of_all_indels > 0 and variant_stats["Total_Indel_Count"] > 0:
-		variant_stats["Avg_Indel_Length"] = float(
-			length_of_all_indels / variant_stats["Total_Indel_Count"])
-		variant_stats["Avg_Indel_Length"] = round(variant_stats["Avg_Indel_Length"], 3)
-	variant_stats["Avg_SNP_per_Chrom"] = int(
-		total_chrom_snp_count / len(list_chromosomes))
-	variant_stats["Avg_Indel_per_Chrom"] = int(
-		total_chrom_indel_count / len(list_chromosomes))
-	variant_stats["Avg_Variant_per_Chrom"] = int(
-		(total_chrom_snp_count + total_chrom_indel_count) / len(list_chromosomes))
-
-	variant_stats["List_Chromosomes"] = list_chromosomes
-
-	# if alt_types isn't empty then add to statistics dictionary
-	if ALT_Types != set():
-		variant_stats["ALT_Types"] = ALT_Types
-
-	# Extract Metadata from VCF
-	metadata_dict = {}
-	# Match groups either side of an "=", after a "##". e.g. filename=xyz, source=tangram, etc.
-	regex_metadata = re.compile('(?<=##)(.*?)=(.*$)')
-
-	MetallaxisGui.progress_bar(10, "Extracting VCF metadata")
-	with open(decompressed_file) as decompressed_out:
-		vcf_line_nb, metadata_line_nb = 0, 0
-
-		for line in decompressed_out:
-			if line.startswith('##'):
-				metadata_tag = str(regex_metadata.search(line).group(1))
-				metadata_result = str(regex_metadata.search(line).group(2))
-				# classify uppercase metadata (e.g. "INFO", "FILTER") differently
-				if metadata_tag.isupper():
-					metadata_type = metadata_tag
-				else:
-					metadata_type = "basic"
-					# truncate long metadata to avoid database errors and distorting the GUI
-					if len(metadata_tag) > 20:
-						metadata_tag = metadata_tag[:20] + "..."
-					if len(metadata_result) > 95:
-						metadata_result = metadata_result[:95] + "...<truncated due to length>"
-
-				metadata_dict_entry = [metadata_type, metadata_tag, metadata_result]
-				if not metadata_dict_entry in metadata_dict.values():
-					metadata_dict[metadata_line_nb] = metadata_dict_entry
-				metadata_line_nb += 1
-
-	return metadata_dict, variant_stats, decompressed_file
-
-
-def already_annotated(vcf_file):
-	with open(vcf_file, 'r') as vcf_read_obj:
-		for line in vcf_read_obj:
-			if line.startswith("##INFO=<ID=ANN"):
-				return True
-
-
-def annotate_vcf(vcf_file):
-	clinvar_url = "ftp://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/clinvar.vcf.gz"
-	clinvar_index_url = "ftp://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/clinvar.vcf.gz.tbi"
+	bin_clicked = QtCore.pyqtSignal(str, int)
 
-	dbSNP_url = "ftp://ftp.ncbi.nih.gov/snp/organisms/human_9606_b150_GRCh38p7/VCF/00-All.vcf.gz"
-	dbSNP_index_url = "ftp://ftp.ncbi.nih.gov/snp/organisms/human_9606_b150_GRCh38p7/VCF/00-All.vcf.gz.tbi"
-
-	dbSNP_index_path = os.path.join(config['working_dir'], 'dbsnp.vcf.gz.tbi')
-	if not os.path.isfile(dbSNP_index_path):
-		wget.download(dbSNP_index_url, out=dbSNP_index_path)
-
-	dbSNP_path = os.path.join(config['working_dir'], 'dbsnp.vcf.gz')
-	if not os.path.isfile(dbSNP_path):
-		MetallaxisGui.progress_bar(35, "Downloading Annotation databases (this will take a while)")
-		wget.download(dbSNP_url, out=dbSNP_path)
-
-	clinvar_index_path = os.path.join(config['working_dir'], 'clinvar.vcf.gz.tbi')
-	if not os.path.isfile(clinvar_index_path):
-		wget.download(clinvar_index_url, out=clinvar_index_path)
-
-	clinvar_path = os.path.join(config['working_dir'], 'clinvar.vcf.gz')
-	if not os.path.isfile(clinvar_path):
-		MetallaxisGui.progress_bar(37, "Downloading Annotation databases (this will take a while)")
-		wget.download(clinvar_url, out=clinvar_path)
-
-	MetallaxisGui.progress_bar(5, "Running annotation on VCF (this will take some time)")
-
-	annotate_cmd = "java -Xmx" + config['max_memory'] + "G -jar " + snpeff_jar + " " + config[
-		'genome_version'] + " " + vcf_file + " > " + annotated_vcf_output_filename
-	os.system(annotate_cmd)
-
-	annotate_cmd = "java -Xmx" + config[
-		'max_memory'] + "G -jar " + snpsift_jar + " annotate " + dbSNP_path + " " + annotated_vcf_output_filename + " > " + annotated_vcf_output_filename + "1"
-	os.system(annotate_cmd)
-
-	annotate_cmd = "java -Xmx" + config[
-		'max_memory'] + "G -jar " + snpsift_jar + " annotate " + clinvar_path + " " + annotated_vcf_output_filename + "1 > " + annotated_vcf_output_filename + "2"
-	os.system(annotate_cmd)
-
-	os.remove(annotated_vcf_output_filename)
-	os.remove(annotated_vcf_output_filename + "1")
-	os.rename(annotated_vcf_output_filename + "2", annotated_vcf_output_filename)
-	return annotated_vcf_output_filename
+	def acceptNavigationRequest(self, url, navigation_type, is_main_frame):
+		if url.host() == karyogram.click_host:
+			url_query = QtCore.QUrlQuery(url)
+			self.bin_clicked.emit(url_query.queryItemValue('chrom', QtCore.QUrl.FullyDecoded), int(url_query.queryItemValue('bin')))
+			return False
+		return super().acceptNavigationRequest(url, navigation_type, is_main_frame)
 
 
-def database_encode(decompressed_file, variant_stats, metadata_dict):
+class BackgroundStatsSignals(QtCore.QObject):
 	"""
-	accepts as input a raw vcf file, and dictionaries for variant counts (variant_stats) and metadata
-	(metadata_dict). Then encodes them as tables into a database.
-	Returns filename of created sqlite database.
+	Carries statistics computed in a worker thread back to the interface.
+	computed gives the key of the statistics of filtered variants and either
+	the statistics or an error message, exact_computed the loaded file the
+	exact values of estimated statistics were computed for and either the
+	values or an error message.
 	"""
-	sqlite_output = sqlite3.connect(sqlite_output_name)
-	cursor = sqlite_connection.cursor()
-	cursor.execute("DROP TABLE IF EXISTS df;")
-	cursor.execute("DROP TABLE IF EXISTS stats;")
-	cursor.execute("DROP TABLE IF EXISTS metadata;")
-	cursor.execute("DROP TABLE IF EXISTS chrom_genes;")
-	cursor.execute("DROP TABLE IF EXISTS previous_annotation_requests;")
-	sqlite_output.commit()
-
-	# write each entry from metadata_dict to a new "metadata" table in database
-	for metadata_line_nb in metadata_dict:
-		metadata_tag = str(metadata_dict[metadata_line_nb][1])
-		metadata_result = str(metadata_dict[metadata_line_nb][2])
-		if not metadata_tag.isupper():
-			metadata_line = {'Tag': metadata_tag, 'Result': metadata_result}
-			metadata_line = pd.DataFrame(
-				metadata_line, index=[metadata_line_nb])
-
-			metadata_line.to_sql('metadata', sqlite_output, if_exists='append', index=False)
-
-	# write each entry to a new "stats" table in database
-	stat_table_index = 0
-	for key, value in variant_stats.items():
-		key = str(key)
-		value = str(value)
-		if len(key) > 40:
-			key = key[:40] + "..."
-		if len(value) > 200:
-			value = value[:200] + "..."
-		variant_stats_line = {'Tag': key, 'Result': value}
-		variant_stats_line = pd.DataFrame(
-			variant_stats_line, index=[stat_table_index])
-
-		variant_stats_line.to_sql('stats', sqlite_output, if_exists='append', index=False)
-		stat_table_index += 1
-
-	# chunked_vcf_len = sum(1 for row in open(decompressed_file, 'r'))
-
-	# PARSE INFO COLUMNS
-	# the info column of a vcf is long and hard to read if
-	# displayed as is, but it is composed of multiple key:value tags
-	# that we can parse as new columns, making them filterable.
-	global info_cols_to_add
-	info_cols_to_add = set()
-	chunked_vcf = pd.read_csv(decompressed_file,
-							  sep="\t",
-							  # skip rows that started with "#"
-							  skiprows=range(0, metadata_num - 1),
-							  # use chunk size that was set in settings
-							  chunksize=int(config['vcf_chunk_size']),
-							  low_memory=False,
-							  # make default data type an object (ie. string)
-							  dtype=object)
-
-	# Run through every chunk of the whole VCF and get the key out of the
-	# key:value pair and add to a set (so no duplicates will be added) that
-	# will later become new column names
-	for chunk in chunked_vcf:
-		for line in chunk["INFO"]:
-			if ";" in line:
-				line_split = line.split(";")
-				for col in line_split:
-					col_to_add = col.split("=")[0]
-					info_cols_to_add.add(col_to_add)
-
-	anno_info_cols_to_add = []
-	with open(decompressed_file, 'r') as vcf_read_obj:
-		for line in vcf_read_obj:
-			if not line.startswith('#'):
-				break
+	computed = QtCore.pyqtSignal(object, object, object)
+	exact_computed = QtCore.pyqtSignal(object, object, object)
 
-			if line.startswith('##INFO=<ID=ANN'):
-				line = line.split("Functional annotations: '")[1]
-				line = line.split("|")
-				for col in line:
-					col = col.replace('"', "")
-					col = col.replace('>', "")
-					col = col.replace("'", '')
-					col = re.sub('^\s+', '', col)
-					col = re.sub('\s+$', '', col)
-					anno_info_cols_to_add.append(col)
-
-	chunked_vcf = pd.read_csv(decompressed_file,
-							  sep="\t",
-							  skiprows=range(0, metadata_num - 1),
-							  chunksize=int(config['vcf_chunk_size']),
-							  low_memory=False,
-							  # make default data type an object (ie. string)
-							  dtype=object)
-
-	for chunk in chunked_vcf:
-		# set the new info column names to be empty by default
-		for col in info_cols_to_add:
-			chunk[col] = "."
-
-		line_nb = 0
-		for line in chunk["INFO"]:
-			# split the INFO column by ; which separates the different
-			# key:value pairs
-			if ";" in line:
-				line_split = line.split(";")
-				# get both sides of the = to get the key and the value
-				for col in line_split:
-					col_split = col.split("=")
-					key_to_add = col_split[0]
-					# col_split will be greater than 1 if there is an = sign
-					# a = means there is a key:value pair to be extracted
-					if len(col_split) > 1:
-						data_to_add = col_split[1]
-						chunk[key_to_add].values[line_nb] = data_to_add
-					# if there is no = sign then there is no key:value pair just
-					# a tag so set it tag as a boolean column
-					else:
-						chunk[key_to_add].values[line_nb] = "True"
-			line_nb += 1
-
-		# Get rid of INFO column now that it exists as multiple columns
-		chunk = chunk.drop(columns=['INFO'])
-
-		if len(anno_info_cols_to_add) > 0:
-			for col in anno_info_cols_to_add:
-				chunk[col] = "."
-
-		line_nb = 0
-		if "ANN" in chunk:
-			for line in chunk["ANN"]:
-				line_split = line.split("|")
-				for col_num in range(0, len(anno_info_cols_to_add)):
-					current_col = anno_info_cols_to_add[col_num]
-					if len(line_split) > col_num:
-						chunk[current_col].values[line_nb] = line_split[col_num]
-				line_nb += 1
-
-			chunk = chunk.drop(columns=['ANN'])
-
-		# Rename column so we get 'CHROM' not '#CHROM' from chunk.keys()
-		chunk.rename(columns={'#CHROM': 'CHROM'}, inplace=True)
-
-		# To fix sorting problems
-		chunk['CHROM'] = chunk['CHROM'].replace('1', '01')
-		chunk['CHROM'] = chunk['CHROM'].replace('2', '02')
-		chunk['CHROM'] = chunk['CHROM'].replace('3', '03')
-		chunk['CHROM'] = chunk['CHROM'].replace('4', '04')
-		chunk['CHROM'] = chunk['CHROM'].replace('5', '05')
-		chunk['CHROM'] = chunk['CHROM'].replace('6', '06')
-		chunk['CHROM'] = chunk['CHROM'].replace('7', '07')
-		chunk['CHROM'] = chunk['CHROM'].replace('8', '08')
-		chunk['CHROM'] = chunk['CHROM'].replace('9', '09')
-
-		# SET COLS WITH NUMBERS TO BE NUMERIC TYPE
-		# set columns that only contain numbers to be numeric dtype
-		# otherwise they are just strings, and can't be used with a
-		# dash separated filter
-
-		# make a list from all column names, we will later remove the
-		# non-numeric columns from the list
-		global numeric_columns
-		numeric_columns = list(chunk.keys())
-		#
-		chunk = chunk.replace(".", np.NaN)
-
-		# run the function for every column to remove non-numeric columns
-		for column in chunk.keys():
-			set_col_to_numeric_if_isdigit(column, chunk, numeric_columns)
-
-		# convert the remaining columns in "numeric_columns" list to numeric datatype
-		for column in numeric_columns:
-			chunk[column] = pd.to_numeric(chunk[column])
-
-		chunk.to_sql('df', sqlite_output, if_exists='append', index=False)
-
-	return sqlite_output
 
+# limits of the cache of rendered variant graphics
+max_cached_graphics = 64
+max_cached_graphics_size = 32 * 1024 * 1024
 
 # Build graphical interface constructed in XML
 gui_window_object, gui_base_object = uic.loadUiType(MetGUIui)
@@ -759,14 +213,42 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		self.setWindowTitle("Metallaxis")
 		# initialise progress bar
 		self.MetallaxisProgress = MetallaxisProgress()
+		self.gene_prefetcher = None
+		# the variant graphic is drawn in one long-lived web view, created on first use
+		self.variant_svg_view = None
+		self.variant_svg = None
+		self.variant_graphic_started = None
+		# rendered variant graphics, most recently used last
+		self.variant_graphic_cache = OrderedDict()
+		self.karyogram_view = None
+		# statistics plots are drawn when their tab is shown, and cached as PNG
+		# per loaded file (counted by stat_plot_session) and chromosome
+		self.stat_plot_session = 0
+		self.shown_stat_plot_session = None
+		self.stat_plot_cache = {}
+		self.stat_var_counts = None
+		# the statistics tab shows either the whole file (stat_source None) or
+		# the variants matching the table filter, computed in the background once
+		# per loaded file and filter
+		self.file_stat_var_counts = None
+		self.stat_source = None
+		self.shown_stat_source = None
+		self.active_filter_query = None
+		self.filtered_stats_cache = {}
+		self.filtered_stats_executor = ThreadPoolExecutor(max_workers=1)
+		# jobs of the executor, and the connection of the running one, so that
+		# they can be stopped before another file is loaded
+		self.background_stats_jobs = []
+		self.background_stats_connection = None
+		self.filtered_stats_signals = BackgroundStatsSignals()
 
 		# Setup inital GUI
 		self.graphicsView.setMaximumHeight(0)
 		self.col_selection_scroll_area.setMaximumHeight(0)
 		self.tabWidget.setTabIcon(0,QIcon(os.path.join(current_file_dir, 'gui/logo.png')))
 		self.tabWidget.setTabIcon(1,QIcon(os.path.join(current_file_dir, 'gui/graph_icon.png')))
-		self.tabWidget.setTabIcon(2,QIcon(os.path.join(current_file_dir, 'gui/table.png')))
-		self.tabWidget.setTabIcon(3,QIcon(os.path.join(current_file_dir, 'gui/about.png')))
+		self.tabWidget.setTabIcon(self.tabWidget.indexOf(self.viewer_tab),QIcon(os.path.join(current_file_dir, 'gui/table.png')))
+		self.tabWidget.setTabIcon(self.tabWidget.indexOf(self.about_tab),QIcon(os.path.join(current_file_dir, 'gui/about.png')))
 
 		# Center GUI on screen
 		qt_rectangle = self.frameGeometry()
@@ -780,9 +262,20 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		self.col_selection_apply_btn.clicked.connect(self.select_columns)
 		self.deselect_all_cols_btn.clicked.connect(self.deselect_all_cols)
 		self.select_all_cols_btn.clicked.connect(self.select_all_cols)
+		self.filter_table_btn.clicked.connect(self.filter_table)
+		self.view_variant_btn.clicked.connect(self.generate_variant_graphic)
+		self.graphics_hide_view_btn.clicked.connect(self.hide_graphics_view)
+		self.graphics_reload_btn.clicked.connect(self.reload_generate_variant_graphic)
+		self.export_svg_toolbtn.clicked.connect(self.save_svg)
+		self.chrom_selection_stat_comboBox.currentTextChanged.connect(self.changed_chrom_stat_combobox)
+		self.tabWidget.currentChanged.connect(self.statistics_tab_changed)
+		self.filtered_stats_checkBox.stateChanged.connect(self.refresh_filtered_stats)
+		self.filtered_stats_signals.computed.connect(self.filtered_stats_computed)
+		self.filtered_stats_signals.exact_computed.connect(self.exact_stats_computed)
 		# menus on interface
 		self.actionOpen_VCF.triggered.connect(self.select_and_parse)
 		self.actionSave_Analysis.triggered.connect(self.save_analysis)
+		self.actionCompare_Sessions.triggered.connect(self.compare_sessions)
 		self.actionQuit.triggered.connect(self.close)
 
 		# Link "Github Page" button on menu to its URL
@@ -793,7 +286,7 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		self.actionGithub_Page.triggered.connect(open_github)
 
 		def open_about_tab():
-			self.tabWidget.setCurrentIndex(3)
+			self.tabWidget.setCurrentWidget(self.about_tab)
 
 		# set first tab as default
 		self.tabWidget.setCurrentIndex(0)
@@ -803,6 +296,8 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		self.MetallaxisSettings = MetallaxisSettings()
 
 		def show_settings_window():
+			self.MetallaxisSettings.show_ensembl_cache_info()
+			self.MetallaxisSettings.show_gene_models_info()
 			self.MetallaxisSettings.show()
 
 		self.actionSettings.triggered.connect(show_settings_window)
@@ -835,9 +330,10 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		save_dialog = QtWidgets.QFileDialog()
 		save_dialog.setAcceptMode(save_dialog.AcceptSave)
 		save_folder = save_dialog.getSaveFileName(self, 'Save variant view as vector image', filter="*.svg")[0]
-		if save_folder == "":
+		if save_folder == "" or self.variant_svg is None:
 		    return
-		copyfile(svg_output_name, save_folder)
+		with open(save_folder, 'w') as svg_write_obj:
+			svg_write_obj.write(self.variant_svg)
 
 	def save_analysis(self):
 		"""
@@ -848,6 +344,44 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		save_folder = save_dialog.getSaveFileName(self, 'Save Analayis as database', filter="*.sqlite")[0]
 		copyfile(sqlite_output_name, save_folder)
 
+	def compare_sessions(self):
+		"""
+		Compares the variants of the loaded file with those of saved analyses
+		chosen by the user, and shows the intersection, difference or union in
+		the table.
+		"""
+		if self.file_stat_var_counts is None:
+			throw_error_message("Open a VCF or a saved analysis to compare first")
+			return
+		compared_files = QtWidgets.QFileDialog.getOpenFileNames(self, 'Compare with Saved Analyses', filter="Metallaxis Database Files(*.sqlite)")[0]
+		if not compared_files:
+			return
+		comparison_choices = [("In this file and every chosen analysis", 'intersection'),
+							  ("In this file but no chosen analysis", 'difference'),
+							  ("In any of them, with a column per analysis", 'union')]
+		chosen_comparison, comparison_ok = QtWidgets.QInputDialog.getItem(self, "Compare Analyses", "Show the variants:",
+																		  [choice_label for choice_label, operation in comparison_choices], 0, False)
+		if not comparison_ok:
+			return
+		operation = dict(comparison_choices)[chosen_comparison]
+
+		session_names = [self.loaded_vcf_lineedit.text()] + compared_files
+		try:
+			# the compared analyses are attached to the loaded one, which is also
+			# where the table and overview read from
+			schemas = session_compare.attach_sessions(db_connection, compared_files)
+			compared_table = pd.read_sql_query(session_compare.comparison_query(operation, schemas, session_names), db_connection)
+		except (FileNotFoundError, sqlite3.Error, pd.io.sql.DatabaseError) as error_message:
+			throw_error_message("Comparison Error:\n" + str(error_message))
+			return
+		self.populate_table(compared_table)
+		self.filter_text.setText(chosen_comparison + " (" + ", ".join(os.path.basename(compared_file) for compared_file in compared_files) +
+								 "): " + str(len(compared_table)) + " variants")
+		# the statistics of the filtered variants are computed apart from the
+		# attached analyses, so those of the whole file are shown
+		self.active_filter_query = None
+		self.refresh_filtered_stats()
+
 	def select_file(self):
 		"""
 		Opens a file dialog where the user can chose an input file.
@@ -923,6 +457,9 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		else:
 			selected_file = cli_arg
 
+		# statistics of the previous file are computed on the database the new one replaces
+		self.cancel_background_stats()
+
 		load_session = False
 		if selected_file.endswith(".sqlite"):
 			load_session = True
@@ -937,21 +474,86 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 
 		if not load_session:
 
+			ingest_pipeline = pipeline.Pipeline(config, GuiPipelineHooks(), sqlite_output_name)
 			# get metadata and variant counts from vcf
 			if config['auto_annotate']:
-				if not already_annotated(selected_vcf):
-					selected_vcf = annotate_vcf(selected_vcf)
+				if not pipeline.already_annotated(selected_vcf):
+					selected_vcf = ingest_pipeline.annotate_vcf(selected_vcf)
 
 			# parse vcf, convert to a database, and write database data to interface
-			metadata_dict, var_counts, decompressed_file = parse_vcf(selected_vcf)
+			metadata_dict, var_counts, decompressed_file = ingest_pipeline.parse_vcf(selected_vcf)
 			global db_connection
-			db_connection = database_encode(decompressed_file, var_counts, metadata_dict)
+			db_connection = ingest_pipeline.database_encode(decompressed_file, var_counts, metadata_dict)
 			loaded_database = pd.read_sql("SELECT * FROM df", db_connection)
 			self.write_database_to_interface(loaded_database)
 
 		# populate table
 		self.populate_table(loaded_database)
+		self.show_karyogram()
+
+		# fetch genes around the loaded variants while the user browses
+		# graphics rendered from the previous file no longer apply
+		self.variant_graphic_cache.clear()
+		self.start_gene_prefetch(loaded_database)
+
+	def start_gene_prefetch(self, loaded_database):
+		"""
+		Starts filling the ENSEMBL response cache with the genes around every
+		variant of the loaded database in the background, stopping any prefetch
+		that was running for a previously loaded file.
+		"""
+		if self.gene_prefetcher is not None:
+			self.gene_prefetcher.stop()
+			self.gene_prefetcher = None
+
+		# nothing to fetch when genes are read from imported gene models
+		if not config.get('prefetch_genes', True) or os.path.isfile(gene_models_path):
+			return
 
+		windows_to_prefetch = []
+		variant_positions = pd.to_numeric(loaded_database['POS'], errors='coerce')
+		for chrom, chrom_positions in variant_positions.groupby(loaded_database['CHROM']):
+			chrom_positions = chrom_positions.dropna().astype(int)
+			for window_start, window_stop in gene_prefetch.covering_windows(chrom_positions):
+				windows_to_prefetch.append((pipeline.ensembl_chrom_name(chrom), window_start, window_stop))
+
+		self.gene_prefetcher = gene_prefetch.GenePrefetcher(ensembl_response_cache, ensembl_api, config['organism'],
+															config['genome_version'], windows_to_prefetch)
+		self.gene_prefetcher.start()
+
+
+	def show_karyogram(self):
+		"""
+		Draws the karyogram of the loaded database in the overview tab, creating
+		its web view the first time.
+		"""
+		if self.karyogram_view is None:
+			self.karyogram_view = QWebEngineView()
+			karyogram_page = KaryogramPage(self.karyogram_view)
+			karyogram_page.bin_clicked.connect(self.show_karyogram_bin)
+			self.karyogram_view.setPage(karyogram_page)
+			self.karyogram_layout.addWidget(self.karyogram_view)
+		karyogram_svg = karyogram.karyogram_svg(db_connection)
+		self.karyogram_view.setContent(QtCore.QByteArray(karyogram_svg.encode('UTF-8')), "image/svg+xml")
+
+	def show_karyogram_bin(self, chrom, bin_nb):
+		"""
+		Filters the table to the variants of a karyogram bin, and draws them in
+		the variant graphic.
+		"""
+		bin_start, bin_end = karyogram.bin_region(bin_nb)
+		self.sql_mode_checkBox.setChecked(True)
+		self.filter_lineedit.setText("SELECT * FROM df WHERE CHROM == '" + chrom.replace("'", "''") + "' AND POS BETWEEN " +
+									 str(bin_start) + " AND " + str(bin_end) + ";")
+		self.filter_table()
+		self.tabWidget.setCurrentWidget(self.viewer_tab)
+		if self.viewer_tab_table_widget.rowCount() == 0:
+			return
+		self.viewer_tab_table_widget.setCurrentCell(0, 0)
+		self.viewer_tab_table_widget.selectAll()
+		self.graphics_min_pos_textin.setText(str(bin_start))
+		self.graphics_max_pos_textin.setText(str(bin_end))
+		self.generate_variant_graphic(True)
 
 	def hide_graphics_view(self):
 		self.graphicsView.setMaximumHeight(0)
@@ -973,11 +575,41 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		self.generate_variant_graphic(True)
 
 
+	def show_variant_svg(self, variant_svg):
+		"""
+		Displays an SVG document in the variant graphic's web view, creating the
+		view the first time, and keeps it for exporting.
+		"""
+		self.variant_svg = variant_svg
+		if self.variant_svg_view is None:
+			self.variant_svg_view = QWebEngineView()
+			self.variant_svg_view.setMaximumHeight(200)
+			self.variant_svg_view.loadFinished.connect(self.variant_graphic_loaded)
+			self.graphicsView_layout.addWidget(self.variant_svg_view)
+
+		variant_svg = variant_svg.encode('UTF-8')
+		# setContent is limited to 2Mb, so bigger graphics are loaded from a file
+		if len(variant_svg) < 2 * 1024 * 1024 - 1024:
+			self.variant_svg_view.setContent(QtCore.QByteArray(variant_svg), "image/svg+xml")
+		else:
+			large_svg_file = os.path.join(config['working_dir'], 'variant_graphic.svg')
+			with open(large_svg_file, 'wb') as svg_write_obj:
+				svg_write_obj.write(variant_svg)
+			self.variant_svg_view.load(QtCore.QUrl.fromLocalFile(os.path.abspath(large_svg_file)))
+
+	def variant_graphic_loaded(self, load_ok):
+		if self.variant_graphic_started is None:
+			return
+		redraw_ms = (time.perf_counter() - self.variant_graphic_started) * 1000
+		self.variant_graphic_started = None
+		self.statusbar.showMessage("Variant graphic drawn in " + str(round(redraw_ms)) + " ms", 5000)
+
 	def generate_variant_graphic(self, read_pos_input=False):
 		current_row = self.viewer_tab_table_widget.currentRow()
 		# if no row selected then stop function
 		if current_row == -1:
 			return
+		self.variant_graphic_started = time.perf_counter()
 
 		# if multiple selected rows, make a list of them
 		current_rows = set()
@@ -987,6 +619,10 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		# SVG Setup
 		varScene = SVGClasses.Scene('variant_scene')
 		line_length = 650
+		# variant glyphs are 16 pixels wide, beyond this many they overlap into a blur
+		variant_glyph_width = 16
+		density_bin_width = 5
+		max_gene_lanes = 5
 		varScene.add(SVGClasses.Line((50, 100), (line_length + 50, 100)))
 
 		# Verify only one chromosome in selected rows
@@ -1005,8 +641,7 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 
 
 
-		my_query = "SELECT * FROM df where CHROM =='" + str(current_chr) + "'"
-		chrom_data = pd.read_sql(my_query, db_connection)
+		chrom_min_pos = db_connection.execute("SELECT MIN(POS) FROM df WHERE CHROM = ?;", (str(current_chr),)).fetchone()[0]
 
 		def get_default_min_max(current_pos):
 			"""
@@ -1018,11 +653,11 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 			if (current_pos / 2) < 2500000:
 				min_pos = (current_pos / 2)
 				max_pos = current_pos + (current_pos / 2)
-			elif (current_pos - 2500000) > chrom_data['POS'].min():
+			elif (current_pos - 2500000) > chrom_min_pos:
 				min_pos = (current_pos - (2500000 - 1))
 				max_pos = (current_pos + (2500000 - 1))
 			else:
-				min_pos = chrom_data['POS'].min()
+				min_pos = chrom_min_pos
 				max_pos = min_pos + (5000000 - 1)
 
 			min_pos = int(float(min_pos))
@@ -1061,64 +696,75 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		self.graphics_max_pos_textin.setText(str(min_pos))
 		self.graphics_min_pos_textin.setText(str(max_pos))
 
-		def get_ENSEMBL_annotation(min_pos, max_pos, current_chr):
-			# if chrom '01' then flatten to '1' so works with the API
-			if is_number_bool(current_chr):
-				current_chr = str(int(current_chr))
-
-			api_request_str = "https://rest.ensembl.org/overlap/region/" + config['organism'] + "/" + current_chr + ":" + str(min_pos) + "-" + str(max_pos) + "?feature=gene;"
+		# if chrom '01' then flatten to '1' so works with the API
+		ensembl_chr = pipeline.ensembl_chrom_name(current_chr)
 
-			def request_ensembl_gene_pos():
-				api_request = requests.get(api_request_str, headers={"Content-Type": "application/json"})
-				if not api_request.ok:
-					throw_error_message(
-						"ENSEMBLE rejected API Call, please try a smaller nucleotide range, or verify internet access")
+		def get_ENSEMBL_annotation(min_pos, max_pos, current_chr):
+			# use the responses cached by previous sessions, and only ask ENSEMBL for the rest
+			genes, remote_gaps = ensembl_response_cache.lookup(config['organism'], config['genome_version'], current_chr, min_pos, max_pos)
+			if remote_gaps:
+				try:
+					remote_genes = ensembl_api.overlap_genes_many(config['organism'], current_chr, remote_gaps)
+				except ensembl_client.EnsemblError as error_message:
+					# draw the variants without genes rather than blocking on a dialog
+					print("Warning: " + str(error_message))
+					self.statusbar.showMessage("Genes unavailable: " + str(error_message), 10000)
 					return False
-				else:
-					return api_request
-
-			ensembl_gene_pos_req = request_ensembl_gene_pos()
-			if ensembl_gene_pos_req:
-				sqlite_output = sqlite3.connect(sqlite_output_name)
-				previous_annotation_requests = {'start': [min_pos], 'stop': [max_pos]}
-				previous_annotation_requests = pd.DataFrame.from_dict(previous_annotation_requests)
-				previous_annotation_requests.to_sql('previous_annotation_requests', sqlite_output, if_exists='append', index=True)
-
-				# if we got any data back from ENSEMBL
-				if len(ensembl_gene_pos_req.json()) > 0:
-					ensembl_gene_pos_df = pd.DataFrame.from_dict(ensembl_gene_pos_req.json())
-					ensembl_gene_pos_df['chrom'] = current_chr
-					ensembl_gene_pos_df.to_sql('chrom_genes', sqlite_output, if_exists='append', index=True)
-
-
-		# check if gene location is already in db
-		# it runs this sql command first as trying to select form no table results in error
-		chrom_genes_empty_bool = pd.read_sql(
-			"SELECT name FROM sqlite_master WHERE type='table' AND name='chrom_genes';", db_connection).empty
-		if chrom_genes_empty_bool:
-			get_ENSEMBL_annotation(min_pos, max_pos, current_chr)
-
-		# if table exists, see if gene location exists in table
+				for (gap_start, gap_stop), gap_genes in zip(remote_gaps, remote_genes):
+					ensembl_response_cache.store(config['organism'], config['genome_version'], current_chr, gap_start, gap_stop, gap_genes)
+					genes += gap_genes
+
+			sqlite_output = sqlite3.connect(sqlite_output_name)
+			# if we got any data back from ENSEMBL
+			if len(genes) > 0:
+				gene_index.insert_genes(sqlite_output, current_chr, genes)
+
+			# only record the region as annotated once its genes are stored
+			interval_index.add_interval(sqlite_output, config['organism'], current_chr, min_pos, max_pos)
+			sqlite_output.close()
+			return True
+
+		if os.path.isfile(gene_models_path):
+			# read genes from the imported gene models, without any network access
+			gene_connection = sqlite3.connect(gene_models_path)
 		else:
-			# if no table previous_annotation_requests table exists then annotate
-			previous_annotation_empty_bool = pd.read_sql(
-				"SELECT name FROM sqlite_master WHERE type='table' AND name='previous_annotation_requests';", db_connection).empty
-			if previous_annotation_empty_bool:
-				get_ENSEMBL_annotation(min_pos, max_pos, current_chr)
-
-			# if table exists then check if already annotated
+			gene_connection = db_connection
+
+		table_column_dict = {}
+		for column_nb in range(self.viewer_tab_table_widget.columnCount()):
+			table_column_dict[self.viewer_tab_table_widget.horizontalHeaderItem(column_nb).text()] = column_nb
+
+		# a graphic only changes with its region, the drawn fields of the
+		# selected variants, and the genes known in the region
+		drawn_columns = [table_column_dict[column] for column in ('POS', 'ID', 'REF', 'ALT', 'Annotation_Impact', 'Annotation')
+						 if column in table_column_dict]
+		selection_hash = hash(tuple(sorted(tuple(self.viewer_tab_table_widget.item(current_row, column_nb).text() for column_nb in drawn_columns)
+										   for current_row in current_rows)))
+		def graphic_key():
+			if gene_connection is db_connection:
+				gene_version = gene_index.index_version(gene_connection)
 			else:
-				previous_annotation_requests = pd.read_sql('SELECT start,stop from previous_annotation_requests;', db_connection)
-				already_annotated = False
-				for index, line in previous_annotation_requests.iterrows():
-					for current_pos in list_of_selected_pos:
-						# if current position is between a previously annotated range
-						if int(line['start']) <= int(current_pos) <= int(line['stop']):
-							already_annotated = True
+				gene_version = (os.path.getmtime(gene_models_path), gene_index.index_version(gene_connection))
+			return current_chr, min_pos, max_pos, selection_hash, gene_version
 
-				if not already_annotated:
-				  get_ENSEMBL_annotation(min_pos, max_pos, current_chr)
+		# graphics are only cached once their region's genes were all fetched, so
+		# a cached graphic is shown without looking for missing genes
+		self.graphics_chr_label.setText(str(current_chr))
+		cached_graphic_key = graphic_key()
+		if cached_graphic_key in self.variant_graphic_cache:
+			self.variant_graphic_cache.move_to_end(cached_graphic_key)
+			self.show_variant_svg(self.variant_graphic_cache[cached_graphic_key])
+			self.show_graphics_view()
+			return
 
+		genes_fetched = True
+		if gene_connection is db_connection:
+			# only request the parts of the region that haven't already been annotated
+			for gap_start, gap_stop in interval_index.uncovered_gaps(db_connection, config['organism'], ensembl_chr, min_pos, max_pos):
+				# stop at the first failed request rather than warning once per gap
+				if not get_ENSEMBL_annotation(gap_start, gap_stop, ensembl_chr):
+					genes_fetched = False
+					break
 
 		def rel_position_on_line(position):
 			"""return SVG position to place variant"""
@@ -1144,89 +790,93 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 			# min_pos = int(self.graphics_max_pos_textin.text())
 			# max_pos = int(self.graphics_min_pos_textin.text())
 
-		alleles_to_draw = []
-		my_query = "SELECT external_name,start,end,biotype,description FROM (SELECT DISTINCT gene_id,external_name,start,end,biotype,description FROM chrom_genes WHERE gene_id <> '' and start >= %d and end <= %d);" % (
-		min_pos, max_pos)
-		alleles_list = pd.read_sql(my_query, db_connection)
-		if not alleles_list.empty:
-			allele_nb = 0
-			for index, line in alleles_list.iterrows():
-
-				start_pos_on_line = rel_position_on_line(line['start'])
-				if start_pos_on_line < 50:
-					start_pos_on_line = 50
-
-				end_pos_on_line = rel_position_on_line(line['end'])
-				if end_pos_on_line > (line_length + 50):
-					end_pos_on_line = line_length + 50
-
-				if not 'biotype' in line:
-				    line['biotype'] = None
-
-				if not 'description' in line:
-				    line['description'] = None
-
-				new_allele = SVGClasses.Allele(rel_position_on_line(line['start']), end_pos_on_line, line['external_name'], line['biotype'],line['description'], allele_nb)
-
-				# add allele to list thatll be added to SVG
-				alleles_to_draw.append(new_allele)
-
-				# this means alleles get all the colors
-				allele_nb += 1
-				if allele_nb > 4:
-					allele_nb = 0
-
-
-		self.empty_qt_layout(self.graphicsView_layout)
-		self.graphics_chr_label.setText(str(current_chr))
-
+		alleles_list = pd.DataFrame(gene_index.query_genes(gene_connection, ensembl_chr, min_pos, max_pos),
+									columns=['external_name', 'start', 'end', 'biotype', 'description'])
+		gene_extents = []
+		for index, line in alleles_list.iterrows():
+			start_pos_on_line = max(50, rel_position_on_line(line['start']))
+			end_pos_on_line = min(line_length + 50, rel_position_on_line(line['end']))
+			# genes too small to see are left out
+			if end_pos_on_line - start_pos_on_line >= 9:
+				gene_extents.append((start_pos_on_line, end_pos_on_line, line))
+
+		# overlapping genes are drawn in separate lanes, each gene once
+		gene_lanes = SVGClasses.pack_lanes([(start, end) for start, end, line in gene_extents], max_gene_lanes)
+		for allele_nb, ((start_pos_on_line, end_pos_on_line, line), lane) in enumerate(zip(gene_extents, gene_lanes)):
+			# cycle through the colors so neighbouring genes differ
+			varScene.add(SVGClasses.Allele(start_pos_on_line, end_pos_on_line, line['external_name'], line['biotype'],
+										   line['description'], allele_nb % 5, lane))
+		if gene_lanes:
+			varScene.height += max(gene_lanes) * SVGClasses.lane_height
+
+		variants_to_draw = []
 		for current_row in current_rows:
-			table_column_dict = {}
-			for column_nb in range(self.viewer_tab_table_widget.columnCount()):
-				table_column_dict[self.viewer_tab_table_widget.horizontalHeaderItem(column_nb).text()] = column_nb
-
 			current_pos = int(self.viewer_tab_table_widget.item(current_row, table_column_dict['POS']).text())
-			current_id = self.viewer_tab_table_widget.item(current_row, table_column_dict['ID']).text()
-			current_ref = self.viewer_tab_table_widget.item(current_row, table_column_dict['REF']).text()
-			current_alt = self.viewer_tab_table_widget.item(current_row, table_column_dict['ALT']).text()
+			# only variants within the displayed region are drawn
+			if current_pos < min_pos or current_pos > max_pos:
+				continue
 			if 'Annotation_Impact' in table_column_dict:
 				current_impact = self.viewer_tab_table_widget.item(current_row, table_column_dict['Annotation_Impact']).text()
 			else:
 				current_impact = None
-			if 'Annotation' in table_column_dict:
-				current_annotation = self.viewer_tab_table_widget.item(current_row, table_column_dict['Annotation']).text()
-				if current_annotation == ".":
+			variants_to_draw.append((current_row, current_pos, current_impact))
+
+		if len(variants_to_draw) > line_length // variant_glyph_width:
+			# too many variants for their glyphs to be told apart, so draw their density instead
+			impact_rank = {"HIGH": 3, "MODERATE": 2, "LOW": 1, "MODIFIER": 1}
+			impact_colors = {3: [255, 0, 0], 2: [230, 200, 0], 1: [0, 160, 0], 0: [120, 120, 120]}
+			nb_bins = line_length // density_bin_width
+			bin_counts = [0] * nb_bins
+			bin_impacts = [0] * nb_bins
+			for current_row, current_pos, current_impact in variants_to_draw:
+				bin_nb = min(nb_bins - 1, int((rel_position_on_line(current_pos) - 50) // density_bin_width))
+				bin_counts[bin_nb] += 1
+				bin_impacts[bin_nb] = max(bin_impacts[bin_nb], impact_rank.get(current_impact, 0))
+
+			max_bin_count = max(bin_counts)
+			for bin_nb, bin_count in enumerate(bin_counts):
+				if bin_count == 0:
+					continue
+				bin_start = min_pos + (max_pos - min_pos) * bin_nb // nb_bins
+				bin_end = min_pos + (max_pos - min_pos) * (bin_nb + 1) // nb_bins
+				bar_height = 5 + round(30 * bin_count / max_bin_count)
+				bar_label = str(bin_count) + " variants (" + str(bin_start) + "-" + str(bin_end) + ")"
+				varScene.add(SVGClasses.DensityBar(50 + bin_nb * density_bin_width, density_bin_width, bar_height, bar_label,
+												   impact_colors[bin_impacts[bin_nb]]))
+		else:
+			for current_row, current_pos, current_impact in variants_to_draw:
+				current_id = self.viewer_tab_table_widget.item(current_row, table_column_dict['ID']).text()
+				current_ref = self.viewer_tab_table_widget.item(current_row, table_column_dict['REF']).text()
+				current_alt = self.viewer_tab_table_widget.item(current_row, table_column_dict['ALT']).text()
+				if 'Annotation' in table_column_dict:
+					current_annotation = self.viewer_tab_table_widget.item(current_row, table_column_dict['Annotation']).text()
+					if current_annotation == ".":
+						current_annotation = None
+				else:
 					current_annotation = None
-			else:
-				current_annotation = None
-
 
-			te_pos = rel_position_on_line(current_pos)
+				te_pos = rel_position_on_line(current_pos)
 
-			if current_id == ".":
-				current_id = str(current_pos) + "\n" + current_ref + "→" + current_alt
+				if current_id == ".":
+					current_id = str(current_pos) + "\n" + current_ref + "→" + current_alt
 
-			if current_alt.startswith('<INS'):
-				varScene.add(SVGClasses.TE(te_pos, current_id, current_impact, current_annotation, "ins"))
-			if current_alt.startswith('<DEL'):
-				varScene.add(SVGClasses.TE(te_pos, current_id, current_impact, current_annotation, "del"))
-			else:
-				varScene.add(SVGClasses.TE(te_pos, current_id, current_impact, current_annotation))
-
-			if len(alleles_to_draw) > 0:
-				for allele in alleles_to_draw:
-					if allele.getWidth() < 9:
-						alleles_to_draw.remove(allele)
-
-				for allele in alleles_to_draw:
-					varScene.add(allele)
-
-		varScene.write_svg(svg_output_name)
-		abs_svg_output_name = os.path.abspath(svg_output_name)
-		interactive_svg_widg = QWebEngineView()
-		self.graphicsView_layout.addWidget(interactive_svg_widg)
-		interactive_svg_widg.load(QtCore.QUrl.fromUserInput(abs_svg_output_name))
-		interactive_svg_widg.setMaximumHeight(200)
+				if current_alt.startswith('<INS'):
+					varScene.add(SVGClasses.TE(te_pos, current_id, current_impact, current_annotation, "ins"))
+				elif current_alt.startswith('<DEL'):
+					varScene.add(SVGClasses.TE(te_pos, current_id, current_impact, current_annotation, "del"))
+				else:
+					varScene.add(SVGClasses.TE(te_pos, current_id, current_impact, current_annotation))
+
+		variant_svg = varScene.svg_string()
+		if genes_fetched:
+			# fetched genes change the gene index version, which the next lookup of
+			# this graphic will have
+			self.variant_graphic_cache[graphic_key()] = variant_svg
+		# evict the least recently shown graphics past the cache's size limits
+		while len(self.variant_graphic_cache) > max_cached_graphics or \
+				sum(len(cached_svg) for cached_svg in self.variant_graphic_cache.values()) > max_cached_graphics_size:
+			self.variant_graphic_cache.popitem(last=False)
+		self.show_variant_svg(variant_svg)
 		self.show_graphics_view()
 
 
@@ -1248,6 +898,7 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 				throw_error_message("Filter Error:\n" + str(error_message))
 				return
 			filter_text_to_set = filter_text
+			filter_query = filter_text
 
 		else:
 			# remove leading / trailing whitespace from request
@@ -1307,19 +958,24 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 			elif filter_text == "":
 				filtered_table = pd.read_sql_query("SELECT * from df", sqlite_connection)
 				self.populate_table(filtered_table)
+				self.active_filter_query = None
+				self.refresh_filtered_stats()
 				return
 
 			else:
 				filter_text_to_set = "Filtering to show " + selected_filter + ": " + str(filter_text)
 				filter_condition = selected_filter + "==" + filter_text + ";"
 
+			filter_query = "SELECT * from df where " + filter_condition
 			try:
-				filtered_table = pd.read_sql_query("SELECT * from df where " + filter_condition, sqlite_connection)
+				filtered_table = pd.read_sql_query(filter_query, sqlite_connection)
 			except (TypeError, pd.io.sql.DatabaseError) as error_message:
 				throw_error_message("Filter Error:\n" + str(error_message))
 				return
 		self.populate_table(filtered_table)
 		self.filter_text.setText(filter_text_to_set)
+		self.active_filter_query = filter_query
+		self.refresh_filtered_stats()
 
 
 	def write_database_to_interface(self, loaded_database):
@@ -1340,6 +996,7 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		self.view_variant_btn.setEnabled(True)
 		self.chrom_selection_stat_comboBox.setEnabled(True)
 		self.chrom_selection_label.setEnabled(True)
+		self.filtered_stats_checkBox.setEnabled(True)
 
 		# get column numbers for ID, POS, etc.
 		self.progress_bar(47, "Extracting column data")
@@ -1363,7 +1020,7 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 			sql_request = "SELECT sum(length('%s')) FROM df;" % (col)
 			col_counts = pd.read_sql(sql_request, sqlite_connection)
 			for key,value in col_counts.iterrows():
-				if is_number_bool(value[0]):
+				if pipeline.is_number_bool(value[0]):
 					if int(value[0]) == 0:
 						empty_cols.append(col)
 
@@ -1389,80 +1046,261 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		# self.empty_qt_layout(self.dynamic_stats_value_label)
 		# self.empty_qt_layout(self.dynamic_stats_key_label)
 		self.empty_qt_layout(self.stat_plot_layout)
-
-		self.filter_table_btn.clicked.connect(self.filter_table)
-		self.view_variant_btn.clicked.connect(self.generate_variant_graphic)
-		self.graphics_hide_view_btn.clicked.connect(self.hide_graphics_view)
-		self.graphics_reload_btn.clicked.connect(self.reload_generate_variant_graphic)
-		self.export_svg_toolbtn.clicked.connect(self.save_svg)
+		self.empty_qt_layout(self.chrom_stat_plot_layout)
 
 		metadata_sql_result = pd.read_sql_query("SELECT DISTINCT Tag,Result FROM metadata", sqlite_connection)
 		for i in range(0, len(metadata_sql_result)):
 			self.dynamic_metadata_label_tags.addWidget(QtWidgets.QLabel(metadata_sql_result['Tag'][i], self))
 			self.dynamic_metadata_label_results.addWidget(QtWidgets.QLabel(metadata_sql_result['Result'][i], self))
 
-		var_counts = {}
-		stats_sql_result = pd.read_sql_query("SELECT * FROM stats", sqlite_connection)
-		for i in range(0, len(stats_sql_result)):
-			var_counts_key = stats_sql_result['Tag'][i]
-			var_counts_value = stats_sql_result['Result'][i]
-			var_counts[var_counts_key] = var_counts_value
-
-		self.progress_bar(49, "Plotting Statistics")
-
-		if "ALT_Types" in var_counts:
-			ALT_Types = eval(var_counts["ALT_Types"])
-			# plot piechart of proportions of types of ALT
-			# get the value for each ALT_Types key in order, per type of Alt so it can be graphed
-			alt_values_to_plot = []
-			for alt in ALT_Types:
-				dict_key = alt + "_Alt_Count"
-				alt_values_to_plot.append(eval(var_counts[dict_key]))
-
-			alt_types_clean_label = [str(alt_type).replace('<', '').replace('>', '') for alt_type in ALT_Types]
-			total_figure = plt.figure()
-			graph = total_figure.add_subplot(111)
-			graph.pie(alt_values_to_plot, labels=alt_types_clean_label, autopct='%1.1f%%')
-			# set x and y axes to be equal to get a perfect circle as a piechart
-			graph.axis('equal')
-			plt.title('Proportion of different mutations')
-			total_figure.tight_layout()
-			graph.legend()
-			self.stat_plot_layout.addWidget(FigureCanvas(total_figure))
+		# plots are only drawn once the statistics tab is shown, and the plots and
+		# statistics of filters of the previous file are discarded
+		self.stat_plot_session += 1
+		self.stat_plot_cache.clear()
+		self.filtered_stats_cache.clear()
+		self.active_filter_query = None
+		self.file_stat_var_counts = vcf_stats.load_stat_values(sqlite_connection)
+		self.refresh_filtered_stats()
+		self.show_approximate_stats()
+
+	def submit_background_stats(self, compute_function):
+		"""
+		Runs compute_function(connection) in the background, on a connection of
+		its own to the session database, until cancel_background_stats() stops it.
+		"""
+		def run_background_stats():
+			# sqlite connections can't be shared between threads
+			stats_connection = sqlite3.connect(sqlite_output_name)
+			self.background_stats_connection = stats_connection
+			try:
+				compute_function(stats_connection)
+			finally:
+				self.background_stats_connection = None
+				stats_connection.close()
+
+		self.background_stats_jobs = [job for job in self.background_stats_jobs if not job.done()]
+		self.background_stats_jobs.append(self.filtered_stats_executor.submit(run_background_stats))
+
+	def cancel_background_stats(self):
+		"""
+		Stops the statistics computed in the background on the session database,
+		and waits for them to stop, before a new file replaces its tables.
+		"""
+		for job in self.background_stats_jobs:
+			job.cancel()
+		stats_connection = self.background_stats_connection
+		if stats_connection is not None:
+			try:
+				# makes the running query fail, which the job reports as an error
+				# that is ignored as it belongs to the previous file
+				stats_connection.interrupt()
+			except sqlite3.ProgrammingError:
+				# the job closed its connection in the meantime
+				pass
+		for job in self.background_stats_jobs:
+			if not job.cancelled():
+				job.exception()
+		self.background_stats_jobs = []
+
+	def show_approximate_stats(self, compute_exact=True):
+		"""
+		Shows the statistics that were estimated in approximate mode with their
+		error bounds, and, if compute_exact, computes their exact values in the
+		background if they aren't known yet.
+		"""
+		estimates = approximate_stats.load_estimates(sqlite_connection)
+		if not estimates:
+			self.approximate_stats_label.setText("")
+			return
+		estimate_lines = [approximate_stats.describe_estimate(*estimate) for estimate in estimates]
+		if compute_exact and any(estimate[4] is None for estimate in estimates):
+			estimate_lines.insert(0, "Estimated in approximate mode, computing exact values...")
+			stat_plot_session = self.stat_plot_session
+			exact_computed_signal = self.filtered_stats_signals.exact_computed
+
+			def compute_exact_stats(stats_connection):
+				try:
+					exact_computed_signal.emit(stat_plot_session, approximate_stats.exact_values(stats_connection), None)
+				except sqlite3.Error as error_message:
+					exact_computed_signal.emit(stat_plot_session, None, str(error_message))
+
+			self.submit_background_stats(compute_exact_stats)
+		self.approximate_stats_label.setText("\n".join(estimate_lines))
+
+	def exact_stats_computed(self, stat_plot_session, exact_values, error_message):
+		# exact values of a file that is no longer loaded are stored in its database
+		if stat_plot_session != self.stat_plot_session:
+			return
+		if error_message is not None:
+			self.approximate_stats_label.setText(self.approximate_stats_label.text().replace(
+				"computing exact values...", "could not compute exact values: " + error_message))
+			return
+		# values that can't be computed (e.g. no DP column) stay estimated
+		self.show_approximate_stats(compute_exact=False)
+
+	def show_stat_values(self, stat_source, var_counts):
+		"""
+		Shows the statistics of the whole file (stat_source None) or of the
+		variants matching a filter query in the statistics tab.
+		"""
+		self.stat_source = stat_source
+		self.stat_var_counts = var_counts
 
-		# plot piechart of proportions of types of ALT
-		# get the nb of mutations for each chromosome
 		if "List_Chromosomes" in var_counts:
-			values_to_plot = []
 			global list_chromosomes  # we're editing a global so it needs to be declared global again
-			list_chromosomes = eval(var_counts['List_Chromosomes'])
-			list_chromosomes = list(list_chromosomes)
-			for chrom in list_chromosomes:
-				dict_key = chrom + "_Chrom_Variant_Count"
-				if dict_key in var_counts:
-					values_to_plot.append(var_counts[dict_key])
+			list_chromosomes = list(var_counts['List_Chromosomes'])
+			plotted_chromosomes = sorted(chrom for chrom in list_chromosomes if chrom + "_Chrom_Variant_Count" in var_counts)
+			# don't draw a plot for every chromosome as the list is filled
+			self.chrom_selection_stat_comboBox.blockSignals(True)
+			self.chrom_selection_stat_comboBox.clear()
+			self.chrom_selection_stat_comboBox.addItems(plotted_chromosomes)
+			self.chrom_selection_stat_comboBox.blockSignals(False)
+
+		if self.tabWidget.currentWidget() is self.statistics_tab:
+			self.show_stat_plots()
+
+	def refresh_filtered_stats(self):
+		"""
+		Shows the statistics of the variants matching the active table filter if
+		asked to, computing them in the background unless they are cached, and
+		those of the whole file otherwise.
+		"""
+		if self.file_stat_var_counts is None:
+			return
+		if not self.filtered_stats_checkBox.isChecked() or self.active_filter_query is None:
+			self.stat_source_label.setText("Statistics of the whole file")
+			self.show_stat_values(None, self.file_stat_var_counts)
+			return
+
+		filter_key = (self.stat_plot_session, self.active_filter_query)
+		if filter_key in self.filtered_stats_cache:
+			self.show_filtered_stats(filter_key)
+			return
+
+		self.stat_source_label.setText("Computing statistics of the filtered variants...")
+		filter_query = self.active_filter_query
+		computed_signal = self.filtered_stats_signals.computed
+
+		def compute_filtered_stats(stats_connection):
+			try:
+				computed_signal.emit(filter_key, subset_stats.filtered_stat_values(stats_connection, filter_query), None)
+			except sqlite3.Error as error_message:
+				computed_signal.emit(filter_key, None, str(error_message))
+
+		self.submit_background_stats(compute_filtered_stats)
+
+	def filtered_stats_computed(self, filter_key, var_counts, error_message):
+		if error_message is not None:
+			if filter_key == (self.stat_plot_session, self.active_filter_query):
+				self.stat_source_label.setText("Could not compute statistics of the filtered variants: " + error_message)
+			return
+		self.filtered_stats_cache[filter_key] = var_counts
+		# results of filters that were replaced while they were computed are only cached
+		if self.filtered_stats_checkBox.isChecked() and filter_key == (self.stat_plot_session, self.active_filter_query):
+			self.show_filtered_stats(filter_key)
+
+	def show_filtered_stats(self, filter_key):
+		var_counts = self.filtered_stats_cache[filter_key]
+		nb_variants = var_counts.get("Total_SNP_Count", 0) + var_counts.get("Total_Indel_Count", 0)
+		self.stat_source_label.setText("Statistics of the " + str(nb_variants) + " variants matching the filter")
+		self.show_stat_values(filter_key[1], var_counts)
+
+	def plot_image(self, figure):
+		"""
+		Renders a matplotlib figure to PNG. Figures are made with Figure() rather
+		than pyplot, so nothing keeps them alive once rendered.
+		"""
+		FigureCanvasAgg(figure)
+		png_buffer = io.BytesIO()
+		figure.savefig(png_buffer, format='png')
+		return png_buffer.getvalue()
+
+	def show_plot_image(self, layout, png_image):
+		plot_pixmap = QtGui.QPixmap()
+		plot_pixmap.loadFromData(png_image, "PNG")
+		plot_label = QtWidgets.QLabel(self)
+		plot_label.setPixmap(plot_pixmap)
+		plot_label.setAlignment(QtCore.Qt.AlignCenter)
+		layout.addWidget(plot_label)
+
+	def cached_plot(self, plot_name, plot_function):
+		"""
+		Returns the PNG of a plot of the loaded file, drawing it with
+		plot_function only if it isn't cached yet.
+		"""
+		plot_key = (self.stat_plot_session, self.stat_source, plot_name)
+		if plot_key not in self.stat_plot_cache:
+			self.stat_plot_cache[plot_key] = self.plot_image(plot_function())
+		return self.stat_plot_cache[plot_key]
 
-			if values_to_plot != []:
-				total_figure = plt.figure()
+	def statistics_tab_changed(self, tab_index):
+		if self.tabWidget.widget(tab_index) is self.statistics_tab:
+			self.show_stat_plots()
+
+	def show_stat_plots(self):
+		"""
+		Draws the statistics plots of the loaded file, unless they are already
+		shown.
+		"""
+		if self.stat_var_counts is None or (self.shown_stat_plot_session, self.shown_stat_source) == (self.stat_plot_session, self.stat_source):
+			return
+		self.shown_stat_plot_session = self.stat_plot_session
+		self.shown_stat_source = self.stat_source
+		var_counts = self.stat_var_counts
+		self.empty_qt_layout(self.stat_plot_layout)
+
+		if isinstance(var_counts.get("ALT_Types"), set):
+			def plot_alt_types():
+				ALT_Types = sorted(var_counts["ALT_Types"])
+				# plot piechart of proportions of types of ALT
+				# get the value for each ALT_Types key in order, per type of Alt so it can be graphed
+				alt_values_to_plot = []
+				for alt in ALT_Types:
+					dict_key = alt + "_Alt_Count"
+					alt_values_to_plot.append(var_counts[dict_key])
+
+				alt_types_clean_label = [str(alt_type).replace('<', '').replace('>', '') for alt_type in ALT_Types]
+				total_figure = Figure()
 				graph = total_figure.add_subplot(111)
-				# convert items in values_to_plot to int, so that matplotlib orders them correctly
-				values_to_plot = [int(x) for x in values_to_plot]
-				graph_df = pd.Series(values_to_plot, index=list_chromosomes)
-				graph_df = graph_df.sort_index()
-				# graph_df graph_df.sort_values(column=""
-				graph.bar(graph_df.index, graph_df.values, tick_label=graph_df.index)
-				plt.title('Distribution of Mutations by Chromosome')
-				plt.xlabel('Chromosome')
-				plt.ylabel('Number of Variants')
+				graph.pie(alt_values_to_plot, labels=alt_types_clean_label, autopct='%1.1f%%')
+				# set x and y axes to be equal to get a perfect circle as a piechart
+				graph.axis('equal')
+				graph.set_title('Proportion of different mutations')
 				total_figure.tight_layout()
-				self.stat_plot_layout.addWidget(FigureCanvas(total_figure))
-				self.chrom_selection_stat_comboBox.addItems(graph_df.index)
+				graph.legend()
+				return total_figure
 
-		# setup variants by position graph for first chromosome in list
-		if list_chromosomes[0]:
-			self.changed_chrom_stat_combobox(list_chromosomes[0])
-		# if selected chromosome changes, create new graph for variants by position for chosen chromosome
-		self.chrom_selection_stat_comboBox.currentTextChanged.connect(self.changed_chrom_stat_combobox)
+			self.show_plot_image(self.stat_plot_layout, self.cached_plot("ALT_Types", plot_alt_types))
+
+		# get the nb of mutations for each chromosome
+		if "List_Chromosomes" in var_counts:
+			values_to_plot = {}
+			for chrom in list_chromosomes:
+				dict_key = chrom + "_Chrom_Variant_Count"
+				if dict_key in var_counts:
+					# convert to int, so that matplotlib orders them correctly
+					values_to_plot[chrom] = int(var_counts[dict_key])
+
+			if values_to_plot:
+				def plot_chromosomes():
+					total_figure = Figure()
+					graph = total_figure.add_subplot(111)
+					graph_df = pd.Series(values_to_plot)
+					graph_df = graph_df.sort_index()
+					graph.bar(graph_df.index, graph_df.values, tick_label=graph_df.index)
+					graph.set_title('Distribution of Mutations by Chromosome')
+					graph.set_xlabel('Chromosome')
+					graph.set_ylabel('Number of Variants')
+					total_figure.tight_layout()
+					return total_figure
+
+				self.show_plot_image(self.stat_plot_layout, self.cached_plot("List_Chromosomes", plot_chromosomes))
+
+		# variants by position graph for the selected chromosome
+		if self.chrom_selection_stat_comboBox.count() > 0:
+			self.changed_chrom_stat_combobox()
+		else:
+			self.empty_qt_layout(self.chrom_stat_plot_layout)
 
 	def changed_chrom_stat_combobox(self, chrom=None):
 		"""
@@ -1473,44 +1311,34 @@ class MetallaxisGuiClass(gui_base_object, gui_window_object):
 		# if no optional argument is provided then read chrom selection, from combobox
 		if chrom == None:
 			chrom = self.chrom_selection_stat_comboBox.currentText()
-		chrom_data_subset_variants = []
-		chrom_data_subset_ranges = []
+		# the plot is drawn when the statistics tab is shown
+		if self.tabWidget.currentWidget() is not self.statistics_tab:
+			return
+
+		def plot_chrom_positions():
+			# count the variants of the chosen chromosome in ranges of positions,
+			# in the same database as the table filter when it is the source
+			stat_connection = db_connection if self.stat_source is None else sqlite_connection
+			try:
+				chrom_data_subset_ranges, chrom_data_subset_variants = subset_stats.position_ranges(stat_connection, self.stat_source, chrom)
+			except sqlite3.Error:
+				# SQL filters don't have to select POS
+				chrom_data_subset_ranges, chrom_data_subset_variants = [], []
+
+			# plot data into bar plots
+			total_figure = Figure()
+			graph = total_figure.add_subplot(111)
+			graph.bar(chrom_data_subset_ranges, chrom_data_subset_variants)
+			graph.set_title('Distribution of Variants by Position in Chr ' + str(chrom))
+			graph.tick_params(axis='x', labelrotation=70)
+			graph.set_xlabel('Position in Chr ' + str(chrom))
+			graph.set_ylabel('Number of Variants')
+			total_figure.tight_layout()
+			return total_figure
+
 		# empty layout from previous selection
 		self.empty_qt_layout(self.chrom_stat_plot_layout)
-
-		# filter loaded_database to only results from chosen chromosome
-		my_query = "SELECT * FROM df where CHROM =='" + str(chrom) + "'"
-		chrom_data = pd.read_sql(my_query, db_connection)
-		# chrom_data = loaded_database[(loaded_database['CHROM'] == chrom)]
-		min_pos = chrom_data['POS'].min()
-		max_pos = chrom_data['POS'].max()
-		# calculate the size of the chromosome based on smallest and largest POS values
-		chrom_size = max_pos - min_pos
-
-		if chrom_size is np.NaN:
-			chrom_size = 0
-
-		# divide that size up so we can see variants by each part of the chromosome
-		chrom_size_10 = int(chrom_size / 12)
-		for i in range(min_pos, max_pos, chrom_size_10):
-			if i != min_pos:  # don't count first one as there will be no data
-				chrom_data_subset_range = str(i - chrom_size_10) + "-" + str(i)
-				chrom_data_subset_filter = (chrom_data['POS'] >= (i - chrom_size_10)) & (chrom_data['POS'] <= i)
-				chrom_data_subset_vars = len(chrom_data.loc[chrom_data_subset_filter])
-
-				chrom_data_subset_ranges.append(chrom_data_subset_range)
-				chrom_data_subset_variants.append(chrom_data_subset_vars)
-
-		# plot data into bar plots
-		total_figure = plt.figure()
-		graph = total_figure.add_subplot(111)
-		graph.bar(chrom_data_subset_ranges, chrom_data_subset_variants)
-		plt.title('Distribution of Variants by Position in Chr ' + str(chrom))
-		plt.xticks(rotation=70)
-		plt.xlabel('Position in Chr ' + str(chrom))
-		plt.ylabel('Number of Variants')
-		total_figure.tight_layout()
-		self.chrom_stat_plot_layout.addWidget(FigureCanvas(total_figure))
+		self.show_plot_image(self.chrom_stat_plot_layout, self.cached_plot("Chrom_" + str(chrom), plot_chrom_positions))
 
 	def populate_table(self, selected_data):
 		if selected_data is None:
@@ -1602,6 +1430,8 @@ class MetallaxisSettings(settings_base_object, settings_window_object):
 		# Initiate Buttons
 		self.change_wd_btn.clicked.connect(self.set_working_dir)
 		self.save_settings_btn.clicked.connect(self.save_settings)
+		self.clear_ensembl_cache_btn.clicked.connect(self.clear_ensembl_cache)
+		self.import_gene_models_btn.clicked.connect(self.import_gene_models)
 
 		# Center settings pannel on screen
 		qt_rectangle = self.frameGeometry()
@@ -1617,14 +1447,65 @@ class MetallaxisSettings(settings_base_object, settings_window_object):
 															   caption='Select folder to be working directory')
 		self.working_directory_lineedit.setText(working_directory)
 
+	def show_ensembl_cache_info(self):
+		"""
+		Displays the number and total size of cached ENSEMBL responses.
+		"""
+		cached_responses, cache_size = ensembl_cache.ResponseCache(ensembl_cache_file).info()
+		cache_size = round(cache_size / (1024 * 1024), 2)
+		self.ensembl_cache_info_label.setText(str(cached_responses) + " cached regions (" + str(cache_size) + " Mb)")
+
+	def clear_ensembl_cache(self):
+		ensembl_cache.ResponseCache(ensembl_cache_file).clear()
+		self.show_ensembl_cache_info()
+
+	def settings_gene_models_file(self):
+		organism = self.organism_lineedit.text().replace(' ', '_')
+		return gene_models.gene_models_file(config_directory, organism, self.genome_version_lineEdit.text())
+
+	def show_gene_models_info(self):
+		"""
+		Displays which gene models were imported for the organism and genome
+		version currently entered.
+		"""
+		imported_gene_models = gene_models.gene_models_info(self.settings_gene_models_file())
+		if imported_gene_models is None:
+			self.gene_models_info_label.setText("No gene models imported, genes are requested from ENSEMBL")
+		else:
+			self.gene_models_info_label.setText(str(imported_gene_models[1]) + " genes from " + os.path.basename(imported_gene_models[0]))
+
+	def import_gene_models(self):
+		"""
+		Open a dialog to chose a GTF or GFF3 file, and import its genes for the
+		organism and genome version currently entered.
+		"""
+		select_dialog = QtWidgets.QFileDialog()
+		annotation_file = select_dialog.getOpenFileName(self, 'Select gene models', filter="Gene Models (*.gtf *.gtf.gz *.gff3 *.gff3.gz *.gff *.gff.gz) ;;All Files(*.*)")[0]
+		if annotation_file == "":
+			return
+		QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+		try:
+			gene_models.import_gene_models(annotation_file, self.settings_gene_models_file())
+		except (OSError, ValueError, sqlite3.Error) as error_message:
+			QApplication.restoreOverrideCursor()
+			throw_error_message("Could not import gene models: " + str(error_message))
+			return
+		QApplication.restoreOverrideCursor()
+		self.show_gene_models_info()
+
 	def save_settings(self):
+		# keep settings that aren't shown in this window (e.g. ensembl_rest_url)
 		config = {}
+		if os.path.isfile(config_file):
+			config = read_config(config_file) or {}
 		config['working_dir'] = self.working_directory_lineedit.text()
 		config['vcf_chunk_size'] = self.vcf_chunk_size.text()
 		config['auto_annotate'] = self.annotation_checkbox.isChecked()
 		config['max_memory'] = self.max_memory_lineedit.text()
 		config['genome_version'] = self.genome_version_lineEdit.text()
 		config['organism'] = self.organism_lineedit.text().replace(' ', '_')
+		config['ensembl_cache_ttl_days'] = self.ensembl_cache_ttl_lineedit.text()
+		config['ensembl_cache_max_mb'] = self.ensembl_cache_max_size_lineedit.text()
 
 		# Write settings to YAML file
 		with open(config_file, 'w') as configf:
@@ -1647,12 +1528,18 @@ if __name__ == '__main__':
 	# Read settings into config dictionary
 	config = read_config(config_file)
 
-	# Temporary file names
-	global sqlite_output_name, vcf_output_filename
+	# Temporary file names, the annotation databases are kept next to them
+	global sqlite_output_name
 	sqlite_output_name = os.path.join(config['working_dir'], 'database.sqlite')
 	sqlite_connection = sqlite3.connect(sqlite_output_name, isolation_level=None)
-	vcf_output_filename = os.path.join(config['working_dir'], 'vcf_output_filename.vcf')
-	annotated_vcf_output_filename = os.path.join(config['working_dir'], 'vcf_annot_filename.vcf')
+
+	# ENSEMBL REST server, can be pointed at a local mirror for air-gapped use
+	ensembl_api = ensembl_client.EnsemblClient(config.get('ensembl_rest_url', ensembl_client.default_rest_url))
+	# genes are read from here instead of ENSEMBL if gene models were imported
+	gene_models_path = gene_models.gene_models_file(config_directory, config['organism'], config['genome_version'])
+	ensembl_response_cache = ensembl_cache.ResponseCache(ensembl_cache_file,
+														 config.get('ensembl_cache_ttl_days', 30),
+														 config.get('ensembl_cache_max_mb', 200))
 
 	if len(sys.argv) == 2:
 		MetallaxisGui.select_and_parse(sys.argv[1])
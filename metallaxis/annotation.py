@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+annotation.py - Parallel annotation of VCF files.
+
+The VCF to annotate is split into size-balanced shards of consecutive records,
+the chain of annotation stages (SnpEff, then SnpSift with dbSNP, then SnpSift
+with ClinVar) is run on every shard in parallel, and the annotated shards are
+merged back together in their original order. The number of shards annotated
+at once is chosen so that the JVMs never use more than the memory allowed in
+the settings between them.
+
+The stages of a chain run at the same time, each streaming its output to the
+next through a pipe, so no intermediate VCF is written to disk. Progress is
+measured by counting the records coming out of the last stage.
+
+Stages are lists of command arguments in which "{input}" is replaced by the
+file to annotate for the first stage and by "-" (standard input) for the
+others, and "{memory}" by the memory given to its JVM in Gb, so any command
+writing a VCF to its standard output can stand in for the annotators.
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# memory needed for SnpEff to load the human genome database
+min_memory_per_jvm = 4
+# SnpSift streams both files it annotates, so needs little memory
+snpsift_memory = 1
+
+
+class AnnotationError(Exception):
+	"""
+	Raised when one of the annotation stages fails.
+	"""
+	pass
+
+
+def open_vcf_text(vcf_file):
+	"""
+	Opens a VCF for reading as text, decompressing it if it is compressed with
+	gzip, bzip2 or xz.
+	"""
+	with open(vcf_file, 'rb') as magic_check:
+		file_magic = magic_check.read(6)
+	if file_magic.startswith(b'\x1f\x8b'):
+		return gzip.open(vcf_file, 'rt')
+	if file_magic.startswith(b'BZh'):
+		return bz2.open(vcf_file, 'rt')
+	if file_magic.startswith(b'\xfd7zXZ\x00'):
+		return lzma.open(vcf_file, 'rt')
+	return open(vcf_file, 'r')
+
+
+def snpeff_snpsift_stages(snpeff_jar, snpsift_jar, genome_version, dbSNP_path, clinvar_path):
+	"""
+	Returns the default chain of annotation stages: SnpEff, then SnpSift with
+	dbSNP, then SnpSift with ClinVar. Only SnpEff gets the memory left over by
+	the other stages.
+	"""
+	snpsift_memory_arg = "-Xmx" + str(snpsift_memory) + "G"
+	return [["java", "-Xmx{memory}G", "-jar", snpeff_jar, genome_version, "{input}"],
+			["java", snpsift_memory_arg, "-jar", snpsift_jar, "annotate", dbSNP_path, "{input}"],
+			["java", snpsift_memory_arg, "-jar", snpsift_jar, "annotate", clinvar_path, "{input}"]]
+
+
+def stage_memory(stages):
+	"""
+	Returns a tuple of the number of stages that share the memory budget, and
+	the memory in Gb set aside for the other stages of a chain.
+	"""
+	budgeted_stages, fixed_memory = 0, 0
+	for stage in stages:
+		if any("{memory}" in arg for arg in stage):
+			budgeted_stages += 1
+		else:
+			fixed_memory += sum(int(arg[4:-1]) for arg in stage if re.match(r'^-Xmx[0-9]+[gG]$', arg))
+	return budgeted_stages, fixed_memory
+
+
+def chain_memory(stages):
+	"""
+	Returns the least memory in Gb that a chain of stages needs to run.
+	"""
+	budgeted_stages, fixed_memory = stage_memory(stages)
+	return max(1, min_memory_per_jvm * budgeted_stages + fixed_memory)
+
+
+def split_vcf(vcf_file, shard_dir, nb_shards):
+	"""
+	Splits a VCF into at most nb_shards VCFs of consecutive records of about
+	the same size, each with the full header. Returns the list of shard files
+	in the order of the original records, and the list of their record counts.
+	A VCF without records gives a single shard with its header, so that the
+	annotators still add theirs.
+	"""
+	# compressed files are bigger once decompressed, but only the relative
+	# size of each shard matters
+	shard_target_size = max(1, os.path.getsize(vcf_file) // nb_shards)
+	header_lines = []
+	shard_files = []
+	shard_records = []
+	shard_write_obj = None
+	shard_size = 0
+
+	with open_vcf_text(vcf_file) as vcf_read_obj:
+		for line in vcf_read_obj:
+			if line.startswith('#'):
+				header_lines.append(line)
+				continue
+			if shard_write_obj is None or (shard_size >= shard_target_size and len(shard_files) < nb_shards):
+				if shard_write_obj is not None:
+					shard_write_obj.close()
+				shard_files.append(os.path.join(shard_dir, "shard_" + str(len(shard_files)) + ".vcf"))
+				shard_write_obj = open(shard_files[-1], 'w')
+				shard_write_obj.writelines(header_lines)
+				shard_records.append(0)
+				shard_size = 0
+			shard_write_obj.write(line)
+			shard_size += len(line)
+			shard_records[-1] += 1
+
+	if shard_write_obj is None:
+		shard_files.append(os.path.join(shard_dir, "shard_0.vcf"))
+		shard_write_obj = open(shard_files[-1], 'w')
+		shard_write_obj.writelines(header_lines)
+		shard_records.append(0)
+	shard_write_obj.close()
+	return shard_files, shard_records
+
+
+def annotate_shard(shard_file, stages, jvm_memory, record_counter=None):
+	"""
+	Runs the chain of annotation stages on a shard, piping each stage into the
+	next, and returns the filename of the annotated shard. record_counter, if
+	given, is a one item list kept updated with the number of records that
+	came out of the last stage.
+	"""
+	annotated_shard = shard_file + ".annotated"
+	stage_processes = []
+	stage_errors = []
+	stage_input = None
+	try:
+		for stage_nb, stage in enumerate(stages):
+			input_arg = shard_file if stage_nb == 0 else "-"
+			stage_cmd = [arg.replace("{input}", input_arg).replace("{memory}", str(jvm_memory)) for arg in stage]
+			# stderr goes to a file so that a chatty stage can't fill a pipe and block
+			stage_errors.append(tempfile.TemporaryFile())
+			stage_processes.append(subprocess.Popen(stage_cmd, stdin=stage_input, stdout=subprocess.PIPE, stderr=stage_errors[-1]))
+			if stage_input is not None:
+				# let the previous stage get SIGPIPE if this one exits early
+				stage_input.close()
+			stage_input = stage_processes[-1].stdout
+
+		with open(annotated_shard, 'wb') as annotated_write_obj:
+			for output_chunk in iter(lambda: stage_input.read(1024 * 1024), b''):
+				annotated_write_obj.write(output_chunk)
+				if record_counter is not None:
+					# header lines are counted too, but are negligible
+					record_counter[0] += output_chunk.count(b'\n')
+		stage_input.close()
+
+		for stage_process, stage_error in zip(stage_processes, stage_errors):
+			if stage_process.wait() != 0:
+				stage_error.seek(0)
+				raise AnnotationError(" ".join(stage_process.args) + " failed with exit code " + str(stage_process.returncode) + ":\n" +
+									  stage_error.read().decode('UTF-8', 'replace')[-1000:])
+	finally:
+		for stage_process in stage_processes:
+			if stage_process.poll() is None:
+				stage_process.kill()
+				stage_process.wait()
+		for stage_error in stage_errors:
+			stage_error.close()
+	return annotated_shard
+
+
+def merge_vcfs(vcf_files, vcf_output_filename):
+	"""
+	Concatenates annotated shards into one VCF, keeping the header of the
+	first shard only.
+	"""
+	with open(vcf_output_filename, 'w') as merged_write_obj:
+		for shard_nb, vcf_file in enumerate(vcf_files):
+			with open(vcf_file, 'r') as shard_read_obj:
+				for line in shard_read_obj:
+					if line.startswith('#') and shard_nb > 0:
+						continue
+					merged_write_obj.write(line)
+
+
+def annotation_workers(max_memory, nb_shards, stages):
+	"""
+	Returns a tuple of the number of shards to annotate at once, and the memory
+	in Gb to give to each budgeted JVM, so that all JVMs of all running chains
+	fit within max_memory.
+	"""
+	max_memory = int(float(max_memory))
+	nb_workers = max_memory // chain_memory(stages)
+	nb_workers = max(1, min(nb_workers, os.cpu_count() or 1, nb_shards))
+	jvm_memory = job_memory(max_memory, nb_workers, stages)
+	return nb_workers, jvm_memory
+
+
+def job_memory(max_memory, nb_workers, stages):
+	"""
+	Returns the memory in Gb to give each budgeted JVM when nb_workers chains
+	run at once.
+	"""
+	budgeted_stages, fixed_memory = stage_memory(stages)
+	worker_memory = int(float(max_memory)) // nb_workers - fixed_memory
+	return max(1, worker_memory // max(1, budgeted_stages))
+
+
+def annotate_sharded(vcf_file, vcf_output_filename, stages, max_memory, progress=None, nb_workers=None, working_dir=None):
+	"""
+	Annotates a VCF by running the chain of stages on shards of it in parallel,
+	and writes the merged result to vcf_output_filename. progress, if given, is
+	regularly called with the number of annotated records and the total number
+	of records, always from the calling thread. Raises AnnotationError if any
+	stage fails.
+	"""
+	# every stage of a chain runs at once, so each worker runs one JVM per stage
+	if nb_workers is None:
+		nb_workers, jvm_memory = annotation_workers(max_memory, os.cpu_count() or 1, stages)
+	else:
+		jvm_memory = job_memory(max_memory, nb_workers, stages)
+
+	shard_dir = tempfile.mkdtemp(prefix="metallaxis_shards_", dir=working_dir)
+	try:
+		# split into a few more shards than workers so that they finish together
+		shard_files, shard_records = split_vcf(vcf_file, shard_dir, nb_workers * 2)
+		record_counters = [[0] for shard_file in shard_files]
+		annotated_shards = [None] * len(shard_files)
+		with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+			annotating_shards = {executor.submit(annotate_shard, shard_file, stages, jvm_memory, record_counter): shard_nb
+								 for shard_nb, (shard_file, record_counter) in enumerate(zip(shard_files, record_counters))}
+			remaining_shards = set(annotating_shards)
+			while remaining_shards:
+				finished_shards, remaining_shards = wait(remaining_shards, timeout=0.5, return_when=FIRST_COMPLETED)
+				for finished_shard in finished_shards:
+					annotated_shards[annotating_shards[finished_shard]] = finished_shard.result()
+				if progress is not None:
+					annotated_records = sum(min(counter[0], records) for counter, records in zip(record_counters, shard_records))
+					progress(annotated_records, sum(shard_records))
+		merge_vcfs(annotated_shards, vcf_output_filename)
+	finally:
+		shutil.rmtree(shard_dir, ignore_errors=True)
+	return vcf_output_filename
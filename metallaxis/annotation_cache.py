@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+annotation_cache.py - Persistent cache of per-variant annotation results.
+
+Successive releases of a VCF mostly contain the same variants, so what the
+annotators add to each variant (its ID and the new INFO fields) is stored,
+keyed by assembly, CHROM, POS, REF, ALT and a fingerprint of the annotators
+and their databases. When a VCF is annotated, only the variants missing from
+the cache go through the annotators, and the cached results are merged back
+in for the others, keeping the original order of the records.
+"""
+
+import hashlib
+import os
+import sqlite3
+
+from metallaxis.annotation import open_vcf_text, AnnotationError
+
+# variants looked up in the cache per query
+lookup_batch_size = 200
+# changes when what is stored per variant changes, so that older entries aren't used
+cache_format = "2"
+
+
+def annotator_version(stages):
+	"""
+	Returns a fingerprint of a chain of annotation stages, which changes when
+	their commands or any file they use (jars, databases) changes.
+	"""
+	version_hash = hashlib.sha1(cache_format.encode('UTF-8'))
+	for stage in stages:
+		for arg in stage:
+			# the memory given to the JVMs doesn't change the annotations
+			if arg.startswith("-Xmx") or arg == "{input}":
+				continue
+			version_hash.update(arg.encode('UTF-8'))
+			if os.path.isfile(arg):
+				version_hash.update((str(os.path.getsize(arg)) + ":" + str(int(os.path.getmtime(arg)))).encode('UTF-8'))
+	return version_hash.hexdigest()
+
+
+def info_fields(info_column):
+	if info_column in ("", "."):
+		return []
+	return info_column.split(';')
+
+
+class AnnotationCache:
+	def __init__(self, cache_file):
+		self.cache_file = cache_file
+		connection = sqlite3.connect(cache_file)
+		cursor = connection.cursor()
+		cursor.execute("CREATE TABLE IF NOT EXISTS variant_annotations (assembly TEXT, chrom TEXT, pos INTEGER, ref TEXT, alt TEXT, "
+					   "annotator_version TEXT, variant_id TEXT, added_info TEXT, "
+					   "PRIMARY KEY (annotator_version, assembly, chrom, pos, ref, alt)) WITHOUT ROWID;")
+		cursor.execute("CREATE TABLE IF NOT EXISTS annotation_headers (annotator_version TEXT PRIMARY KEY, added_header TEXT);")
+		connection.commit()
+		connection.close()
+
+	def lookup(self, connection, assembly, version, variant_keys):
+		"""
+		Returns a dictionary of (chrom, pos, ref, alt) -> (variant_id, added_info)
+		for the given variant keys that are cached. variant_id is None if the
+		annotators left the ID of the variant as it was.
+		"""
+		cached_variants = {}
+		for batch_start in range(0, len(variant_keys), lookup_batch_size):
+			key_batch = variant_keys[batch_start:batch_start + lookup_batch_size]
+			query_values = []
+			for variant_key in key_batch:
+				query_values.extend(variant_key)
+			cursor = connection.execute("SELECT chrom, pos, ref, alt, variant_id, added_info FROM variant_annotations "
+										"WHERE annotator_version = ? AND assembly = ? AND (chrom, pos, ref, alt) IN (VALUES " +
+										", ".join(["(?, ?, ?, ?)"] * len(key_batch)) + ");",
+										[version, assembly] + query_values)
+			for chrom, pos, ref, alt, variant_id, added_info in cursor:
+				cached_variants[(chrom, pos, ref, alt)] = (variant_id, added_info)
+		return cached_variants
+
+	def annotate(self, vcf_file, vcf_output_filename, assembly, version, annotate_func, working_dir, progress=None):
+		"""
+		Writes an annotated copy of vcf_file to vcf_output_filename, using the
+		cached annotations where possible. Variants that aren't cached are
+		written to a temporary VCF and annotated by calling
+		annotate_func(input_vcf, output_vcf), and their results are added to the
+		cache. Returns a tuple of the number of cached variants and the total
+		number of variants.
+		"""
+		misses_file = os.path.join(working_dir, "annotation_cache_misses.vcf")
+		annotated_misses_file = os.path.join(working_dir, "annotation_cache_misses_annotated.vcf")
+		connection = sqlite3.connect(self.cache_file)
+
+		# first pass: find cached variants, and write the others to their own VCF
+		header_lines = []
+		cache_hits = bytearray()
+		nb_misses = 0
+		with open_vcf_text(vcf_file) as vcf_read_obj, open(misses_file, 'w') as misses_write_obj:
+			record_batch = []
+
+			def check_batch():
+				cached_variants = self.lookup(connection, assembly, version, [variant_key for variant_key, line in record_batch])
+				batch_misses = 0
+				for variant_key, line in record_batch:
+					if variant_key in cached_variants:
+						cache_hits.append(1)
+					else:
+						cache_hits.append(0)
+						misses_write_obj.write(line)
+						batch_misses += 1
+				record_batch.clear()
+				return batch_misses
+
+			for line in vcf_read_obj:
+				if line.startswith('#'):
+					header_lines.append(line)
+					misses_write_obj.write(line)
+					continue
+				columns = line.split('\t', 5)
+				record_batch.append(((columns[0], int(columns[1]), columns[3], columns[4]), line.rstrip('\n') + '\n'))
+				if len(record_batch) >= lookup_batch_size:
+					nb_misses += check_batch()
+			nb_misses += check_batch()
+
+		if progress is not None:
+			progress(len(cache_hits) - nb_misses, len(cache_hits))
+
+		added_header = None
+		if nb_misses > 0:
+			annotate_func(misses_file, annotated_misses_file)
+			added_header = self.store_annotations(connection, assembly, version, misses_file, annotated_misses_file, header_lines)
+		else:
+			cursor = connection.execute("SELECT added_header FROM annotation_headers WHERE annotator_version = ?;", (version,))
+			header_row = cursor.fetchone()
+			added_header = header_row[0] if header_row is not None else ""
+
+		# second pass: merge cached and freshly annotated variants in the original order
+		with open_vcf_text(vcf_file) as vcf_read_obj, open(vcf_output_filename, 'w') as annotated_write_obj:
+			annotated_misses_obj = open(annotated_misses_file, 'r') if nb_misses > 0 else None
+			annotated_write_obj.writelines(line for line in header_lines if not line.startswith('#CHROM'))
+			annotated_write_obj.write(added_header)
+			annotated_write_obj.writelines(line for line in header_lines if line.startswith('#CHROM'))
+
+			record_nb = 0
+			record_batch = []
+
+			def write_batch():
+				cached_variants = self.lookup(connection, assembly, version,
+											  [variant_key for variant_key, columns, is_hit in record_batch if is_hit])
+				for variant_key, columns, is_hit in record_batch:
+					if is_hit:
+						variant_id, added_info = cached_variants[variant_key]
+						# the record keeps its own ID unless the annotators set one
+						if variant_id is not None:
+							columns[2] = variant_id
+						columns[7] = ";".join(info_fields(columns[7]) + info_fields(added_info)) or "."
+						annotated_write_obj.write("\t".join(columns) + "\n")
+					else:
+						annotated_line = next(annotated_misses_obj, None)
+						while annotated_line is not None and annotated_line.startswith('#'):
+							annotated_line = next(annotated_misses_obj, None)
+						if annotated_line is None:
+							raise AnnotationError("The annotators returned fewer variants than they were given, "
+												  "the first one missing is at " + ":".join(columns[:2]))
+						annotated_write_obj.write(annotated_line.rstrip('\n') + '\n')
+				record_batch.clear()
+
+			for line in vcf_read_obj:
+				if line.startswith('#'):
+					continue
+				columns = line.rstrip('\n').split('\t')
+				record_batch.append(((columns[0], int(columns[1]), columns[3], columns[4]), columns, cache_hits[record_nb] == 1))
+				record_nb += 1
+				if len(record_batch) >= lookup_batch_size:
+					write_batch()
+			write_batch()
+			if annotated_misses_obj is not None:
+				annotated_misses_obj.close()
+
+		connection.close()
+		for temporary_file in (misses_file, annotated_misses_file):
+			if os.path.isfile(temporary_file):
+				os.remove(temporary_file)
+		return len(cache_hits) - nb_misses, len(cache_hits)
+
+	def store_annotations(self, connection, assembly, version, misses_file, annotated_misses_file, header_lines):
+		"""
+		Stores what the annotators added to each variant of misses_file, and the
+		header lines they added. Returns the added header lines.
+		"""
+		added_header_lines = []
+		variant_annotations = []
+		with open(misses_file, 'r') as misses_read_obj, open(annotated_misses_file, 'r') as annotated_read_obj:
+			original_records = (line for line in misses_read_obj if not line.startswith('#'))
+			for annotated_line in annotated_read_obj:
+				if annotated_line.startswith('#'):
+					if annotated_line not in header_lines:
+						added_header_lines.append(annotated_line)
+					continue
+				original_line = next(original_records, None)
+				if original_line is None:
+					raise AnnotationError("The annotators returned more variants than they were given")
+				original_columns = original_line.rstrip('\n').split('\t')
+				annotated_columns = annotated_line.rstrip('\n').split('\t')
+				if original_columns[:2] != annotated_columns[:2]:
+					raise AnnotationError("Annotated variants are not in the same order as the input, at " + ":".join(original_columns[:2]))
+				original_info = set(info_fields(original_columns[7]))
+				added_info = [info_field for info_field in info_fields(annotated_columns[7]) if info_field not in original_info]
+				variant_annotations.append((assembly, original_columns[0], int(original_columns[1]), original_columns[3], original_columns[4],
+											version, annotated_columns[2] if annotated_columns[2] != original_columns[2] else None,
+											";".join(added_info)))
+
+		connection.executemany("INSERT OR REPLACE INTO variant_annotations VALUES (?, ?, ?, ?, ?, ?, ?, ?);", variant_annotations)
+		added_header = "".join(added_header_lines)
+		connection.execute("INSERT OR REPLACE INTO annotation_headers VALUES (?, ?);", (version, added_header))
+		connection.commit()
+		return added_header
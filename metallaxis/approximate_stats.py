@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+approximate_stats.py - Constant memory estimates of the statistics of a VCF.
+
+Counting distinct IDs or finding QUAL quantiles exactly needs memory that
+grows with the file. In approximate mode they are estimated from sketches
+filled in the same pass as the other statistics, whose size doesn't depend
+on the number of variants:
+
+HyperLogLog counts distinct values (IDs, ALT alleles) from the leading zeros
+of their hashes, with a relative standard error of 1.04 / sqrt(registers).
+A KLL sketch keeps a sample of values at weights that are powers of two,
+from which any quantile (of QUAL, DP) is read with a bounded rank error.
+A reservoir keeps a uniform sample of the variants, to preview them.
+
+Every estimate is stored with its error bound, and can be replaced by its
+exact value computed from the database later.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+hash_key = "metallaxisapprox"
+
+# 2^14 registers, a relative standard error of 0.8%
+hll_precision = 14
+# KLL accuracy parameter, a rank error of about 1.3%
+kll_k = 200
+# variants kept to preview the file
+reservoir_size = 1000
+
+quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def value_hashes(values):
+	"""
+	Returns a uint64 numpy array of the hashes of the given values, as text.
+	"""
+	return pd.util.hash_pandas_object(pd.Series(values, dtype=object).astype(str), index=False, hash_key=hash_key).values
+
+
+def bit_lengths(values):
+	"""
+	Returns the number of bits needed to write each of a uint64 numpy array.
+	"""
+	values = values.copy()
+	lengths = np.zeros(len(values), dtype=np.int64)
+	for shift in (32, 16, 8, 4, 2, 1):
+		is_longer = values >= (np.uint64(1) << np.uint64(shift))
+		lengths[is_longer] += shift
+		values[is_longer] >>= np.uint64(shift)
+	return lengths + (values > 0)
+
+
+class HyperLogLog:
+	def __init__(self, precision=hll_precision):
+		self.precision = precision
+		self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+	def add(self, values):
+		"""
+		Adds an array of values, which are counted once however often they are
+		added.
+		"""
+		if len(values) == 0:
+			return
+		hashes = value_hashes(values)
+		register_numbers = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+		remaining_bits = 64 - self.precision
+		remainders = hashes & np.uint64((1 << remaining_bits) - 1)
+		# position of the first set bit of what's left of the hash
+		ranks = (remaining_bits - bit_lengths(remainders) + 1).astype(np.uint8)
+		np.maximum.at(self.registers, register_numbers, ranks)
+
+	def estimate(self):
+		nb_registers = len(self.registers)
+		alpha = 0.7213 / (1 + 1.079 / nb_registers)
+		raw_estimate = alpha * nb_registers ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+		nb_empty = int(np.count_nonzero(self.registers == 0))
+		# linear counting is more accurate while many registers are still empty
+		if raw_estimate <= 2.5 * nb_registers and nb_empty > 0:
+			return nb_registers * math.log(nb_registers / nb_empty)
+		return float(raw_estimate)
+
+	def relative_error(self):
+		return 1.04 / math.sqrt(len(self.registers))
+
+
+class KllSketch:
+	def __init__(self, k=kll_k, seed=0):
+		self.k = k
+		# compactors[h] holds values that each stand for 2^h values
+		self.compactors = [np.zeros(0)]
+		self.count = 0
+		self.random = np.random.RandomState(seed)
+
+	def capacity(self, level):
+		# lower levels are kept smaller, as their values weigh less
+		return max(2, int(math.ceil(self.k * (2 / 3) ** (len(self.compactors) - level - 1))))
+
+	def add(self, values):
+		values = np.asarray(values, dtype=np.float64)
+		if len(values) == 0:
+			return
+		self.count += len(values)
+		self.compactors[0] = np.concatenate([self.compactors[0], values])
+		level = 0
+		while level < len(self.compactors):
+			if len(self.compactors[level]) > self.capacity(level):
+				if level + 1 == len(self.compactors):
+					self.compactors.append(np.zeros(0))
+				# keep every other value of the sorted compactor, at twice the weight
+				sorted_values = np.sort(self.compactors[level])
+				nb_compacted = len(sorted_values) - len(sorted_values) % 2
+				promoted_values = sorted_values[self.random.randint(2):nb_compacted:2]
+				self.compactors[level] = sorted_values[nb_compacted:]
+				self.compactors[level + 1] = np.concatenate([self.compactors[level + 1], promoted_values])
+			level += 1
+
+	def quantile(self, fraction):
+		"""
+		Returns the estimated value at a fraction (between 0 and 1) of the sorted
+		values added, or None if no value was added.
+		"""
+		values = np.concatenate(self.compactors)
+		if len(values) == 0:
+			return None
+		weights = np.concatenate([np.full(len(compactor), 2 ** level) for level, compactor in enumerate(self.compactors)])
+		order = np.argsort(values, kind='stable')
+		cumulative_weights = np.cumsum(weights[order])
+		value_index = np.searchsorted(cumulative_weights, fraction * cumulative_weights[-1], side='left')
+		return float(values[order][min(value_index, len(values) - 1)])
+
+	def rank_error(self):
+		# normalised rank error of a single quantile, at 99% confidence
+		if len(self.compactors) == 1:
+			return 0.0
+		return 2.296 / self.k ** 0.9723
+
+
+class ReservoirSample:
+	def __init__(self, size=reservoir_size, seed=0):
+		self.size = size
+		self.rows = None
+		self.count = 0
+		self.random = np.random.RandomState(seed)
+
+	def add(self, chunk):
+		"""
+		Adds the rows of a DataFrame, keeping each row seen so far with the same
+		probability.
+		"""
+		chunk = chunk.reset_index(drop=True)
+		if self.rows is None:
+			self.rows = chunk.iloc[:0].copy()
+		nb_filling = max(0, min(len(chunk), self.size - len(self.rows)))
+		if nb_filling > 0:
+			self.rows = pd.concat([self.rows, chunk.iloc[:nb_filling]], ignore_index=True)
+		# every later row replaces a random slot with probability size / rows seen
+		row_numbers = self.count + np.arange(nb_filling, len(chunk))
+		slots = (self.random.random_sample(len(row_numbers)) * (row_numbers + 1)).astype(np.int64)
+		is_kept = slots < self.size
+		if is_kept.any():
+			# a slot taken by several rows ends with the last of them, as it would one row at a time
+			kept_slots = pd.Series(np.arange(nb_filling, len(chunk))[is_kept], index=slots[is_kept])
+			kept_slots = kept_slots.groupby(level=0).last()
+			self.rows.iloc[kept_slots.index.values] = chunk.iloc[kept_slots.values].values
+		self.count += len(chunk)
+
+
+class ApproximateStats:
+	def __init__(self):
+		self.distinct_ids = HyperLogLog()
+		self.distinct_alt_alleles = HyperLogLog()
+		self.qual = KllSketch(seed=1)
+		self.dp = KllSketch(seed=2)
+		self.preview = ReservoirSample()
+
+	def add_chunk(self, chunk, qual, dp, alts):
+		"""
+		Adds a chunk of the VCF, with its QUAL and DP as float arrays (NaN when
+		missing) and its distinct ALT values.
+		"""
+		ids = chunk['ID'].values
+		self.distinct_ids.add(ids[ids != '.'])
+		alt_alleles = {alt_allele for alt in alts for alt_allele in alt.split(',') if alt_allele != '.'}
+		self.distinct_alt_alleles.add(list(alt_alleles))
+		self.qual.add(qual[~np.isnan(qual)])
+		self.dp.add(dp[~np.isnan(dp)])
+		self.preview.add(chunk)
+
+	def estimates(self):
+		"""
+		Returns a list of (metric, estimate, error, error_kind) of the estimated
+		statistics, where error_kind is 'relative' for an error relative to the
+		estimate and 'rank' for an error in the rank of a quantile.
+		"""
+		estimates = [('distinct_ids', self.distinct_ids.estimate(), self.distinct_ids.relative_error(), 'relative'),
+					 ('distinct_alt_alleles', self.distinct_alt_alleles.estimate(), self.distinct_alt_alleles.relative_error(), 'relative')]
+		for metric, sketch in (('QUAL', self.qual), ('DP', self.dp)):
+			for fraction in quantiles:
+				estimates.append((metric + "_p" + str(int(fraction * 100)), sketch.quantile(fraction), sketch.rank_error(), 'rank'))
+		return estimates
+
+
+def store_estimates(connection, approximate_stats):
+	"""
+	Writes the estimated statistics to the stats_approximate table, and the
+	sampled variants to the stats_preview table, replacing previous ones.
+	"""
+	cursor = connection.cursor()
+	cursor.execute("DROP TABLE IF EXISTS stats_approximate;")
+	cursor.execute("DROP TABLE IF EXISTS stats_preview;")
+	cursor.execute("CREATE TABLE stats_approximate (metric TEXT PRIMARY KEY, estimate REAL, error REAL, error_kind TEXT, exact REAL);")
+	cursor.executemany("INSERT INTO stats_approximate VALUES (?, ?, ?, ?, NULL);", approximate_stats.estimates())
+	connection.commit()
+	if approximate_stats.preview.rows is not None:
+		approximate_stats.preview.rows.to_sql('stats_preview', connection, index=False)
+
+
+def load_estimates(connection):
+	"""
+	Returns the list of (metric, estimate, error, error_kind, exact) of the
+	stats_approximate table, empty if the statistics weren't estimated.
+	"""
+	cursor = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'stats_approximate';")
+	if cursor.fetchone() is None:
+		return []
+	return connection.execute("SELECT metric, estimate, error, error_kind, exact FROM stats_approximate ORDER BY rowid;").fetchall()
+
+
+def exact_values(connection):
+	"""
+	Computes the exact values of the estimated statistics from the variants of
+	the database, stores them in the stats_approximate table, and returns them
+	as a dictionary.
+	"""
+	exact = {'distinct_ids': connection.execute("SELECT COUNT(DISTINCT ID) FROM df WHERE ID IS NOT NULL AND ID != '.';").fetchone()[0]}
+	alt_alleles = set()
+	for alt, in connection.execute("SELECT DISTINCT ALT FROM df WHERE ALT IS NOT NULL;"):
+		alt_alleles.update(alt_allele for alt_allele in str(alt).split(',') if alt_allele != '.')
+	exact['distinct_alt_alleles'] = len(alt_alleles)
+
+	df_columns = [column[1] for column in connection.execute("PRAGMA table_info(df);")]
+	for metric in ('QUAL', 'DP'):
+		if metric not in df_columns:
+			continue
+		# the columns hold text, and missing values as NULL
+		values = "SELECT CAST(" + metric + " AS REAL) AS value FROM df WHERE " + metric + " IS NOT NULL AND " + metric + " != '.'"
+		nb_values = connection.execute("SELECT COUNT(*) FROM (" + values + ");").fetchone()[0]
+		if nb_values == 0:
+			continue
+		for fraction in quantiles:
+			rank = min(nb_values - 1, max(0, int(math.ceil(fraction * nb_values)) - 1))
+			exact[metric + "_p" + str(int(fraction * 100))] = connection.execute(values + " ORDER BY value LIMIT 1 OFFSET ?;", (rank,)).fetchone()[0]
+
+	connection.executemany("UPDATE stats_approximate SET exact = ? WHERE metric = ?;", [(value, metric) for metric, value in exact.items()])
+	connection.commit()
+	return exact
+
+
+def metric_label(metric):
+	if metric == 'distinct_ids':
+		return "Distinct IDs"
+	if metric == 'distinct_alt_alleles':
+		return "Distinct ALT alleles"
+	metric_name, percentile = metric.rsplit("_p", 1)
+	return metric_name + " " + percentile + "th percentile"
+
+
+def describe_estimate(metric, estimate, error, error_kind, exact):
+	"""
+	Returns a line of text giving an estimated statistic with its error bound,
+	or its exact value once known.
+	"""
+	if estimate is None and exact is None:
+		return metric_label(metric) + ": no values"
+	if exact is not None and estimate is None:
+		return metric_label(metric) + ": " + format(exact, 'g')
+	if exact is not None:
+		return metric_label(metric) + ": " + format(exact, 'g') + " (estimated " + format(estimate, '.6g') + ")"
+	if error_kind == 'relative':
+		# the error of HyperLogLog is a standard error, give a 95% interval
+		return metric_label(metric) + ": ~" + format(round(estimate), 'd') + " (±" + format(200 * error, '.1f') + "%)"
+	return metric_label(metric) + ": ~" + format(estimate, 'g') + " (rank ±" + format(100 * error, '.1f') + "%)"
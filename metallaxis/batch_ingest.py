@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+batch_ingest.py - Conversion of many VCFs into a single cohort database.
+
+A session database holds the variants of a single VCF. A cohort database
+instead holds those of many VCFs, e.g. one per sample, so that variants can be
+filtered across all of them with a single query:
+
+sources       one row per VCF, with its status (ok or failed), the messages
+              of the pipeline, its number of variants and ingestion time
+variants      one row per distinct (CHROM, POS, REF, ALT), the variant key
+calls         one row per variant of each VCF, with its other columns (ID,
+              QUAL, FILTER, FORMAT, samples and INFO fields)
+contigs       the contig lengths declared by the VCFs
+info_fields   the INFO fields declared by the VCFs, the first declaration of
+              each field being kept
+batch_runs    the throughput of each batch
+df            a view of the calls joined to their variant and source file,
+              queried like the df table of a session
+
+VCFs are converted in parallel by worker processes, each into a temporary
+session database of its own, which is then merged into the cohort database by
+the main process, each in a transaction. A VCF that fails, or whose worker
+dies, is recorded as failed without affecting the others: as a dying worker
+breaks its whole pool, the VCFs it took down with it are converted again,
+one at a time. Running the batch again skips the VCFs already ingested and
+retries the failed ones.
+"""
+
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from metallaxis import annotation
+from metallaxis import pipeline
+
+vcf_extensions = ('.vcf', '.vcf.gz', '.vcf.bz2', '.vcf.xz')
+variant_key_columns = ['CHROM', 'POS', 'REF', 'ALT']
+
+info_id_regex = re.compile(r'ID=([^,>]+)')
+info_number_regex = re.compile(r'Number=([^,>]+)')
+info_type_regex = re.compile(r'Type=([^,>]+)')
+info_description_regex = re.compile(r'Description="((?:[^"\\]|\\.)*)"')
+
+
+class BatchHooks(pipeline.PipelineHooks):
+	"""
+	Keeps the warnings and errors of the pipeline of a worker, to be stored
+	with its VCF, and ignores its progress.
+	"""
+	def __init__(self):
+		self.messages = []
+
+	def progress(self, percent, message):
+		pass
+
+	def warning(self, message):
+		self.messages.append("Warning: " + message)
+
+	def error(self, message):
+		self.messages.append("Error: " + message)
+
+
+def find_vcfs(batch_input):
+	"""
+	Returns the list of VCFs of a batch: the VCFs (optionally compressed) of a
+	directory, or the files listed in a manifest, one per line, relative to the
+	manifest. Empty lines and lines starting with # are ignored.
+	"""
+	if os.path.isdir(batch_input):
+		return sorted(os.path.join(batch_input, file_name) for file_name in os.listdir(batch_input)
+					  if file_name.endswith(vcf_extensions))
+	if batch_input.endswith(vcf_extensions):
+		return [batch_input]
+	manifest_dir = os.path.dirname(batch_input)
+	vcf_files = []
+	with open(batch_input) as manifest:
+		for line in manifest:
+			line = line.strip()
+			if line and not line.startswith('#'):
+				vcf_files.append(os.path.join(manifest_dir, line))
+	return vcf_files
+
+
+def info_definitions(metadata_dict):
+	"""
+	Returns a dictionary of ID -> (Number, Type, Description) of the INFO
+	fields declared in the metadata of a VCF.
+	"""
+	definitions = {}
+	for metadata_type, metadata_tag, metadata_result in metadata_dict.values():
+		if metadata_type != "INFO":
+			continue
+		info_id = info_id_regex.search(metadata_result)
+		if info_id is None:
+			continue
+		definitions[info_id.group(1)] = tuple(None if field_match is None else field_match.group(1) for field_match in
+											  (info_number_regex.search(metadata_result), info_type_regex.search(metadata_result),
+											   info_description_regex.search(metadata_result)))
+	return definitions
+
+
+def ingest_file(vcf_file, config, shard_file):
+	"""
+	Converts a VCF into a session database, shard_file, in a worker process.
+	Returns a dictionary of the result, whose error is None if the VCF was
+	converted.
+	"""
+	start_time = time.perf_counter()
+	hooks = BatchHooks()
+	result = {'file': vcf_file, 'shard': shard_file, 'error': None, 'messages': hooks.messages, 'info_fields': {}, 'seconds': None}
+	# temporary files of the pipeline are kept next to the shard, apart from other workers
+	temp_dir = shard_file + ".tmp"
+	os.makedirs(temp_dir, exist_ok=True)
+	# left by a worker that died converting the same VCF
+	if os.path.exists(shard_file):
+		os.remove(shard_file)
+	try:
+		file_pipeline = pipeline.Pipeline(config, hooks, shard_file, temp_dir)
+		shard_connection = file_pipeline.ingest(vcf_file)
+		if shard_connection is None:
+			result['error'] = hooks.messages[-1] if hooks.messages else "Not a valid VCF"
+		else:
+			shard_connection.close()
+			result['info_fields'] = info_definitions(file_pipeline.metadata_dict)
+	# any error of a VCF must only fail that VCF, not the batch
+	except Exception as error_message:
+		result['error'] = type(error_message).__name__ + ": " + str(error_message)
+	finally:
+		shutil.rmtree(temp_dir, ignore_errors=True)
+	result['seconds'] = time.perf_counter() - start_time
+	return result
+
+
+def quote_column(column):
+	return '"' + column.replace('"', '""') + '"'
+
+
+def create_cohort_tables(connection):
+	cursor = connection.cursor()
+	cursor.execute("CREATE TABLE IF NOT EXISTS sources (source_id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT, status TEXT, "
+				   "messages TEXT, variant_count INTEGER, file_size INTEGER, seconds REAL);")
+	cursor.execute("CREATE TABLE IF NOT EXISTS variants (variant_id INTEGER PRIMARY KEY, CHROM TEXT NOT NULL, POS INTEGER NOT NULL, "
+				   "REF TEXT NOT NULL, ALT TEXT NOT NULL, UNIQUE (CHROM, POS, REF, ALT));")
+	cursor.execute("CREATE TABLE IF NOT EXISTS calls (source_id INTEGER NOT NULL, variant_id INTEGER NOT NULL);")
+	cursor.execute("CREATE INDEX IF NOT EXISTS calls_variant ON calls (variant_id);")
+	cursor.execute("CREATE INDEX IF NOT EXISTS calls_source ON calls (source_id);")
+	cursor.execute("CREATE TABLE IF NOT EXISTS contigs (CHROM TEXT PRIMARY KEY, length INTEGER);")
+	cursor.execute("CREATE TABLE IF NOT EXISTS info_fields (ID TEXT PRIMARY KEY, Number TEXT, Type TEXT, Description TEXT);")
+	cursor.execute("CREATE TABLE IF NOT EXISTS batch_runs (started TEXT, files INTEGER, ingested INTEGER, failed INTEGER, skipped INTEGER, "
+				   "variants INTEGER, new_variants INTEGER, seconds REAL);")
+	connection.commit()
+
+
+def table_columns(connection, table, schema="main"):
+	return [column[1] for column in connection.execute("PRAGMA " + schema + ".table_info(" + table + ");")]
+
+
+def create_df_view(connection):
+	"""
+	(Re)creates the df view over the calls, with the columns they have so far.
+	"""
+	call_columns = [column for column in table_columns(connection, "calls") if column not in ('source_id', 'variant_id')]
+	connection.execute("DROP VIEW IF EXISTS df;")
+	connection.execute("CREATE VIEW df AS SELECT sources.name AS SOURCE, " +
+					   ", ".join(["variants." + column for column in variant_key_columns] + ["calls." + quote_column(column) for column in call_columns]) +
+					   " FROM calls JOIN variants ON variants.variant_id = calls.variant_id JOIN sources ON sources.source_id = calls.source_id;")
+
+
+def record_source(connection, vcf_file, status, messages, variant_count, seconds):
+	cursor = connection.execute("INSERT OR REPLACE INTO sources (path, name, status, messages, variant_count, file_size, seconds) "
+								"VALUES (?, ?, ?, ?, ?, ?, ?);",
+								(os.path.abspath(vcf_file), os.path.basename(vcf_file), status, "\n".join(messages) or None, variant_count,
+								 os.path.getsize(vcf_file) if os.path.isfile(vcf_file) else None, seconds))
+	return cursor.lastrowid
+
+
+def merge_shard(connection, result):
+	"""
+	Adds the variants of a worker's session database to the cohort database,
+	in a single transaction. Returns the number of variants added.
+	"""
+	connection.execute("ATTACH DATABASE ? AS shard;", (result['shard'],))
+	try:
+		with connection:
+			source_id = record_source(connection, result['file'], "ok", result['messages'], 0, result['seconds'])
+
+			# columns new to the cohort are added to the calls, lower case
+			# as SQLite column names are case insensitive
+			call_columns = [column.lower() for column in table_columns(connection, "calls")]
+			shard_columns = [column for column in table_columns(connection, "df", "shard") if column not in variant_key_columns]
+			for column in shard_columns:
+				if column.lower() not in call_columns:
+					connection.execute("ALTER TABLE calls ADD COLUMN " + quote_column(column) + ";")
+					call_columns.append(column.lower())
+
+			# contigs are zero padded, but columns of numbers only are stored as
+			# numbers, dropping the zero
+			shard_keys = ("SELECT CASE WHEN typeof(CHROM) = 'integer' AND CHROM BETWEEN 0 AND 9 THEN '0' || CHROM ELSE CAST(CHROM AS TEXT) END AS CHROM, "
+						  "POS, IFNULL(CAST(REF AS TEXT), '.') AS REF, IFNULL(CAST(ALT AS TEXT), '.') AS ALT, " +
+						  ", ".join(["shard.df." + quote_column(column) for column in shard_columns] or ["NULL"]) + " FROM shard.df")
+			connection.execute("INSERT OR IGNORE INTO variants (CHROM, POS, REF, ALT) SELECT DISTINCT CHROM, POS, REF, ALT FROM (" + shard_keys + ");")
+			cursor = connection.execute("INSERT INTO calls (source_id, variant_id" + "".join(", " + quote_column(column) for column in shard_columns) + ") "
+										"SELECT ?, variants.variant_id" + "".join(", shard_rows." + quote_column(column) for column in shard_columns) +
+										" FROM (" + shard_keys + ") AS shard_rows JOIN variants ON variants.CHROM = shard_rows.CHROM AND "
+										"variants.POS = shard_rows.POS AND variants.REF = shard_rows.REF AND variants.ALT = shard_rows.ALT;", (source_id,))
+			variant_count = cursor.rowcount
+			connection.execute("UPDATE sources SET variant_count = ? WHERE source_id = ?;", (variant_count, source_id))
+
+			if connection.execute("SELECT name FROM shard.sqlite_master WHERE name = 'variant_bin_contigs';").fetchone() is not None:
+				connection.execute("INSERT OR IGNORE INTO contigs SELECT CHROM, length FROM shard.variant_bin_contigs;")
+			connection.executemany("INSERT OR IGNORE INTO info_fields VALUES (?, ?, ?, ?);",
+								   [(info_id,) + definition for info_id, definition in result['info_fields'].items()])
+			create_df_view(connection)
+	finally:
+		connection.execute("DETACH DATABASE shard;")
+	return variant_count
+
+
+def batch_ingest(vcf_files, cohort_file, config, nb_workers=None, progress=None):
+	"""
+	Converts VCFs into the cohort database cohort_file, created if needed, with
+	nb_workers worker processes (one per CPU by default, and no more than the
+	annotation chains that fit in max_memory when annotating). progress, if
+	given, is called with the result of each VCF, the number of VCFs done and
+	their total number. Returns a dictionary summarising the batch.
+	"""
+	start_time = time.perf_counter()
+	started = time.strftime("%Y-%m-%d %H:%M:%S")
+	connection = sqlite3.connect(cohort_file)
+	create_cohort_tables(connection)
+	create_df_view(connection)
+	connection.commit()
+
+	ingested_files = set(path for path, in connection.execute("SELECT path FROM sources WHERE status = 'ok';"))
+	pending_files = [vcf_file for vcf_file in vcf_files if os.path.abspath(vcf_file) not in ingested_files]
+	summary = {'files': len(vcf_files), 'ingested': 0, 'failed': 0, 'skipped': len(vcf_files) - len(pending_files),
+			   'variants': 0, 'new_variants': 0, 'bytes': 0, 'worker_seconds': 0.0}
+	variants_before = connection.execute("SELECT COUNT(*) FROM variants;").fetchone()[0]
+
+	if nb_workers is None:
+		nb_workers = os.cpu_count() or 1
+	nb_workers = max(1, min(nb_workers, len(pending_files)))
+	worker_config = dict(config)
+	if config['auto_annotate']:
+		# every worker runs its own chain of annotation JVMs, each needing some
+		# memory, so only as many workers as chains fit in the memory run at once
+		annotation_stages = pipeline.Pipeline(config).annotation_stages()
+		nb_workers = max(1, min(nb_workers, int(float(config['max_memory'])) // annotation.chain_memory(annotation_stages)))
+		worker_config['max_memory'] = max(1, float(config['max_memory']) / nb_workers)
+
+	batch_dir = tempfile.mkdtemp(prefix="metallaxis_batch_", dir=config['working_dir'])
+	nb_done = 0
+
+	def add_result(result):
+		nonlocal nb_done
+		vcf_file = result['file']
+		if result['error'] is None:
+			try:
+				result['variant_count'] = merge_shard(connection, result)
+			except sqlite3.Error as error_message:
+				result['error'] = "Could not add to " + str(cohort_file) + ": " + str(error_message)
+			finally:
+				os.remove(result['shard'])
+		if result['error'] is not None:
+			with connection:
+				record_source(connection, vcf_file, "failed", result['messages'] + [result['error']], None, result['seconds'])
+			summary['failed'] += 1
+		else:
+			summary['ingested'] += 1
+			summary['variants'] += result['variant_count']
+			summary['bytes'] += os.path.getsize(vcf_file)
+		summary['worker_seconds'] += result['seconds'] or 0
+		nb_done += 1
+		if progress is not None:
+			progress(result, nb_done, len(pending_files))
+
+	def ingest_in_pool(file_nbs, nb_pool_workers):
+		"""
+		Converts VCFs in a new process pool, and yields the file number and
+		result of each, the result being None if the pool broke before it.
+		"""
+		with ProcessPoolExecutor(max_workers=nb_pool_workers) as executor:
+			ingesting_files = {executor.submit(ingest_file, pending_files[file_nb], worker_config,
+											   os.path.join(batch_dir, str(file_nb) + ".sqlite")): file_nb for file_nb in file_nbs}
+			for ingested_file in as_completed(ingesting_files):
+				try:
+					yield ingesting_files[ingested_file], ingested_file.result()
+				except BrokenProcessPool:
+					yield ingesting_files[ingested_file], None
+
+	file_nb_groups = [list(range(len(pending_files)))]
+	if config['auto_annotate'] and pending_files:
+		# the first VCF downloads the annotation databases, the others wait for it
+		file_nb_groups = [[0], list(range(1, len(pending_files)))]
+	try:
+		for file_nbs in file_nb_groups:
+			broken_file_nbs = []
+			for file_nb, result in ingest_in_pool(file_nbs, nb_workers):
+				if result is None:
+					broken_file_nbs.append(file_nb)
+				else:
+					add_result(result)
+			# a worker that dies breaks its whole pool, failing every VCF that was
+			# still being converted, so these are converted again one at a time to
+			# only fail the VCF that kills its worker
+			for broken_file_nb in broken_file_nbs:
+				retried_results = ingest_in_pool([broken_file_nb], 1) if len(file_nbs) > 1 else [(broken_file_nb, None)]
+				for file_nb, result in retried_results:
+					if result is None:
+						result = {'file': pending_files[file_nb], 'shard': None, 'error': "Worker process died (out of memory?)",
+								  'messages': [], 'seconds': None}
+					add_result(result)
+	finally:
+		shutil.rmtree(batch_dir, ignore_errors=True)
+
+	summary['new_variants'] = connection.execute("SELECT COUNT(*) FROM variants;").fetchone()[0] - variants_before
+	summary['seconds'] = time.perf_counter() - start_time
+	summary['variants_per_second'] = summary['variants'] / summary['seconds']
+	summary['megabytes_per_second'] = summary['bytes'] / (1024 * 1024) / summary['seconds']
+	with connection:
+		connection.execute("INSERT INTO batch_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+						   (started, summary['files'], summary['ingested'], summary['failed'], summary['skipped'],
+							summary['variants'], summary['new_variants'], summary['seconds']))
+	connection.close()
+	return summary
+
+
+def describe_summary(summary):
+	"""
+	Returns the lines of text describing the throughput of a batch.
+	"""
+	lines = [str(summary['ingested']) + " of " + str(summary['files']) + " VCFs ingested, " + str(summary['failed']) + " failed, " +
+			 str(summary['skipped']) + " already ingested",
+			 str(summary['variants']) + " variants (" + str(summary['new_variants']) + " new distinct variants) in " +
+			 format(summary['seconds'], '.1f') + " s",
+			 format(summary['variants_per_second'], '.0f') + " variants/s, " + format(summary['megabytes_per_second'], '.2f') + " Mb/s of VCF"]
+	if summary['seconds'] > 0 and summary['worker_seconds'] > 0:
+		lines.append(format(summary['worker_seconds'] / summary['seconds'], '.1f') + " VCFs converted at once on average")
+	return lines
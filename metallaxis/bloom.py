@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+bloom.py - Bloom filter of the variants known to dbSNP.
+
+Flagging novel variants by looking every variant up in dbSNP is slow, so the
+(CHROM, POS, REF, ALT) of every dbSNP variant is hashed once into a Bloom
+filter stored on disk. At ingest the filter is memory-mapped and whole chunks
+of variants are tested at once with numpy. A Bloom filter never misses a
+variant it contains, but can claim a variant it doesn't, so only the variants
+it reports have to be checked exactly in dbSNP.
+
+The filter file is a small header (magic, number of bits, number of hashes,
+number of variants, size and modification time of the dbSNP file it was built
+from) followed by the bit array.
+"""
+
+import gzip
+import itertools
+import math
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+filter_magic = b'MXBLOOM1'
+filter_header_format = '<8sQIQQQ'
+filter_header_size = struct.calcsize(filter_header_format)
+
+# the two independent hashes combined into the filter's hashes
+first_hash_key = "metallaxisbloom1"
+second_hash_key = "metallaxisbloom2"
+
+
+def normalise_contigs(contigs):
+	"""
+	Returns a pandas Series of contig names with any 'chr' prefix and the zero
+	padding used for sorting removed, and 'M' renamed to 'MT'.
+	"""
+	contigs = contigs.astype(str).str.replace(r'^chr', '', regex=True).str.replace(r'^0+(?=\d)', '', regex=True)
+	return contigs.where(contigs != 'M', 'MT')
+
+
+def variant_hashes(chroms, positions, refs, alts):
+	"""
+	Returns two arrays of 64 bit hashes of the given variants, one ALT each.
+	"""
+	variant_keys = (normalise_contigs(pd.Series(chroms)).values + ":" + pd.Series(positions).astype(str).values + ":" +
+					pd.Series(refs).astype(str).values + ":" + pd.Series(alts).astype(str).values)
+	variant_keys = pd.Series(variant_keys)
+	first_hashes = pd.util.hash_pandas_object(variant_keys, index=False, hash_key=first_hash_key).values
+	# an odd step visits different bits for every hash
+	second_hashes = pd.util.hash_pandas_object(variant_keys, index=False, hash_key=second_hash_key).values | np.uint64(1)
+	return first_hashes, second_hashes
+
+
+def split_alts(alts):
+	"""
+	Returns a numpy array of the ALTs of the given variants, one per comma
+	separated ALT, and the number of ALTs of each variant.
+	"""
+	alt_lists = pd.Series(alts, dtype=object).astype(str).str.split(',').values
+	nb_alts = np.array([len(alt_list) for alt_list in alt_lists], dtype=np.int64)
+	return np.array(list(itertools.chain.from_iterable(alt_lists)), dtype=object), nb_alts
+
+
+def bit_positions(first_hashes, second_hashes, nb_bits, nb_hashes):
+	"""
+	Returns a (nb_hashes, nb_variants) array of the filter bits of each variant,
+	derived from two hashes by double hashing.
+	"""
+	hash_numbers = np.arange(nb_hashes, dtype=np.uint64)[:, None]
+	# uint64 arithmetic wraps around, which is fine for hashing
+	with np.errstate(over='ignore'):
+		return (first_hashes[None, :] + hash_numbers * second_hashes[None, :]) % np.uint64(nb_bits)
+
+
+def filter_size(expected_variants, false_positive_rate):
+	"""
+	Returns a tuple of the optimal number of bits and of hashes for a filter
+	of expected_variants variants with the given false positive rate.
+	"""
+	expected_variants = max(1, expected_variants)
+	nb_bits = int(math.ceil(-expected_variants * math.log(false_positive_rate) / (math.log(2) ** 2)))
+	# round up to whole bytes
+	nb_bits = ((nb_bits + 7) // 8) * 8
+	nb_hashes = max(1, int(round(nb_bits / expected_variants * math.log(2))))
+	return nb_bits, nb_hashes
+
+
+def count_records(vcf_file):
+	"""
+	Returns the number of records in a (possibly gzipped) VCF.
+	"""
+	with open(vcf_file, 'rb') as magic_check:
+		is_gzipped = magic_check.read(2) == b'\x1f\x8b'
+	vcf_read_obj = gzip.open(vcf_file, 'rb') if is_gzipped else open(vcf_file, 'rb')
+	nb_lines, nb_header_lines = 0, 0
+	with vcf_read_obj:
+		for line in vcf_read_obj:
+			if not line.startswith(b'#'):
+				nb_lines = 1
+				break
+			nb_header_lines += 1
+		for vcf_chunk in iter(lambda: vcf_read_obj.read(16 * 1024 * 1024), b''):
+			nb_lines += vcf_chunk.count(b'\n')
+	return nb_lines, nb_header_lines
+
+
+def build_bloom_filter(vcf_file, filter_file, false_positive_rate=0.01, chunk_size=1000000, progress=None):
+	"""
+	Builds a Bloom filter of the (CHROM, POS, REF, ALT) of every variant of a
+	VCF such as dbSNP, streaming the VCF in chunks of chunk_size records.
+	progress, if given, is called with the number of records added so far and
+	the total number of records. Returns the number of variants added.
+	"""
+	nb_records, nb_header_lines = count_records(vcf_file)
+	# multi-allelic records add one variant per ALT, so leave some room for them
+	nb_bits, nb_hashes = filter_size(int(nb_records * 1.1), false_positive_rate)
+
+	# build into a temporary file so an interrupted build never replaces a good one
+	temporary_file = filter_file + ".building"
+	with open(temporary_file, 'wb') as filter_write_obj:
+		filter_write_obj.write(b'\x00' * filter_header_size)
+		filter_write_obj.truncate(filter_header_size + nb_bits // 8)
+	filter_bits = np.memmap(temporary_file, dtype=np.uint8, mode='r+', offset=filter_header_size, shape=(nb_bits // 8,))
+
+	nb_variants, nb_added_records = 0, 0
+	vcf_chunks = pd.read_csv(vcf_file, sep="\t", header=None, usecols=[0, 1, 3, 4], names=['CHROM', 'POS', 'REF', 'ALT'],
+							 skiprows=nb_header_lines, chunksize=chunk_size, dtype=str, compression='infer')
+	for vcf_chunk in vcf_chunks:
+		nb_added_records += len(vcf_chunk)
+		alts, nb_alts = split_alts(vcf_chunk['ALT'].values)
+		first_hashes, second_hashes = variant_hashes(np.repeat(vcf_chunk['CHROM'].values, nb_alts), np.repeat(vcf_chunk['POS'].values, nb_alts),
+													 np.repeat(vcf_chunk['REF'].values, nb_alts), alts)
+		variant_bits = bit_positions(first_hashes, second_hashes, nb_bits, nb_hashes).ravel()
+		np.bitwise_or.at(filter_bits, (variant_bits >> np.uint64(3)).astype(np.int64),
+						 np.left_shift(1, (variant_bits & np.uint64(7)).astype(np.uint8)).astype(np.uint8))
+		nb_variants += len(alts)
+		if progress is not None:
+			progress(nb_added_records, nb_records)
+
+	filter_bits.flush()
+	del filter_bits
+	with open(temporary_file, 'r+b') as filter_write_obj:
+		filter_write_obj.write(struct.pack(filter_header_format, filter_magic, nb_bits, nb_hashes, nb_variants,
+										   os.path.getsize(vcf_file), int(os.path.getmtime(vcf_file))))
+	os.replace(temporary_file, filter_file)
+	return nb_variants
+
+
+def is_filter_current(filter_file, vcf_file):
+	"""
+	Returns whether a Bloom filter exists and was built from the current
+	version of a VCF.
+	"""
+	if not os.path.isfile(filter_file) or not os.path.isfile(vcf_file):
+		return False
+	try:
+		with BloomFilter(filter_file) as bloom_filter:
+			return (bloom_filter.source_size, bloom_filter.source_mtime) == (os.path.getsize(vcf_file), int(os.path.getmtime(vcf_file)))
+	except ValueError:
+		return False
+
+
+class BloomFilter:
+	def __init__(self, filter_file):
+		with open(filter_file, 'rb') as filter_read_obj:
+			filter_header = filter_read_obj.read(filter_header_size)
+		if len(filter_header) < filter_header_size or not filter_header.startswith(filter_magic):
+			raise ValueError(str(filter_file) + " is not a Metallaxis Bloom filter")
+		(magic, self.nb_bits, self.nb_hashes, self.nb_variants,
+		 self.source_size, self.source_mtime) = struct.unpack(filter_header_format, filter_header)
+		# the bits are paged in by the OS as lookups need them
+		self.filter_bits = np.memmap(filter_file, dtype=np.uint8, mode='r', offset=filter_header_size, shape=(self.nb_bits // 8,))
+
+	def close(self):
+		del self.filter_bits
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def contains_variants(self, chroms, positions, refs, alts):
+		"""
+		Returns a boolean numpy array, True for the variants that may be in the
+		filter and False for those that certainly aren't. A variant with several
+		comma separated ALTs may be in the filter if any of its ALTs is.
+		"""
+		if len(alts) == 0:
+			return np.zeros(0, dtype=bool)
+		# one row per ALT, the ALTs of a variant following each other
+		alts, nb_alts = split_alts(alts)
+		first_hashes, second_hashes = variant_hashes(np.repeat(np.asarray(chroms, dtype=object), nb_alts),
+													 np.repeat(np.asarray(positions, dtype=object), nb_alts),
+													 np.repeat(np.asarray(refs, dtype=object), nb_alts), alts)
+		variant_bits = bit_positions(first_hashes, second_hashes, self.nb_bits, self.nb_hashes)
+		bit_is_set = (self.filter_bits[(variant_bits >> np.uint64(3)).astype(np.int64)] >> (variant_bits & np.uint64(7)).astype(np.uint8)) & 1
+		alt_in_filter = bit_is_set.all(axis=0)
+		# every variant has at least one ALT, so each of them starts a non-empty run
+		return np.logical_or.reduceat(alt_in_filter, np.cumsum(nb_alts) - nb_alts)
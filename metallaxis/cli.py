@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+cli.py - Command line of Metallaxis, for machines without a display.
+
+python3 -m metallaxis ingest|batch|stats|query|export runs without loading Qt
+or matplotlib: VCFs are converted into session databases on the command line
+(for instance on a cluster), and opened in the interface afterwards.
+
+ingest     converts a VCF into a session database
+batch      converts many VCFs into a cohort database (see batch_ingest.py)
+stats      prints the statistics of a session
+query      prints the rows returned by an SQL query on a session
+export     writes the variants of a session, or of a query, to a TSV or CSV
+compare    prints the intersection, difference or union of sessions' variants
+
+Exit codes are 0 on success, 1 if the command failed and 2 if it was used
+incorrectly.
+"""
+
+import argparse
+import csv
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+
+import yaml
+
+from metallaxis import approximate_stats
+from metallaxis import batch_ingest
+from metallaxis import pipeline
+from metallaxis import session_compare
+from metallaxis import vcf_stats
+
+commands = ['ingest', 'batch', 'stats', 'query', 'export', 'compare']
+
+# settings used when the interface was never run to save any
+default_config = {
+	'working_dir': pipeline.config_directory,
+	'vcf_chunk_size': 10000,
+	'auto_annotate': False,
+	'max_memory': 5,
+	'genome_version': 'GRCh38.86',
+	'organism': 'homo_sapiens',
+}
+
+
+class CommandError(Exception):
+	pass
+
+
+class TextHooks(pipeline.PipelineHooks):
+	"""
+	Prints the progress of the pipeline to stderr, unless quiet, and
+	remembers whether it reported an error.
+	"""
+	def __init__(self, quiet=False):
+		self.quiet = quiet
+		self.failed = False
+
+	def progress(self, percent, message):
+		if not self.quiet:
+			super().progress(percent, message)
+
+	def error(self, message):
+		self.failed = True
+		super().error(message)
+
+
+def read_settings(config_file):
+	"""
+	Returns the settings of a settings file, completed with the default ones.
+	"""
+	config = dict(default_config)
+	if config_file is None:
+		config_file = pipeline.config_file
+		if not os.path.isfile(config_file):
+			return config
+	try:
+		config.update(pipeline.load_config(config_file) or {})
+	except (OSError, yaml.YAMLError) as error_message:
+		raise CommandError("Can't read settings from " + str(config_file) + ": " + str(error_message))
+	return config
+
+
+def open_session(session_file, read_only=False):
+	if not os.path.isfile(session_file):
+		raise CommandError("Session file does not exist: " + str(session_file))
+	if read_only:
+		return sqlite3.connect(pathlib.Path(os.path.abspath(session_file)).as_uri() + "?mode=ro", uri=True)
+	return sqlite3.connect(session_file)
+
+
+def ingest_settings(arguments):
+	"""
+	Returns the settings of the ingest and batch commands, with the options
+	that override them.
+	"""
+	config = read_settings(arguments.config)
+	if arguments.annotate is not None:
+		config['auto_annotate'] = arguments.annotate
+	if arguments.approximate:
+		config['approximate_stats'] = True
+	if arguments.working_dir is not None:
+		config['working_dir'] = arguments.working_dir
+	os.makedirs(config['working_dir'], exist_ok=True)
+	return config
+
+
+def ingest(arguments):
+	config = ingest_settings(arguments)
+	session_file = arguments.output
+	if session_file is None:
+		session_name = os.path.basename(arguments.vcf)
+		for extension in ('.xz', '.gz', '.bz2', '.vcf'):
+			if session_name.endswith(extension):
+				session_name = session_name[:-len(extension)]
+		session_file = session_name + ".sqlite"
+	if os.path.exists(session_file):
+		if not arguments.force:
+			raise CommandError(str(session_file) + " already exists, use --force to replace it")
+		os.remove(session_file)
+
+	hooks = TextHooks(arguments.quiet)
+	ingest_pipeline = pipeline.Pipeline(config, hooks, session_file)
+	session_connection = ingest_pipeline.ingest(arguments.vcf)
+	if session_connection is None or hooks.failed:
+		return 1
+	nb_variants = session_connection.execute("SELECT COUNT(*) FROM df;").fetchone()[0]
+	session_connection.close()
+	print("Wrote " + str(nb_variants) + " variants to " + str(session_file), file=sys.stderr)
+	return 0
+
+
+def batch(arguments):
+	config = ingest_settings(arguments)
+	try:
+		vcf_files = batch_ingest.find_vcfs(arguments.input)
+	except OSError as error_message:
+		raise CommandError("Can't read the list of VCFs: " + str(error_message))
+	if not vcf_files:
+		raise CommandError("No VCF found in " + str(arguments.input))
+
+	def batch_progress(result, nb_done, nb_files):
+		if result['error'] is not None:
+			print("[" + str(nb_done) + "/" + str(nb_files) + "] " + result['file'] + " failed: " + result['error'], file=sys.stderr)
+		elif not arguments.quiet:
+			print("[" + str(nb_done) + "/" + str(nb_files) + "] " + result['file'] + ": " + str(result['variant_count']) + " variants in " +
+				  format(result['seconds'], '.1f') + " s", file=sys.stderr)
+
+	try:
+		summary = batch_ingest.batch_ingest(vcf_files, arguments.output, config, arguments.jobs, progress=batch_progress)
+	except sqlite3.Error as error_message:
+		raise CommandError("Can't write to " + str(arguments.output) + ": " + str(error_message))
+	for line in batch_ingest.describe_summary(summary):
+		print(line, file=sys.stderr)
+	return 1 if summary['failed'] > 0 else 0
+
+
+def stats(arguments):
+	session_connection = open_session(arguments.session)
+	try:
+		session_stats = {'summary': {}, 'estimates': {}}
+		has_summary = session_connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'stats_summary';").fetchone()
+		if has_summary is not None:
+			session_stats['summary'] = dict(session_connection.execute("SELECT metric, value FROM stats_summary ORDER BY rowid;").fetchall())
+		else:
+			# sessions from before the typed statistics only have these
+			session_stats['summary'] = {tag: value for tag, value in vcf_stats.load_stat_values(session_connection).items()
+										if not isinstance(value, (set, list, dict))}
+		for metric, estimate, error, error_kind, exact in approximate_stats.load_estimates(session_connection):
+			session_stats['estimates'][metric] = {'estimate': estimate, 'error': error, 'error_kind': error_kind, 'exact': exact}
+	except sqlite3.Error as error_message:
+		raise CommandError("Can't read statistics of " + str(arguments.session) + ": " + str(error_message))
+	finally:
+		session_connection.close()
+
+	if arguments.json:
+		json.dump(session_stats, sys.stdout, indent=2)
+		print()
+		return 0
+	for metric, value in session_stats['summary'].items():
+		print(metric + "\t" + ("NA" if value is None else format(value, 'g') if isinstance(value, float) else str(value)))
+	for metric, estimate in session_stats['estimates'].items():
+		print(approximate_stats.describe_estimate(metric, estimate['estimate'], estimate['error'], estimate['error_kind'], estimate['exact']))
+	return 0
+
+
+def write_rows(cursor, output, output_format):
+	"""
+	Writes the rows of an executed query, with a header line, as TSV or CSV.
+	Returns the number of rows written.
+	"""
+	row_writer = csv.writer(output, delimiter="\t" if output_format == 'tsv' else ",", lineterminator="\n")
+	row_writer.writerow([column[0] for column in cursor.description])
+	nb_rows = 0
+	for row in cursor:
+		row_writer.writerow(["" if value is None else value for value in row])
+		nb_rows += 1
+	return nb_rows
+
+
+def query(arguments):
+	session_connection = open_session(arguments.session)
+	try:
+		cursor = session_connection.execute(arguments.sql)
+		if cursor.description is not None:
+			write_rows(cursor, sys.stdout, arguments.format)
+	except sqlite3.Error as error_message:
+		raise CommandError("Query failed: " + str(error_message))
+	finally:
+		session_connection.close()
+	return 0
+
+
+def export(arguments):
+	output_format = arguments.format
+	if output_format is None:
+		output_format = 'csv' if arguments.output.endswith(".csv") else 'tsv'
+	# the filter is the user's SQL, which mustn't change the session
+	session_connection = open_session(arguments.session, read_only=True)
+	try:
+		cursor = session_connection.execute(arguments.filter if arguments.filter is not None else "SELECT * FROM df;")
+		if cursor.description is None:
+			raise CommandError("The filter must be a SELECT query")
+		with open(arguments.output, 'w', newline='') as output:
+			nb_rows = write_rows(cursor, output, output_format)
+	except sqlite3.Error as error_message:
+		raise CommandError("Export failed: " + str(error_message))
+	finally:
+		session_connection.close()
+	print("Wrote " + str(nb_rows) + " variants to " + str(arguments.output), file=sys.stderr)
+	return 0
+
+
+def compare(arguments):
+	session_connection = open_session(arguments.session)
+	try:
+		schemas = session_compare.attach_sessions(session_connection, arguments.others)
+		cursor = session_connection.execute(session_compare.comparison_query(arguments.operation, schemas, [arguments.session] + arguments.others))
+		if arguments.output is None:
+			write_rows(cursor, sys.stdout, arguments.format)
+			return 0
+		with open(arguments.output, 'w', newline='') as output:
+			nb_rows = write_rows(cursor, output, arguments.format)
+	except FileNotFoundError as error_message:
+		raise CommandError(str(error_message))
+	except sqlite3.Error as error_message:
+		raise CommandError("Comparison failed: " + str(error_message))
+	finally:
+		session_connection.close()
+	print("Wrote " + str(nb_rows) + " variants to " + str(arguments.output), file=sys.stderr)
+	return 0
+
+
+def argument_parser():
+	parser = argparse.ArgumentParser(prog="python3 -m metallaxis", description="Command line of Metallaxis, run without a command to open the interface.")
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	# options shared by the ingest and batch commands
+	settings_parser = argparse.ArgumentParser(add_help=False)
+	settings_parser.add_argument('--config', help="settings file (default: the one saved by the interface)")
+	settings_parser.add_argument('--working-dir', help="directory of temporary files and annotation databases")
+	settings_parser.add_argument('--annotate', dest='annotate', action='store_true', default=None, help="annotate the VCFs")
+	settings_parser.add_argument('--no-annotate', dest='annotate', action='store_false', help="don't annotate the VCFs")
+	settings_parser.add_argument('--approximate', action='store_true', help="also estimate distinct counts and quantiles")
+	settings_parser.add_argument('-q', '--quiet', action='store_true', help="don't print progress")
+
+	ingest_parser = subparsers.add_parser('ingest', parents=[settings_parser], help="convert a VCF (optionally compressed) into a session database")
+	ingest_parser.add_argument('vcf')
+	ingest_parser.add_argument('-o', '--output', help="session database to write (default: named after the VCF, in the current directory)")
+	ingest_parser.add_argument('-f', '--force', action='store_true', help="replace the session database if it exists")
+	ingest_parser.set_defaults(command_function=ingest)
+
+	batch_parser = subparsers.add_parser('batch', parents=[settings_parser], help="convert the VCFs of a directory, or listed in a manifest file, into a cohort database")
+	batch_parser.add_argument('input', help="directory of VCFs, or file listing one VCF per line")
+	batch_parser.add_argument('-o', '--output', required=True, help="cohort database, created or added to")
+	batch_parser.add_argument('-j', '--jobs', type=int, help="number of VCFs converted at once (default: number of CPUs)")
+	batch_parser.set_defaults(command_function=batch)
+
+	stats_parser = subparsers.add_parser('stats', help="print the statistics of a session")
+	stats_parser.add_argument('session')
+	stats_parser.add_argument('--json', action='store_true', help="print as JSON")
+	stats_parser.set_defaults(command_function=stats)
+
+	query_parser = subparsers.add_parser('query', help="print the result of an SQL query on a session, e.g. \"SELECT * FROM df WHERE CHROM == '01'\"")
+	query_parser.add_argument('session')
+	query_parser.add_argument('sql')
+	query_parser.add_argument('--format', choices=['tsv', 'csv'], default='tsv')
+	query_parser.set_defaults(command_function=query)
+
+	export_parser = subparsers.add_parser('export', help="write the variants of a session to a TSV or CSV file")
+	export_parser.add_argument('session')
+	export_parser.add_argument('output')
+	export_parser.add_argument('--filter', help="SELECT query of the variants to export (default: all)")
+	export_parser.add_argument('--format', choices=['tsv', 'csv'], help="default: from the output's extension, else TSV")
+	export_parser.set_defaults(command_function=export)
+
+	compare_parser = subparsers.add_parser('compare', help="compare the variants of sessions by CHROM, POS, REF and ALT")
+	compare_parser.add_argument('session', help="session whose variants are compared with the others")
+	compare_parser.add_argument('others', nargs='+', metavar='other_session')
+	compare_parser.add_argument('--operation', choices=session_compare.operations, default='intersection',
+								help="intersection and difference give the variants of the first session in all or none of the others, "
+									 "union the variants of any session with a presence column per session (default: intersection)")
+	compare_parser.add_argument('-o', '--output', help="file to write instead of printing")
+	compare_parser.add_argument('--format', choices=['tsv', 'csv'], default='tsv')
+	compare_parser.set_defaults(command_function=compare)
+	return parser
+
+
+def main(argv):
+	arguments = argument_parser().parse_args(argv)
+	try:
+		return arguments.command_function(arguments)
+	except CommandError as error_message:
+		print("Error: " + str(error_message), file=sys.stderr)
+		return 1
+	except BrokenPipeError:
+		# output piped to a command that stopped reading, like head
+		return 0
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+download.py - Resumable, parallel downloads of annotation databases.
+
+Large files are downloaded as several byte ranges at once, each written to its
+own part file next to the destination. An interrupted download resumes each
+part from where it stopped. Once every part is complete they are joined,
+checked against the expected size (and md5 checksum when the server publishes
+one), and only then renamed to the destination, so a file at the destination
+is always a complete download.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+download_chunk_size = 1024 * 1024
+
+
+class DownloadError(Exception):
+	"""
+	Raised when a file can't be downloaded, or fails verification.
+	"""
+	pass
+
+
+def remote_file_info(url, session):
+	"""
+	Returns a tuple of the size of a remote file (or None if unknown), and
+	whether the server accepts byte range requests for it.
+	"""
+	head_request = session.head(url, allow_redirects=True, timeout=60)
+	head_request.raise_for_status()
+	remote_size = head_request.headers.get('Content-Length')
+	accepts_ranges = head_request.headers.get('Accept-Ranges', '').lower() == 'bytes'
+	return (int(remote_size) if remote_size is not None else None), accepts_ranges
+
+
+def remote_md5(url, session):
+	"""
+	Returns the md5 checksum published next to a file (as NCBI does in a .md5
+	file), or None if there isn't one.
+	"""
+	try:
+		md5_request = session.get(url + ".md5", timeout=60)
+	except requests.RequestException:
+		return None
+	if not md5_request.ok or not md5_request.text.strip():
+		return None
+	return md5_request.text.split()[0].lower()
+
+
+def file_md5(file_path):
+	md5_hash = hashlib.md5()
+	with open(file_path, 'rb') as file_read_obj:
+		for file_chunk in iter(lambda: file_read_obj.read(download_chunk_size), b''):
+			md5_hash.update(file_chunk)
+	return md5_hash.hexdigest()
+
+
+def download_segment(url, part_file, segment_start, segment_end, session, downloaded_bytes, stop_event):
+	"""
+	Downloads the closed byte range [segment_start, segment_end] of a file into
+	part_file, resuming after the bytes already in part_file. downloaded_bytes
+	is a one item list kept updated with the size of part_file.
+	"""
+	part_size = 0
+	if segment_end is not None and os.path.isfile(part_file):
+		part_size = os.path.getsize(part_file)
+	downloaded_bytes[0] = part_size
+	if segment_end is not None and segment_start + part_size > segment_end:
+		return
+
+	headers = {}
+	if segment_end is not None:
+		headers['Range'] = "bytes=" + str(segment_start + part_size) + "-" + str(segment_end)
+	with session.get(url, headers=headers, stream=True, timeout=60) as segment_request:
+		segment_request.raise_for_status()
+		if segment_end is not None and segment_request.status_code != 206:
+			raise DownloadError("Server ignored range request for " + url)
+		# without ranges the download can't be resumed, so it starts over
+		with open(part_file, 'ab' if segment_end is not None else 'wb') as part_write_obj:
+			for segment_chunk in segment_request.iter_content(download_chunk_size):
+				if stop_event.is_set():
+					return
+				part_write_obj.write(segment_chunk)
+				downloaded_bytes[0] += len(segment_chunk)
+
+
+def download_file(url, output_path, nb_segments=4, expected_md5=None, progress=None, session=None):
+	"""
+	Downloads url to output_path in nb_segments parallel byte ranges, resuming
+	any previous interrupted download of the same file. progress, if given, is
+	regularly called with the number of downloaded bytes and the total size (or
+	None if unknown), always from the calling thread. Raises DownloadError if
+	the download fails or doesn't match the expected size or md5 checksum.
+	"""
+	if session is None:
+		session = requests.Session()
+	try:
+		remote_size, accepts_ranges = remote_file_info(url, session)
+	except requests.RequestException as error_message:
+		raise DownloadError("Could not reach " + url + ": " + str(error_message))
+
+	if remote_size is None or not accepts_ranges or remote_size < nb_segments * download_chunk_size:
+		nb_segments = 1
+	# the layout of the parts is kept, so that resuming downloads the same ranges
+	state_file = output_path + ".download"
+	download_state = {'url': url, 'size': remote_size, 'segments': nb_segments, 'ranges': accepts_ranges}
+	if os.path.isfile(state_file):
+		with open(state_file, 'r') as state_read_obj:
+			previous_state = json.load(state_read_obj)
+		if previous_state == dict(download_state, segments=previous_state.get('segments')):
+			download_state = previous_state
+		else:
+			remove_parts(output_path, previous_state.get('segments', 0))
+	with open(state_file, 'w') as state_write_obj:
+		json.dump(download_state, state_write_obj)
+	nb_segments = download_state['segments']
+
+	segments = []
+	for segment_nb in range(nb_segments):
+		part_file = output_path + ".part" + str(segment_nb)
+		if accepts_ranges and remote_size is not None:
+			segment_start = segment_nb * remote_size // nb_segments
+			segment_end = (segment_nb + 1) * remote_size // nb_segments - 1
+		else:
+			segment_start, segment_end = 0, None
+		segments.append((part_file, segment_start, segment_end, [0]))
+
+	stop_event = threading.Event()
+	with ThreadPoolExecutor(max_workers=nb_segments) as executor:
+		downloading_segments = [executor.submit(download_segment, url, part_file, segment_start, segment_end, session, downloaded_bytes, stop_event)
+								for part_file, segment_start, segment_end, downloaded_bytes in segments]
+		remaining_segments = set(downloading_segments)
+		try:
+			while remaining_segments:
+				finished_segments, remaining_segments = wait(remaining_segments, timeout=0.5, return_when=FIRST_COMPLETED)
+				for finished_segment in finished_segments:
+					finished_segment.result()
+				if progress is not None:
+					progress(sum(segment[3][0] for segment in segments), remote_size)
+		except (requests.RequestException, OSError) as error_message:
+			stop_event.set()
+			raise DownloadError("Download of " + url + " interrupted, it will resume on next attempt: " + str(error_message))
+		except BaseException:
+			stop_event.set()
+			raise
+
+	# join the parts, then verify them before the file takes its final name
+	joined_file = output_path + ".joined"
+	with open(joined_file, 'wb') as joined_write_obj:
+		for part_file, segment_start, segment_end, downloaded_bytes in segments:
+			with open(part_file, 'rb') as part_read_obj:
+				for part_chunk in iter(lambda: part_read_obj.read(download_chunk_size), b''):
+					joined_write_obj.write(part_chunk)
+
+	if remote_size is not None and os.path.getsize(joined_file) != remote_size:
+		os.remove(joined_file)
+		remove_parts(output_path, nb_segments)
+		raise DownloadError("Downloaded " + url + " has the wrong size, expected " + str(remote_size) + " bytes")
+	if expected_md5 is not None and file_md5(joined_file) != expected_md5.lower():
+		os.remove(joined_file)
+		remove_parts(output_path, nb_segments)
+		raise DownloadError("Downloaded " + url + " doesn't match its md5 checksum")
+
+	os.replace(joined_file, output_path)
+	remove_parts(output_path, nb_segments)
+	return output_path
+
+
+def remove_parts(output_path, nb_segments):
+	"""
+	Removes the part files and state of a download.
+	"""
+	for segment_nb in range(nb_segments):
+		if os.path.isfile(output_path + ".part" + str(segment_nb)):
+			os.remove(output_path + ".part" + str(segment_nb))
+	if os.path.isfile(output_path + ".download"):
+		os.remove(output_path + ".download")
+
+
+def ensure_downloaded(url, output_path, nb_segments=4, verify_md5=True, progress=None):
+	"""
+	Downloads url to output_path unless a complete copy is already there. An
+	existing file whose size doesn't match the remote file is downloaded again,
+	so truncated downloads are never used.
+	"""
+	session = requests.Session()
+	if os.path.isfile(output_path):
+		try:
+			remote_size, accepts_ranges = remote_file_info(url, session)
+		except requests.RequestException:
+			# offline, so trust the file we have
+			return output_path
+		if remote_size is None or os.path.getsize(output_path) == remote_size:
+			return output_path
+		os.remove(output_path)
+
+	expected_md5 = remote_md5(url, session) if verify_md5 else None
+	return download_file(url, output_path, nb_segments, expected_md5, progress, session)
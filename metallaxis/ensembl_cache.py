@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+ensembl_cache.py - On-disk cache of ENSEMBL gene overlap responses.
+
+Responses are stored in a sqlite database in the Metallaxis config directory,
+so they are shared by every analysis, session and process. Each response is
+keyed by organism, assembly, contig and region, and is dropped once older
+than the time to live, or when the cache grows beyond its maximum size, in
+which case the least recently used responses are removed first.
+"""
+
+import json
+import sqlite3
+import time
+
+from metallaxis import interval_index
+
+# ENSEMBL refuses overlap requests spanning more than 5Mb, so no cached
+# region can start further than this before the region it overlaps
+max_region_length = 5000000
+
+
+def merge_intervals(intervals):
+	"""
+	Returns a sorted list of disjoint (start, stop) intervals covering the same
+	positions as the given closed intervals.
+	"""
+	merged_intervals = []
+	for start, stop in sorted(intervals):
+		if merged_intervals and start <= merged_intervals[-1][1] + 1:
+			merged_intervals[-1] = (merged_intervals[-1][0], max(stop, merged_intervals[-1][1]))
+		else:
+			merged_intervals.append((start, stop))
+	return merged_intervals
+
+
+class ResponseCache:
+	def __init__(self, cache_file, ttl_days=30, max_size_mb=200):
+		self.cache_file = cache_file
+		self.ttl = float(ttl_days) * 24 * 60 * 60
+		self.max_size = int(float(max_size_mb) * 1024 * 1024)
+		connection = self.connect()
+		cursor = connection.cursor()
+		cursor.execute("CREATE TABLE IF NOT EXISTS responses (id INTEGER PRIMARY KEY, organism TEXT, assembly TEXT, chrom TEXT, "
+					   "start INTEGER, stop INTEGER, fetched_at REAL, last_access REAL, size INTEGER, body TEXT);")
+		cursor.execute("CREATE INDEX IF NOT EXISTS responses_region_idx ON responses (organism, assembly, chrom, start);")
+		cursor.execute("CREATE INDEX IF NOT EXISTS responses_access_idx ON responses (last_access);")
+		connection.commit()
+		connection.close()
+
+	def connect(self):
+		# WAL lets several Metallaxis processes read the cache while one writes
+		connection = sqlite3.connect(self.cache_file, timeout=30)
+		connection.execute("PRAGMA journal_mode=WAL;")
+		return connection
+
+	def lookup(self, organism, assembly, chrom, start, stop):
+		"""
+		Returns a tuple of the list of cached genes overlapping [start, stop],
+		and the list of (start, stop) gaps of the region that aren't cached.
+		"""
+		now = time.time()
+		connection = self.connect()
+		cursor = connection.cursor()
+		cursor.execute("SELECT id, start, stop, body FROM responses WHERE organism = ? AND assembly = ? AND chrom = ? "
+					   "AND start >= ? AND start <= ? AND stop >= ? AND fetched_at >= ?;",
+					   (organism, assembly, chrom, start - max_region_length, stop, start, now - self.ttl))
+		cached_responses = cursor.fetchall()
+
+		genes = {}
+		for response_id, response_start, response_stop, body in cached_responses:
+			for gene in json.loads(body):
+				gene_id = gene.get('gene_id') or gene.get('id')
+				if int(gene['end']) >= start and int(gene['start']) <= stop:
+					genes[gene_id] = gene
+
+		if cached_responses:
+			cursor.executemany("UPDATE responses SET last_access = ? WHERE id = ?;",
+							   [(now, cached_response[0]) for cached_response in cached_responses])
+			connection.commit()
+		connection.close()
+
+		covered_intervals = merge_intervals([(row[1], row[2]) for row in cached_responses])
+		gaps = interval_index.subtract_intervals(start, stop, covered_intervals)
+		return list(genes.values()), gaps
+
+	def store(self, organism, assembly, chrom, start, stop, genes):
+		"""
+		Stores the list of genes returned by ENSEMBL for a region, then evicts
+		expired or least recently used responses.
+		"""
+		now = time.time()
+		body = json.dumps(genes)
+		connection = self.connect()
+		connection.execute("INSERT INTO responses (organism, assembly, chrom, start, stop, fetched_at, last_access, size, body) "
+						   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",
+						   (organism, assembly, chrom, start, stop, now, now, len(body), body))
+		connection.commit()
+		self.evict(connection)
+		connection.close()
+
+	def evict(self, connection=None):
+		"""
+		Removes expired responses, then the least recently used responses until
+		the cache is no bigger than its maximum size.
+		"""
+		close_connection = connection is None
+		if connection is None:
+			connection = self.connect()
+		cursor = connection.cursor()
+		cursor.execute("DELETE FROM responses WHERE fetched_at < ?;", (time.time() - self.ttl,))
+		cursor.execute("SELECT coalesce(sum(size), 0) FROM responses;")
+		cache_size = cursor.fetchone()[0]
+		if cache_size > self.max_size:
+			cursor.execute("SELECT id, size FROM responses ORDER BY last_access;")
+			responses_to_evict = []
+			for response_id, size in cursor.fetchall():
+				if cache_size <= self.max_size:
+					break
+				responses_to_evict.append((response_id,))
+				cache_size -= size
+			cursor.executemany("DELETE FROM responses WHERE id = ?;", responses_to_evict)
+		connection.commit()
+		if close_connection:
+			connection.close()
+
+	def info(self):
+		"""
+		Returns a tuple of the number of cached responses and their total size
+		in bytes.
+		"""
+		connection = self.connect()
+		cursor = connection.cursor()
+		cursor.execute("SELECT count(*), coalesce(sum(size), 0) FROM responses;")
+		cache_info = cursor.fetchone()
+		connection.close()
+		return cache_info
+
+	def clear(self):
+		"""
+		Removes every cached response.
+		"""
+		connection = self.connect()
+		connection.execute("DELETE FROM responses;")
+		connection.commit()
+		connection.execute("VACUUM;")
+		connection.close()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+ensembl_client.py - Client for the ENSEMBL REST API.
+
+All requests go through one pooled keep-alive session, with timeouts, a shared
+request rate limit, and retries with exponential backoff. ENSEMBL's rate limit
+headers are honoured: Retry-After on rejected requests, and X-RateLimit-Reset
+once X-RateLimit-Remaining reaches zero. The base URL can point at a local
+mirror or mock server for air-gapped deployments and tests.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+default_rest_url = "https://rest.ensembl.org"
+
+
+class EnsemblError(Exception):
+	"""
+	Raised when ENSEMBL can't answer a request, even after retrying.
+	"""
+	pass
+
+
+class RateLimiter:
+	"""
+	Blocks callers so that no more than requests_per_second requests start
+	each second, whichever thread they are made from. Can also be paused
+	until a given time when the server asks us to slow down.
+	"""
+	def __init__(self, requests_per_second):
+		self.interval = 1.0 / float(requests_per_second)
+		self.next_request_time = time.monotonic()
+		self.lock = threading.Lock()
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			wait_time = self.next_request_time - now
+			self.next_request_time = max(now, self.next_request_time) + self.interval
+		if wait_time > 0:
+			time.sleep(wait_time)
+
+	def pause(self, seconds):
+		with self.lock:
+			self.next_request_time = max(self.next_request_time, time.monotonic() + seconds)
+
+
+class EnsemblClient:
+	def __init__(self, rest_url=default_rest_url, timeout=30, retries=4, backoff=1.0, max_workers=4, requests_per_second=10):
+		self.rest_url = rest_url.rstrip('/')
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.max_workers = max_workers
+		self.rate_limiter = RateLimiter(requests_per_second)
+
+		# keep one connection per worker alive between requests
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		self.session.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+
+	def get(self, endpoint):
+		"""
+		Requests an endpoint of the REST API, and returns its decoded JSON. Raises
+		EnsemblError if the request still fails after all retries.
+		"""
+		request_url = self.rest_url + endpoint
+		for attempt in range(self.retries + 1):
+			self.rate_limiter.wait()
+			retry_after = None
+			try:
+				api_request = self.session.get(request_url, timeout=self.timeout)
+			except (requests.ConnectionError, requests.Timeout) as request_error:
+				error_message = "Could not reach ENSEMBL at " + self.rest_url + ": " + str(request_error)
+			else:
+				# slow everyone down before the server starts refusing requests
+				if api_request.headers.get('X-RateLimit-Remaining') == '0':
+					self.rate_limiter.pause(float(api_request.headers.get('X-RateLimit-Reset', 1)))
+				if api_request.ok:
+					return api_request.json()
+
+				error_message = "ENSEMBL rejected API call (status " + str(api_request.status_code) + "): " + api_request.text[:200]
+				# client errors other than rate limiting won't succeed on retry
+				if api_request.status_code != 429 and api_request.status_code < 500:
+					raise EnsemblError(error_message)
+				if 'Retry-After' in api_request.headers:
+					retry_after = float(api_request.headers['Retry-After'])
+
+			if attempt == self.retries:
+				raise EnsemblError(error_message)
+			if retry_after is not None:
+				self.rate_limiter.pause(retry_after)
+			else:
+				time.sleep(self.backoff * (2 ** attempt))
+
+	def overlap_genes(self, organism, chrom, start, stop):
+		"""
+		Returns the list of genes overlapping a region of a chromosome.
+		"""
+		return self.get("/overlap/region/" + organism + "/" + str(chrom) + ":" + str(start) + "-" + str(stop) + "?feature=gene")
+
+	def overlap_genes_many(self, organism, chrom, regions):
+		"""
+		Requests the genes of several (start, stop) regions of a chromosome
+		concurrently. Returns the lists of genes in the order of the regions, or
+		raises the first EnsemblError encountered.
+		"""
+		if len(regions) == 1:
+			return [self.overlap_genes(organism, chrom, regions[0][0], regions[0][1])]
+		with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			requested_regions = [executor.submit(self.overlap_genes, organism, chrom, start, stop) for start, stop in regions]
+			return [requested_region.result() for requested_region in requested_regions]
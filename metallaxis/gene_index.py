@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+gene_index.py - Spatial index of gene positions.
+
+Genes are stored once per gene_id in the chrom_genes table, and their
+(contig, start, end) boxes are stored in an R*Tree virtual table so that
+overlap queries on a region are indexed rather than a scan of every gene.
+Contig names are mapped to integers as R*Tree coordinates must be numeric.
+"""
+
+
+def create_gene_index(connection):
+	"""
+	Creates the gene table, contig table and R*Tree in the given sqlite
+	connection, if they don't already exist.
+	"""
+	cursor = connection.cursor()
+	cursor.execute("CREATE TABLE IF NOT EXISTS chrom_genes (id INTEGER PRIMARY KEY, gene_id TEXT UNIQUE, external_name TEXT, "
+				   "chrom TEXT, start INTEGER, end INTEGER, biotype TEXT, description TEXT);")
+	cursor.execute("CREATE TABLE IF NOT EXISTS chrom_contigs (contig_id INTEGER PRIMARY KEY, chrom TEXT UNIQUE);")
+	cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chrom_genes_rtree USING rtree(id, min_contig, max_contig, min_pos, max_pos);")
+	connection.commit()
+
+
+def drop_gene_index(connection):
+	"""
+	Removes all gene index tables from the given sqlite connection.
+	"""
+	cursor = connection.cursor()
+	cursor.execute("DROP TABLE IF EXISTS chrom_genes;")
+	cursor.execute("DROP TABLE IF EXISTS chrom_contigs;")
+	cursor.execute("DROP TABLE IF EXISTS chrom_genes_rtree;")
+	connection.commit()
+
+
+def get_contig_id(connection, chrom, create=False):
+	"""
+	Returns the integer used as R*Tree coordinate for a contig name, creating it
+	if create is True. Returns None for an unknown contig otherwise.
+	"""
+	cursor = connection.cursor()
+	cursor.execute("SELECT contig_id FROM chrom_contigs WHERE chrom = ?;", (chrom,))
+	row = cursor.fetchone()
+	if row is not None:
+		return row[0]
+	if not create:
+		return None
+	cursor.execute("INSERT INTO chrom_contigs (chrom) VALUES (?);", (chrom,))
+	return cursor.lastrowid
+
+
+def insert_genes(connection, chrom, genes):
+	"""
+	Adds genes on a contig to the index, ignoring any gene_id that is already
+	stored. Accepts a list of dictionaries as returned by the ENSEMBL overlap
+	endpoint. Returns the number of genes that were added.
+	"""
+	create_gene_index(connection)
+	contig_id = get_contig_id(connection, chrom, create=True)
+	cursor = connection.cursor()
+	added_genes = 0
+	for gene in genes:
+		gene_id = gene.get('gene_id') or gene.get('id')
+		if not gene_id:
+			continue
+		cursor.execute("INSERT OR IGNORE INTO chrom_genes (gene_id, external_name, chrom, start, end, biotype, description) "
+					   "VALUES (?, ?, ?, ?, ?, ?, ?);",
+					   (gene_id, gene.get('external_name'), chrom, int(gene['start']), int(gene['end']),
+						gene.get('biotype'), gene.get('description')))
+		# rowcount is 0 if the gene_id was already in the table
+		if cursor.rowcount == 1:
+			cursor.execute("INSERT INTO chrom_genes_rtree VALUES (?, ?, ?, ?, ?);",
+						   (cursor.lastrowid, contig_id, contig_id, int(gene['start']), int(gene['end'])))
+			added_genes += 1
+	connection.commit()
+	return added_genes
+
+
+def query_genes(connection, chrom, start, end):
+	"""
+	Returns a list of (external_name, start, end, biotype, description) tuples
+	for every gene that overlaps, even partially, [start, end] on a contig,
+	ordered by start position.
+	"""
+	create_gene_index(connection)
+	contig_id = get_contig_id(connection, chrom)
+	if contig_id is None:
+		return []
+	cursor = connection.cursor()
+	# R*Tree coordinates are 32 bit floats that are rounded outwards, so the
+	# exact positions are checked again on the gene table
+	cursor.execute("SELECT g.external_name, g.start, g.end, g.biotype, g.description FROM chrom_genes_rtree r "
+				   "JOIN chrom_genes g ON g.id = r.id "
+				   "WHERE r.min_contig <= ? AND r.max_contig >= ? AND r.max_pos >= ? AND r.min_pos <= ? "
+				   "AND g.end >= ? AND g.start <= ? ORDER BY g.start;",
+				   (contig_id, contig_id, start, end, start, end))
+	return cursor.fetchall()
+
+
+def index_version(connection):
+	"""
+	Returns a number that grows whenever genes are added to the index, so that
+	anything drawn from the index can tell when it is out of date.
+	"""
+	create_gene_index(connection)
+	cursor = connection.cursor()
+	cursor.execute("SELECT COALESCE(MAX(id), 0) FROM chrom_genes;")
+	return cursor.fetchone()[0]
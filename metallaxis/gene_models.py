@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+gene_models.py - Import gene models from local GTF/GFF3 files.
+
+On machines without internet access ENSEMBL can't be queried, so gene
+positions are instead read from an Ensembl or GENCODE GTF/GFF3 file (which
+may be gzipped). Only gene records are kept, and they are stored in the same
+R*Tree backed gene index as genes fetched from ENSEMBL, in a database per
+organism and assembly in the Metallaxis config directory.
+"""
+
+import gzip
+import os
+import re
+import sqlite3
+import time
+from urllib.parse import unquote
+
+from metallaxis import gene_index
+
+# feature types of gene records in Ensembl and GENCODE files
+gene_feature_types = {'gene', 'ncRNA_gene', 'pseudogene'}
+
+gtf_attribute_regex = re.compile(r'(\S+)\s+"([^"]*)"')
+
+
+def gene_models_file(config_directory, organism, assembly):
+	"""
+	Returns the path of the imported gene models database of an organism and
+	assembly.
+	"""
+	file_name = "gene_models_" + re.sub(r'[^\w.-]', '_', organism + "_" + assembly) + ".sqlite"
+	return os.path.join(config_directory, file_name)
+
+
+def normalise_contig(contig):
+	"""
+	Returns the Ensembl name of a contig, so that GENCODE/UCSC names like
+	'chr1' and 'chrM' match the '1' and 'MT' used everywhere else.
+	"""
+	if contig.startswith('chr'):
+		contig = contig[3:]
+	if contig == 'M':
+		contig = 'MT'
+	return contig
+
+
+def parse_attributes(attributes):
+	"""
+	Returns a dictionary of the attributes column of a GTF or GFF3 line.
+	"""
+	# GTF attributes are written key "value"; whereas GFF3 uses key=value;
+	if '"' in attributes:
+		return dict(gtf_attribute_regex.findall(attributes))
+	attribute_dict = {}
+	for attribute in attributes.strip().split(';'):
+		if '=' in attribute:
+			key, value = attribute.split('=', 1)
+			attribute_dict[key] = unquote(value)
+	return attribute_dict
+
+
+def read_gene_records(annotation_file):
+	"""
+	Generator returning a (contig, gene) tuple for every gene record of a GTF or
+	GFF3 file, where gene is a dictionary with the same keys ENSEMBL uses.
+	"""
+	with open(annotation_file, 'rb') as magic_check:
+		is_gzipped = magic_check.read(2) == b'\x1f\x8b'
+	if is_gzipped:
+		annotation_read_obj = gzip.open(annotation_file, 'rt')
+	else:
+		annotation_read_obj = open(annotation_file, 'r')
+
+	with annotation_read_obj:
+		for line in annotation_read_obj:
+			if line.startswith('#'):
+				continue
+			# only split the whole line for gene records
+			line = line.rstrip('\n').split('\t', 8)
+			if len(line) < 9 or line[2] not in gene_feature_types:
+				continue
+
+			attributes = parse_attributes(line[8])
+			gene_id = attributes.get('gene_id') or attributes.get('ID', '').replace('gene:', '')
+			if not gene_id:
+				continue
+			# strip the version suffix GENCODE adds to Ensembl gene ids
+			if gene_id.startswith('ENS'):
+				gene_id = gene_id.split('.')[0]
+			description = attributes.get('description')
+			if description is not None:
+				description = description.split(' [Source:')[0]
+			yield normalise_contig(line[0]), {
+				'gene_id': gene_id,
+				'external_name': attributes.get('gene_name') or attributes.get('Name') or gene_id,
+				'start': int(line[3]),
+				'end': int(line[4]),
+				'biotype': attributes.get('gene_biotype') or attributes.get('gene_type') or attributes.get('biotype'),
+				'description': description}
+
+
+def import_gene_models(annotation_file, database_file):
+	"""
+	Imports the genes of a GTF or GFF3 file into a gene index database, replacing
+	any previous import. Returns the number of imported genes.
+	"""
+	# build into a temporary file so an interrupted import never replaces a good one
+	temporary_file = database_file + ".importing"
+	if os.path.isfile(temporary_file):
+		os.remove(temporary_file)
+	connection = sqlite3.connect(temporary_file)
+	connection.execute("PRAGMA journal_mode=OFF;")
+	connection.execute("PRAGMA synchronous=OFF;")
+
+	genes_by_contig = {}
+	for contig, gene in read_gene_records(annotation_file):
+		genes_by_contig.setdefault(contig, []).append(gene)
+
+	gene_count = 0
+	for contig, genes in genes_by_contig.items():
+		gene_count += gene_index.insert_genes(connection, contig, genes)
+
+	connection.execute("CREATE TABLE gene_models_info (source TEXT, imported_at REAL, gene_count INTEGER);")
+	connection.execute("INSERT INTO gene_models_info VALUES (?, ?, ?);",
+					   (os.path.abspath(annotation_file), time.time(), gene_count))
+	connection.commit()
+	connection.close()
+	os.replace(temporary_file, database_file)
+	return gene_count
+
+
+def gene_models_info(database_file):
+	"""
+	Returns a tuple of the source file and number of genes of an imported gene
+	models database, or None if no gene models were imported.
+	"""
+	if not os.path.isfile(database_file):
+		return None
+	connection = sqlite3.connect(database_file)
+	source_info = connection.execute("SELECT source, gene_count FROM gene_models_info;").fetchone()
+	connection.close()
+	return source_info
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+gene_prefetch.py - Fetch genes around loaded variants in the background.
+
+Once a VCF is loaded, the smallest set of ENSEMBL sized windows covering the
+region displayed around every variant is computed, and the windows that are
+not already cached are fetched by a background thread with a bounded number
+of concurrent requests through the ENSEMBL client, which rate limits and
+retries them. Fetched genes go into the shared ENSEMBL response cache, so the
+variant graphic can then be drawn from local data.
+"""
+
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metallaxis.ensembl_cache import max_region_length
+from metallaxis.ensembl_client import EnsemblError
+
+
+def covering_windows(positions, padding=max_region_length // 2 - 1, window_length=max_region_length):
+	"""
+	Returns the smallest list of (start, stop) windows of at most window_length
+	that cover [position - padding, position + padding] for every position.
+	"""
+	windows = []
+	# first position that isn't covered by a window yet
+	uncovered_pos = None
+	for position in sorted(set(positions)):
+		interval_start = max(1, position - padding)
+		interval_stop = position + padding
+		if uncovered_pos is not None and interval_stop < uncovered_pos:
+			continue
+		if uncovered_pos is None or interval_start > uncovered_pos:
+			uncovered_pos = interval_start
+		# greedily place windows starting at the first uncovered position
+		while uncovered_pos <= interval_stop:
+			windows.append((uncovered_pos, uncovered_pos + window_length - 1))
+			uncovered_pos += window_length
+	return windows
+
+
+class GenePrefetcher(threading.Thread):
+	"""
+	Background thread that fills the ENSEMBL response cache for a list of
+	(chrom, start, stop) windows. Windows that can't be fetched are reported
+	by calling warning(message) from a worker thread, which prints to stderr
+	by default.
+	"""
+	def __init__(self, response_cache, ensembl_api, organism, assembly, windows, warning=None):
+		super(GenePrefetcher, self).__init__(daemon=True)
+		self.response_cache = response_cache
+		self.ensembl_api = ensembl_api
+		self.organism = organism
+		self.assembly = assembly
+		self.windows = windows
+		self.stop_event = threading.Event()
+		self.warning = warning if warning is not None else self.print_warning
+		# counted from the worker threads
+		self.counts_lock = threading.Lock()
+		self.fetched_windows = 0
+		self.failed_windows = 0
+
+	@staticmethod
+	def print_warning(message):
+		print("Warning: " + message, file=sys.stderr)
+
+	def stop(self):
+		"""
+		Asks the thread to stop after the requests already in flight.
+		"""
+		self.stop_event.set()
+
+	def prefetch_window(self, window):
+		chrom, start, stop = window
+		if self.stop_event.is_set():
+			return
+		genes, gaps = self.response_cache.lookup(self.organism, self.assembly, chrom, start, stop)
+		for gap_start, gap_stop in gaps:
+			if self.stop_event.is_set():
+				return
+			try:
+				genes = self.ensembl_api.overlap_genes(self.organism, chrom, gap_start, gap_stop)
+			except EnsemblError as error:
+				self.warning("could not prefetch genes for " + chrom + ":" + str(gap_start) + "-" + str(gap_stop) + ": " + str(error))
+				with self.counts_lock:
+					self.failed_windows += 1
+				return
+			self.response_cache.store(self.organism, self.assembly, chrom, gap_start, gap_stop, genes)
+		with self.counts_lock:
+			self.fetched_windows += 1
+
+	def run(self):
+		with ThreadPoolExecutor(max_workers=self.ensembl_api.max_workers) as executor:
+			list(executor.map(self.prefetch_window, self.windows))
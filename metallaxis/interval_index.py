@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+interval_index.py - Persistent index of already-annotated genomic regions.
+
+Regions that have been requested from ENSEMBL are stored as merged, sorted and
+non-overlapping closed intervals per organism and chromosome. As the intervals
+never overlap, ordering them by start also orders them by stop, so the
+intervals touching a region are found with two index seeks and no scan.
+"""
+
+coverage_table = "annotation_coverage"
+
+
+def create_interval_table(connection):
+	"""
+	Creates the coverage table and its index in the given sqlite connection,
+	if they don't already exist.
+	"""
+	cursor = connection.cursor()
+	cursor.execute("CREATE TABLE IF NOT EXISTS %s (organism TEXT, chrom TEXT, start INTEGER, stop INTEGER);" % coverage_table)
+	cursor.execute("CREATE INDEX IF NOT EXISTS %s_idx ON %s (organism, chrom, start);" % (coverage_table, coverage_table))
+	connection.commit()
+
+
+def overlapping_intervals(connection, organism, chrom, start, stop):
+	"""
+	Returns the sorted list of (start, stop) intervals stored for an organism
+	and chromosome that overlap the closed interval [start, stop].
+	"""
+	cursor = connection.cursor()
+	# the only interval starting before our region that can overlap it is
+	# the last one, as intervals are disjoint
+	cursor.execute("SELECT start, stop FROM %s WHERE organism = ? AND chrom = ? AND start < ? ORDER BY start DESC LIMIT 1;" % coverage_table,
+				   (organism, chrom, start))
+	intervals = [row for row in cursor.fetchall() if row[1] >= start]
+	cursor.execute("SELECT start, stop FROM %s WHERE organism = ? AND chrom = ? AND start >= ? AND start <= ? ORDER BY start;" % coverage_table,
+				   (organism, chrom, start, stop))
+	intervals += cursor.fetchall()
+	return intervals
+
+
+def subtract_intervals(start, stop, covered_intervals):
+	"""
+	Returns the list of (start, stop) gaps of the closed interval [start, stop]
+	that are not covered by the sorted, disjoint covered_intervals.
+	"""
+	gaps = []
+	gap_start = start
+	for covered_start, covered_stop in covered_intervals:
+		if covered_start > gap_start:
+			gaps.append((gap_start, min(covered_start - 1, stop)))
+		gap_start = max(gap_start, covered_stop + 1)
+		if gap_start > stop:
+			break
+	if gap_start <= stop:
+		gaps.append((gap_start, stop))
+	return gaps
+
+
+def uncovered_gaps(connection, organism, chrom, start, stop):
+	"""
+	Returns the list of (start, stop) gaps of [start, stop] on a chromosome that
+	have not yet been annotated for the given organism.
+	"""
+	create_interval_table(connection)
+	covered_intervals = overlapping_intervals(connection, organism, chrom, start, stop)
+	return subtract_intervals(start, stop, covered_intervals)
+
+
+def add_interval(connection, organism, chrom, start, stop):
+	"""
+	Records [start, stop] as annotated, merging it with any stored interval it
+	overlaps or touches so that the stored intervals stay disjoint.
+	"""
+	create_interval_table(connection)
+	# widen by one so that adjacent intervals are merged together
+	touching_intervals = overlapping_intervals(connection, organism, chrom, start - 1, stop + 1)
+	if touching_intervals:
+		start = min(start, touching_intervals[0][0])
+		stop = max(stop, touching_intervals[-1][1])
+
+	cursor = connection.cursor()
+	cursor.execute("DELETE FROM %s WHERE organism = ? AND chrom = ? AND start >= ? AND start <= ?;" % coverage_table,
+				   (organism, chrom, start, stop))
+	cursor.execute("INSERT INTO %s (organism, chrom, start, stop) VALUES (?, ?, ?, ?);" % coverage_table,
+				   (organism, chrom, start, stop))
+	connection.commit()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+karyogram.py - Whole genome overview of variant density.
+
+Variants are counted in fixed-size bins of each contig while the VCF is
+encoded into the database, so that the overview never has to scan the
+variants themselves. Every contig is then drawn to scale as a row of bins
+coloured by how many variants they hold. The drawing carries a small script
+that turns a click on a bin into a navigation to a metallaxis.invalid URL,
+which the viewer intercepts to show the variants of the bin.
+"""
+
+import math
+import re
+
+import pandas as pd
+
+from metallaxis import SVGClasses
+
+bin_size = 1000000
+# host of the URLs clicked bins navigate to
+click_host = "metallaxis.invalid"
+
+line_length = 650
+row_height = 12
+row_pitch = 18
+top_margin = 20
+# light yellow to dark red, for increasing variant counts
+heat_colors = [[255, 237, 160], [254, 217, 118], [254, 178, 76], [253, 141, 60],
+			   [252, 78, 42], [227, 26, 28], [189, 0, 38], [128, 0, 38]]
+
+contig_length_regex = re.compile(r'##contig=<.*?ID=([^,>]+).*?length=([0-9]+)')
+
+
+def contig_lengths(vcf_file):
+	"""
+	Returns a dictionary of the contig lengths declared in a VCF header.
+	"""
+	lengths = {}
+	with open(vcf_file, 'r') as vcf_read_obj:
+		for line in vcf_read_obj:
+			if not line.startswith('##'):
+				break
+			contig_match = contig_length_regex.match(line)
+			if contig_match:
+				lengths[contig_match.group(1)] = int(contig_match.group(2))
+	return lengths
+
+
+def count_bins(chrom_column, pos_column):
+	"""
+	Returns a pandas Series of the number of variants per (CHROM, bin) of a
+	chunk of variants.
+	"""
+	positions = pd.to_numeric(pos_column, errors='coerce')
+	return positions.groupby([chrom_column, positions // bin_size]).size()
+
+
+def store_variant_bins(connection, bin_counts, lengths):
+	"""
+	Writes the variant counts per bin (a Series indexed by CHROM and bin) and
+	the contig lengths to the variant_bins and variant_bin_contigs tables.
+	"""
+	cursor = connection.cursor()
+	cursor.execute("DROP TABLE IF EXISTS variant_bins;")
+	cursor.execute("DROP TABLE IF EXISTS variant_bin_contigs;")
+	cursor.execute("CREATE TABLE variant_bins (CHROM TEXT, bin INTEGER, variant_count INTEGER, PRIMARY KEY (CHROM, bin));")
+	cursor.execute("CREATE TABLE variant_bin_contigs (CHROM TEXT PRIMARY KEY, length INTEGER);")
+	cursor.executemany("INSERT INTO variant_bins VALUES (?, ?, ?);",
+					   [(str(chrom), int(bin_nb), int(variant_count)) for (chrom, bin_nb), variant_count in bin_counts.items()])
+	cursor.executemany("INSERT INTO variant_bin_contigs VALUES (?, ?);", [(str(chrom), int(length)) for chrom, length in lengths.items()])
+	connection.commit()
+
+
+def ensure_variant_bins(connection):
+	"""
+	Builds the variant_bins table from the variants of a database saved before
+	bins were counted at encoding.
+	"""
+	cursor = connection.cursor()
+	cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'variant_bins';")
+	if cursor.fetchone() is not None:
+		return
+	cursor.execute("CREATE TABLE variant_bins (CHROM TEXT, bin INTEGER, variant_count INTEGER, PRIMARY KEY (CHROM, bin));")
+	cursor.execute("CREATE TABLE IF NOT EXISTS variant_bin_contigs (CHROM TEXT PRIMARY KEY, length INTEGER);")
+	cursor.execute("INSERT INTO variant_bins SELECT CHROM, CAST(POS / ? AS INTEGER), COUNT(*) FROM df "
+				   "WHERE POS IS NOT NULL GROUP BY 1, 2;", (bin_size,))
+	connection.commit()
+
+
+def contig_sort_key(chrom):
+	# numbered contigs first in numeric order, then the others by name
+	chrom_number = re.sub(r'^chr', '', str(chrom))
+	if chrom_number.isdigit():
+		return 0, int(chrom_number), ""
+	return 1, 0, str(chrom)
+
+
+def bin_region(bin_nb):
+	"""
+	Returns the 1-based closed interval of positions covered by a bin.
+	"""
+	return max(1, bin_nb * bin_size), (bin_nb + 1) * bin_size - 1
+
+
+def karyogram_svg(connection):
+	"""
+	Returns the SVG of the karyogram of the variants in a database.
+	"""
+	ensure_variant_bins(connection)
+	cursor = connection.cursor()
+	cursor.execute("SELECT CHROM, bin, variant_count FROM variant_bins;")
+	bins_by_contig = {}
+	for chrom, bin_nb, variant_count in cursor:
+		bins_by_contig.setdefault(chrom, []).append((bin_nb, variant_count))
+	if not bins_by_contig:
+		return SVGClasses.Scene('karyogram', 50).svg_string()
+
+	cursor.execute("SELECT CHROM, length FROM variant_bin_contigs;")
+	declared_lengths = dict(cursor.fetchall())
+	contigs = sorted(bins_by_contig, key=contig_sort_key)
+	# contigs are drawn at least as long as their last variant
+	lengths = [max(declared_lengths.get(chrom, 0), (max(bin_nb for bin_nb, count in bins_by_contig[chrom]) + 1) * bin_size)
+			   for chrom in contigs]
+	scale = line_length / max(lengths)
+	max_count = max(count for contig_bins in bins_by_contig.values() for bin_nb, count in contig_bins)
+
+	karyogram_scene = SVGClasses.Scene('karyogram', top_margin + len(contigs) * row_pitch + 10)
+	heat_bins = [[] for heat_color in heat_colors]
+	bin_width = max(1, bin_size * scale)
+	for row_nb, (chrom, length) in enumerate(zip(contigs, lengths)):
+		row_top = top_margin + row_nb * row_pitch
+		karyogram_scene.add(SVGClasses.Text([5, row_top + row_height - 2], str(chrom), 9))
+		karyogram_scene.add(SVGClasses.Rectangle([50, row_top], row_height, max(1, length * scale), [235, 235, 235]))
+		for bin_nb, count in bins_by_contig[chrom]:
+			# log scale, so that sparse bins still show next to dense ones
+			heat_level = int(math.log1p(count) / math.log1p(max_count) * (len(heat_colors) - 1))
+			heat_bins[heat_level].append((50 + bin_nb * bin_size * scale, row_top, bin_width, row_height))
+
+	# one path per colour rather than one element per bin
+	for heat_color, color_bins in zip(heat_colors, heat_bins):
+		if color_bins:
+			karyogram_scene.add(SVGClasses.Rectangles(color_bins, heat_color))
+	karyogram_scene.add(SVGClasses.Text([50, 12], "Bins of " + str(bin_size // 1000000) + " Mb, up to " + str(max_count) + " variants", 9))
+	karyogram_scene.add(SVGClasses.Script(click_script(contigs, lengths, scale)))
+	return karyogram_scene.svg_string()
+
+
+def click_script(contigs, lengths, scale):
+	"""
+	Returns the script that navigates to the URL of a bin when it is clicked.
+	"""
+	contig_list = ", ".join('"' + str(chrom).replace('"', '') + '"' for chrom in contigs)
+	length_list = ", ".join(str(length) for length in lengths)
+	return ("var contigs = [" + contig_list + "];\n"
+			"var lengths = [" + length_list + "];\n"
+			"document.documentElement.addEventListener('click', function (event) {\n"
+			"  var x = event.clientX + window.scrollX, y = event.clientY + window.scrollY - " + str(top_margin) + ";\n"
+			"  var row = Math.floor(y / " + str(row_pitch) + ");\n"
+			"  if (row < 0 || row >= contigs.length || y % " + str(row_pitch) + " > " + str(row_height) + ") { return; }\n"
+			"  var pos = (x - 50) / " + repr(scale) + ";\n"
+			"  if (pos < 0 || pos > lengths[row]) { return; }\n"
+			"  window.location.href = 'https://" + click_host + "/bin?chrom=' + encodeURIComponent(contigs[row]) +\n"
+			"    '&bin=' + Math.floor(pos / " + str(bin_size) + ");\n"
+			"});\n")
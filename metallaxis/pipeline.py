@@ -0,0 +1,789 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+pipeline.py - Conversion of a VCF into a session database, without interface.
+
+The steps that turn a VCF into the database the interface browses (checking
+the file, decompressing it, computing its statistics, annotating it and
+encoding its variants) don't depend on Qt, so that sessions can be built on
+machines without a display, from the command line, and opened in the
+interface afterwards. Progress, warnings and errors are reported to a
+PipelineHooks object, which prints them by default and which the interface
+replaces with its progress bar and dialogs.
+"""
+
+import os
+import pathlib  # for making the folder where we store data
+import platform  # for determining OS and therefore where to store data
+import re
+import sqlite3
+import sys
+
+import magic  # to detect filetype from file header
+import numpy as np
+import pandas as pd
+import yaml
+
+# to handle compressed VCFs
+import lzma
+import bz2
+import gzip
+
+# to read selected lines of files (reduce RAM usage for big files)
+from itertools import islice
+
+from metallaxis import annotation
+from metallaxis import annotation_cache
+from metallaxis import bloom
+from metallaxis import download
+from metallaxis import gene_index
+from metallaxis import gene_models
+from metallaxis import interval_index
+from metallaxis import karyogram
+from metallaxis import subset_stats
+from metallaxis import tabix
+from metallaxis import vcf_stats
+
+# Determine where to store temporary Metallaxis Data
+home_dir = os.path.expanduser('~')
+if platform.system() == "Linux":
+	config_directory = home_dir + "/.metallaxis/"
+elif platform.system() == "Darwin":
+	config_directory = home_dir + "/Library/Caches/Metallaxis/"
+elif platform.system() == "Windows":
+	config_directory = os.path.expandvars(r'%APPDATA%\Metallaxis\\')
+
+# make data folder and parent folders if they don't exist
+pathlib.Path(config_directory).mkdir(parents=True, exist_ok=True)
+
+config_file = os.path.join(config_directory, "metallaxis_config.yaml")
+ensembl_cache_file = os.path.join(config_directory, "ensembl_cache.sqlite")
+
+# Annotation executables
+current_file_dir = os.path.dirname(__file__)
+snpsift_jar = os.path.join(current_file_dir, "annotation/SnpSift.jar")
+snpeff_jar = os.path.join(current_file_dir, "annotation/SnpEff.jar")
+
+
+def load_config(config_file):
+	"""
+	Returns the settings dictionary of a YAML settings file. Raises OSError or
+	yaml.YAMLError if it can't be read.
+	"""
+	with open(config_file, 'r') as configf:
+		return yaml.safe_load(configf)
+
+
+def decompress_vcf(type_of_compression, vcf_input_filename, headonly_bool=False, vcf_output_filename=None):
+	"""
+	Decompresses or not, a file in argument (accepts xz/gz/bz2), and returns
+	either the head of the decompressed file, or the filename of the decompressed
+	VCF depending on the provided boolean argument: "headonly_bool".
+	"""
+	if type_of_compression == "":
+		decompressed_file_object = open(vcf_input_filename, mode="rb")
+	else:
+		decompressed_file_object = eval(type_of_compression).open(vcf_input_filename, mode="rb")
+
+	if headonly_bool is True:
+		decompressed_file_head = list(islice(decompressed_file_object, 100))
+		decompressed_file_object.close()
+		return decompressed_file_head
+	else:
+		with open(vcf_output_filename, "wb") as decompressed_out:
+			decompressed_out.write(decompressed_file_object.read())
+		decompressed_file_object.close()
+		return vcf_output_filename
+
+
+def is_number_bool(sample):
+	try:
+		float(sample)
+	except:
+		return False
+	return True
+
+
+def ensembl_chrom_name(chrom):
+	"""
+	Returns the chromosome name used by ENSEMBL for a chromosome of the VCF,
+	flattening our zero-padded chromosomes (e.g. '01' becomes '1').
+	"""
+	chrom = gene_models.normalise_contig(str(chrom))
+	if is_number_bool(chrom):
+		chrom = str(int(float(chrom)))
+	return chrom
+
+
+def set_col_to_numeric_if_isdigit(column, chunk, numeric_columns_list):
+	"""
+	Determines which columns of a given chunk are ints or floats, and removes
+	them from a list of columns if they are neither.
+	"""
+
+	def del_col(column):
+		if column in numeric_columns_list:
+			numeric_columns_list.remove(column)
+
+	for row in chunk[column]:
+		row = str(row)
+		if "," in row:
+			del_col(column)
+		if ";" in row:
+			del_col(column)
+		if "|" in row:
+			del_col(column)
+		if "True" in row:
+			del_col(column)
+		if "False" in row:
+			del_col(column)
+		if bool(re.match('^[0-9]+$', row)) is False:
+			if is_number_bool(row) is False:
+				if column in numeric_columns_list:
+					numeric_columns_list.remove(column)
+
+
+def already_annotated(vcf_file):
+	with open(vcf_file, 'r') as vcf_read_obj:
+		for line in vcf_read_obj:
+			if line.startswith("##INFO=<ID=ANN"):
+				return True
+
+
+def add_known_variant_columns(chunk, dbSNP_tabix, clinvar_tabix, dbSNP_bloom=None):
+	"""
+	Looks up each variant of a chunk of the VCF in the tabix indexed dbSNP and
+	ClinVar databases, matching on CHROM, POS, REF and ALT. Fills the ID column
+	with the rsID of variants without an ID, flags variants known to dbSNP in an
+	in_dbSNP column, and adds ClinVar's clinical significance as a CLNSIG
+	column. If dbSNP_bloom is given, only the variants it may contain are
+	looked up in dbSNP.
+	"""
+	def find_known_variant(known_variant_tabix, chrom, pos, ref, alts):
+		chrom = known_variant_tabix.resolve_contig(chrom)
+		if chrom is None:
+			return None
+		for alt in alts.split(','):
+			known_variant = known_variant_tabix.find_variant(chrom, pos, ref, alt)
+			if known_variant is not None:
+				return known_variant
+		return None
+
+	if dbSNP_bloom is not None:
+		maybe_in_dbSNP = dbSNP_bloom.contains_variants(chunk['CHROM'].values, chunk['POS'].values, chunk['REF'].values, chunk['ALT'].values)
+	else:
+		maybe_in_dbSNP = np.ones(len(chunk), dtype=bool)
+
+	variant_ids, in_dbSNP, clinical_significances = [], [], []
+	for chrom, pos, variant_id, ref, alts, maybe_known in zip(chunk['CHROM'], chunk['POS'], chunk['ID'], chunk['REF'], chunk['ALT'], maybe_in_dbSNP):
+		chrom, pos, alts = ensembl_chrom_name(chrom), int(pos), str(alts)
+
+		# the Bloom filter has false positives, so confirm them in dbSNP itself
+		dbSNP_record = None
+		if maybe_known:
+			dbSNP_record = find_known_variant(dbSNP_tabix, chrom, pos, ref, alts)
+		if dbSNP_record is not None and variant_id == ".":
+			variant_id = dbSNP_record[2]
+		variant_ids.append(variant_id)
+		in_dbSNP.append(str(dbSNP_record is not None))
+
+		clinical_significance = "."
+		clinvar_record = find_known_variant(clinvar_tabix, chrom, pos, ref, alts)
+		if clinvar_record is not None:
+			clinical_significance = tabix.info_value(clinvar_record[7], 'CLNSIG') or "."
+		clinical_significances.append(clinical_significance)
+
+	chunk['ID'] = variant_ids
+	chunk['in_dbSNP'] = in_dbSNP
+	chunk['CLNSIG'] = clinical_significances
+	return chunk
+
+
+
+class PipelineHooks:
+	"""
+	Receives the progress, warnings and errors of the pipeline, which are
+	printed by default.
+	"""
+	def progress(self, percent, message):
+		print("[" + format(percent, '3.0f') + "%] " + message, file=sys.stderr)
+
+	def warning(self, message):
+		print("Warning: " + message, file=sys.stderr)
+
+	def error(self, message):
+		print("Error: " + message, file=sys.stderr)
+
+	def detected_filetype(self, filetype):
+		pass
+
+	def loaded_file(self, filename):
+		pass
+
+
+class Pipeline:
+	"""
+	Converts VCFs into a session database. Downloaded files are kept in the
+	working directory of the settings, and temporary files in temp_dir, which
+	defaults to it; pipelines running at once need their own temp_dir.
+	"""
+	def __init__(self, config, hooks=None, sqlite_output_name=None, temp_dir=None):
+		self.config = config
+		self.hooks = hooks if hooks is not None else PipelineHooks()
+		working_dir = config['working_dir']
+		self.temp_dir = temp_dir or working_dir
+
+		# Temporary file names
+		self.sqlite_output_name = sqlite_output_name or os.path.join(working_dir, 'database.sqlite')
+		self.vcf_output_filename = os.path.join(self.temp_dir, 'vcf_output_filename.vcf')
+		self.annotated_vcf_output_filename = os.path.join(self.temp_dir, 'vcf_annot_filename.vcf')
+
+		# Annotation databases
+		self.dbSNP_path = os.path.join(working_dir, 'dbsnp.vcf.gz')
+		self.dbSNP_index_path = os.path.join(working_dir, 'dbsnp.vcf.gz.tbi')
+		self.clinvar_path = os.path.join(working_dir, 'clinvar.vcf.gz')
+		self.clinvar_index_path = os.path.join(working_dir, 'clinvar.vcf.gz.tbi')
+		self.dbSNP_bloom_path = os.path.join(working_dir, 'dbsnp.bloom')
+		self.snpeff_jar = snpeff_jar
+		self.snpsift_jar = snpsift_jar
+
+		# number of header lines of the VCF being converted, set by verify_vcf()
+		self.metadata_num = None
+		# metadata of the last VCF converted by ingest()
+		self.metadata_dict = None
+
+	def ingest(self, vcf_input_filename):
+		"""
+		Runs the whole pipeline on a VCF: annotates it if set to, parses it and
+		encodes it. Returns the connection to the created database, or None if
+		the VCF isn't valid.
+		"""
+		if self.config['auto_annotate'] and not already_annotated(vcf_input_filename):
+			vcf_input_filename = self.annotate_vcf(vcf_input_filename)
+		parsed_vcf = self.parse_vcf(vcf_input_filename)
+		if parsed_vcf is None:
+			return None
+		metadata_dict, variant_stats, decompressed_file = parsed_vcf
+		self.metadata_dict = metadata_dict
+		return self.database_encode(decompressed_file, variant_stats, metadata_dict)
+
+	def verify_file(self, selected_vcf):
+		"""
+		Verify that given VCF is a valid file, that exists, and has a non-null filesize.
+		Accepts a VCF as entry, returns a boolean: true if file exists, false if not.
+		"""
+		# Verify that the file exists
+		if not os.path.isfile(selected_vcf):
+			self.hooks.error("Selected file does not \
+		exist. You specified : " + str(selected_vcf))
+			return False
+
+		# Verify that the file isn't empty
+		if not os.path.getsize(selected_vcf) > 0:
+			self.hooks.error("Selected file is empty. \
+		You specified : " + str(selected_vcf))
+			return False
+
+		# Return True to continue, as VCF matched neither of our tests
+		return True
+
+	def verify_vcf(self, decompressed_file_head):
+		# verify is conform to VCFv4.1 specification:
+		# The header line names the 8 fixed, mandatory columns. These columns are as follows:
+		# CHROM
+		# POS
+		# - (Integer, Required)
+		# ID
+		# - No identifier should be present in more than one data record
+		# REF
+		# - must be one of A,C,G,T,N (case insensitive). Multiple bases are permitted
+		# ALT
+		# - must be one of A,C,G,T,N (case insensitive). Multiple bases are permitted
+		# - or an angle-bracketed ID String (“<ID>”)
+		# - or a breakend replacement string as described in the section on
+		# breakends.
+		# - If there are no alternative alleles, then the missing value should be used.
+		# QUAL
+		# - float or Integer
+		# FILTER
+		# INFO
+
+		line_num = 0
+		variant_num = 0
+		# make a list of mandatory columns in VCF we need to find for a VCF to be valid
+		expected_columns = ['#CHROM', 'POS', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
+
+		for line in decompressed_file_head:
+			line_num = line_num + 1
+			if line.startswith(b'#'):  # lines with # are metadata
+				if line.startswith(b'#CHROM'):
+					# verify header is conform to vcf 4.1 spec
+					# decode byte object to utf-8 string, then split by tab to get each column
+					header_line_cols = line.decode('UTF-8')
+					header_line_cols = header_line_cols.rstrip()  # remove trailing/leading whitespace
+					header_line_cols = header_line_cols.split("\t")
+					# get index of each column name
+					pos_col = [i for i, s in enumerate(header_line_cols) if 'POS' in s][0]
+					ref_col = [i for i, s in enumerate(header_line_cols) if 'REF' in s][0]
+					alt_col = [i for i, s in enumerate(header_line_cols) if 'ALT' in s][0]
+					qual_col = [i for i, s in enumerate(header_line_cols) if 'QUAL' in s][0]
+
+					# verify that VCF has all required columns
+					if not all(column in header_line_cols for column in expected_columns):
+						self.hooks.error("VCF not valid: VCF doesn't not contain all required columns. Contains: " + str(
+							header_line_cols))
+						return False
+
+			else:
+				# if line is not part of header, split by tab to get columns
+				# and verify that each column, in each line is conform to VCFv4.1
+				split_line = line.decode('UTF-8').split("\t")
+				for column in split_line:
+					column = column.strip()
+
+					# Verify that POS column only contains digits
+					if column == split_line[pos_col]:
+						if not column.isdigit():
+							self.hooks.error("VCF not valid: column 'POS' doesn't only contain digits: " + str(column))
+							return False
+
+					# Verify that REF column only contains ACGTN
+					elif column == split_line[ref_col]:
+						allowed_chars = set('ACGTN')
+						if not set(column.upper()).issubset(allowed_chars):
+							self.hooks.error(
+								"VCF not valid: column 'REF' doesn't only contain A,C,G,T,N: " + str(column))
+							return False
+
+					# Verify that ALT column only contains ACGTN or <ID>
+					elif column == split_line[alt_col]:
+						if not column.startswith("<") and column.endswith(">"):
+							allowed_chars = set('ACGTN')
+							if not set(column).issubset(allowed_chars):
+								self.hooks.error(
+									"VCF not valid: column 'ALT' doesn't only contain A,C,G,T,N or <ID>: " + str(column))
+								return False
+
+					# Verify that QUAL column only contains number (float or int) or "."
+					elif column == split_line[qual_col]:
+						if column.isdigit():
+							break
+						elif column == ".":
+							break
+						else:
+							allowed_chars = set('123456789.')
+							if not set(column).issubset(allowed_chars):
+								try:
+									float(column)
+
+								except ValueError:
+									self.hooks.error(
+										"VCF not valid: column 'QUAL' doesn't only contain digits: " + str(column))
+									return False
+				variant_num += 1
+
+			# total number of lines of metadata (will be used to extract just the data in database_encode()
+			self.metadata_num = int(line_num - variant_num)
+
+		# return Error or warning depending on variant numbers
+		if variant_num == 0:
+			self.hooks.error("VCF is empty, there are no variants at all in this vcf, please use a different vcf")
+			return False
+		elif variant_num < 5:
+			# TODO: uncomment the lines below, and remove "return TRUE"
+			return True
+		# self.hooks.error("VCF contains too few variants to analyse, please use a different vcf")
+		# return False
+		elif 5 < variant_num < 30:
+			# TODO: Uncomment the below as is just to speed up development that I removed GUI
+			# self.hooks.warning("VCF contains very few variants, only rudimentary statistics can be performed")
+			return True
+		else:
+			# if more than 35 variants then VCF is fine, return without any alert
+			return True
+
+	def parse_vcf(self, vcf_input_filename):
+		"""
+		Takes a VCF in input, runs both file and VCF verifications, decompresses it, and extracts metadata  and statistics
+		Accepts a string of a VCF filename in input.
+		Returns a tuple of a metadata dictionary, the VcfStats of the variants, and the filename of the decompressed VCF.
+		"""
+		# Verify that the selected VCF is a valid file (ie. that it exists, and has a non-null size)
+		self.hooks.progress(3, "Verifying VCF: verifying that file is valid")
+		file_is_valid = self.verify_file(vcf_input_filename)
+		if not file_is_valid:
+			return
+
+		vcf_filetype = magic.from_file(vcf_input_filename)
+		# Decompress selected vcf
+		if "XZ" in vcf_filetype:
+			self.hooks.detected_filetype("xz compressed VCF")
+			decompressed_file_head = decompress_vcf("lzma", vcf_input_filename, headonly_bool=True)
+
+		elif "bzip2" in vcf_filetype:
+			self.hooks.detected_filetype("bz2 compressed VCF")
+			decompressed_file_head = decompress_vcf("bz2", vcf_input_filename, headonly_bool=True)
+
+		elif "gzip" in vcf_filetype:
+			self.hooks.detected_filetype("gz compressed VCF")
+			decompressed_file_head = decompress_vcf("gzip", vcf_input_filename, headonly_bool=True)
+
+		elif "Variant Call Format" in vcf_filetype:
+			self.hooks.detected_filetype("uncompressed VCF")
+			decompressed_file_head = decompress_vcf("", vcf_input_filename, headonly_bool=True)
+
+		else:
+			self.hooks.error("Selected file must be a VCF file")
+			return
+
+		# now we have a returned decompressed file object verify if
+		# contents are valid vcf
+		self.hooks.progress(8, "Verifying VCF: verifying that file is a valid VCF")
+		vcf_is_valid = self.verify_vcf(decompressed_file_head)
+		if not vcf_is_valid:
+			return
+
+		self.hooks.progress(9, "Decompressing VCF")
+		if "XZ" in vcf_filetype:
+			decompressed_file = decompress_vcf("lzma", vcf_input_filename, vcf_output_filename=self.vcf_output_filename)
+
+		elif "bzip2" in vcf_filetype:
+			decompressed_file = decompress_vcf("bz2", vcf_input_filename, vcf_output_filename=self.vcf_output_filename)
+
+		elif "gzip" in vcf_filetype:
+			decompressed_file = decompress_vcf("gzip", vcf_input_filename, vcf_output_filename=self.vcf_output_filename)
+
+		elif "Variant Call Format" in vcf_filetype:
+			decompressed_file = decompress_vcf("", vcf_input_filename, vcf_output_filename=self.vcf_output_filename)
+
+		self.hooks.loaded_file(os.path.abspath(vcf_input_filename))
+
+		# Calculate counts of different variant types, a chunk of the VCF at a time
+		self.hooks.progress(9, "Calculating variant statistics")
+		# in approximate mode, distinct counts and quantiles are estimated in constant memory
+		variant_stats = vcf_stats.compute_stats(decompressed_file, self.metadata_num - 1, int(self.config['vcf_chunk_size']),
+												approximate=self.config.get('approximate_stats', False))
+
+		# Extract Metadata from VCF
+		metadata_dict = {}
+		# Match groups either side of an "=", after a "##". e.g. filename=xyz, source=tangram, etc.
+		regex_metadata = re.compile('(?<=##)(.*?)=(.*$)')
+
+		self.hooks.progress(10, "Extracting VCF metadata")
+		with open(decompressed_file) as decompressed_out:
+			vcf_line_nb, metadata_line_nb = 0, 0
+
+			for line in decompressed_out:
+				if line.startswith('##'):
+					metadata_tag = str(regex_metadata.search(line).group(1))
+					metadata_result = str(regex_metadata.search(line).group(2))
+					# classify uppercase metadata (e.g. "INFO", "FILTER") differently
+					if metadata_tag.isupper():
+						metadata_type = metadata_tag
+					else:
+						metadata_type = "basic"
+						# truncate long metadata to avoid database errors and distorting the GUI
+						if len(metadata_tag) > 20:
+							metadata_tag = metadata_tag[:20] + "..."
+						if len(metadata_result) > 95:
+							metadata_result = metadata_result[:95] + "...<truncated due to length>"
+
+					metadata_dict_entry = [metadata_type, metadata_tag, metadata_result]
+					if not metadata_dict_entry in metadata_dict.values():
+						metadata_dict[metadata_line_nb] = metadata_dict_entry
+					metadata_line_nb += 1
+
+		return metadata_dict, variant_stats, decompressed_file
+
+	def annotation_stages(self):
+		"""
+		Returns the chain of annotation stages run on VCFs: SnpEff, then
+		SnpSift with dbSNP, then with ClinVar.
+		"""
+		annotation_stages = annotation.snpeff_snpsift_stages(self.snpeff_jar, self.snpsift_jar, self.config['genome_version'], self.dbSNP_path, self.clinvar_path)
+		if self.config.get('tabix_annotation', True):
+			# dbSNP and ClinVar are instead looked up by database_encode() through their indexes
+			annotation_stages = annotation_stages[:1]
+		return annotation_stages
+
+	def annotate_vcf(self, vcf_file):
+		clinvar_url = "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/clinvar.vcf.gz"
+		clinvar_index_url = "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/clinvar.vcf.gz.tbi"
+
+		dbSNP_url = "https://ftp.ncbi.nih.gov/snp/organisms/human_9606_b150_GRCh38p7/VCF/00-All.vcf.gz"
+		dbSNP_index_url = "https://ftp.ncbi.nih.gov/snp/organisms/human_9606_b150_GRCh38p7/VCF/00-All.vcf.gz.tbi"
+
+		annotation_databases = [(dbSNP_index_url, self.dbSNP_index_path, "dbSNP index"),
+								(dbSNP_url, self.dbSNP_path, "dbSNP"),
+								(clinvar_index_url, self.clinvar_index_path, "ClinVar index"),
+								(clinvar_url, self.clinvar_path, "ClinVar")]
+		for database_url, database_path, database_name in annotation_databases:
+			def download_progress(downloaded_bytes, total_bytes):
+				download_message = "Downloading " + database_name + " (this will take a while): " + str(downloaded_bytes // (1024 * 1024)) + " Mb"
+				if total_bytes:
+					download_message += " of " + str(total_bytes // (1024 * 1024)) + " Mb"
+				self.hooks.progress(35, download_message)
+
+			try:
+				download.ensure_downloaded(database_url, database_path, progress=download_progress)
+			except (download.DownloadError, OSError) as error_message:
+				self.hooks.error("Could not download annotation databases, continuing without annotation:\n" + str(error_message))
+				return vcf_file
+
+		if self.config.get('tabix_annotation', True) and not bloom.is_filter_current(self.dbSNP_bloom_path, self.dbSNP_path):
+			def bloom_progress(added_records, total_records):
+				self.hooks.progress(35, "Indexing dbSNP (only done once): " + str(added_records) + "/" + str(total_records) + " variants")
+
+			try:
+				bloom.build_bloom_filter(self.dbSNP_path, self.dbSNP_bloom_path, progress=bloom_progress)
+			except (OSError, ValueError) as error_message:
+				self.hooks.warning("Could not index dbSNP, every variant will be looked up in it: " + str(error_message))
+
+		self.hooks.progress(5, "Running annotation on VCF (this will take some time)")
+
+		def annotation_progress(annotated_records, total_records):
+			annotate_percent = 5 + (annotated_records / max(1, total_records)) * 30
+			self.hooks.progress(annotate_percent, "Running annotation on VCF (" + str(annotated_records) + "/" + str(total_records) + " variants annotated)")
+
+		# run the annotation stages on parts of the VCF in parallel
+		annotation_stages = self.annotation_stages()
+
+		def annotate_uncached(uncached_vcf, annotated_uncached_vcf):
+			annotation.annotate_sharded(uncached_vcf, annotated_uncached_vcf, annotation_stages, self.config['max_memory'],
+										progress=annotation_progress, working_dir=self.temp_dir)
+
+		def cache_progress(cached_records, total_records):
+			self.hooks.progress(5, "Running annotation on VCF (" + str(cached_records) + "/" + str(total_records) + " variants already annotated)")
+
+		# only variants that weren't annotated by the same annotators before go through them
+		variant_annotation_cache = annotation_cache.AnnotationCache(os.path.join(self.config['working_dir'], "annotation_cache.sqlite"))
+		try:
+			cached_records, total_records = variant_annotation_cache.annotate(
+				vcf_file, self.annotated_vcf_output_filename, self.config['genome_version'], annotation_cache.annotator_version(annotation_stages),
+				annotate_uncached, self.temp_dir, progress=cache_progress)
+		except (annotation.AnnotationError, OSError, sqlite3.Error) as error_message:
+			self.hooks.error("Annotation failed, continuing without annotation:\n" + str(error_message))
+			return vcf_file
+		if total_records > 0:
+			self.hooks.progress(35, "Annotation cache hit rate: " + str(cached_records) + "/" + str(total_records) +
+								" variants (" + str(round(100 * cached_records / total_records, 1)) + "%)")
+		return self.annotated_vcf_output_filename
+
+	def open_known_variant_databases(self):
+		"""
+		Returns a tuple of TabixFile objects for the downloaded dbSNP and ClinVar
+		databases and of the dbSNP Bloom filter (None if it wasn't built), or None
+		if annotation by tabix lookups isn't enabled or the databases haven't been
+		downloaded.
+		"""
+		if not self.config['auto_annotate'] or not self.config.get('tabix_annotation', True):
+			return None
+		for database_path in (self.dbSNP_path, self.dbSNP_index_path, self.clinvar_path, self.clinvar_index_path):
+			if not os.path.isfile(database_path):
+				return None
+		try:
+			dbSNP_tabix, clinvar_tabix = tabix.TabixFile(self.dbSNP_path, self.dbSNP_index_path), tabix.TabixFile(self.clinvar_path, self.clinvar_index_path)
+		except (OSError, tabix.TabixError) as error_message:
+			self.hooks.warning("Can't read annotation databases, variants won't be annotated with dbSNP and ClinVar: " + str(error_message))
+			return None
+
+		dbSNP_bloom = None
+		if bloom.is_filter_current(self.dbSNP_bloom_path, self.dbSNP_path):
+			dbSNP_bloom = bloom.BloomFilter(self.dbSNP_bloom_path)
+		return dbSNP_tabix, clinvar_tabix, dbSNP_bloom
+
+	def database_encode(self, decompressed_file, variant_stats, metadata_dict):
+		"""
+		accepts as input a raw vcf file, the VcfStats of its variants (variant_stats) and a dictionary of metadata
+		(metadata_dict). Then encodes them as tables into a database.
+		Returns filename of created sqlite database.
+		"""
+		sqlite_output = sqlite3.connect(self.sqlite_output_name)
+		cursor = sqlite_output.cursor()
+		cursor.execute("DROP TABLE IF EXISTS df;")
+		cursor.execute("DROP TABLE IF EXISTS stats;")
+		cursor.execute("DROP TABLE IF EXISTS metadata;")
+		cursor.execute("DROP TABLE IF EXISTS previous_annotation_requests;")
+		cursor.execute("DROP TABLE IF EXISTS " + interval_index.coverage_table + ";")
+		sqlite_output.commit()
+		gene_index.drop_gene_index(sqlite_output)
+
+		# write each entry from metadata_dict to a new "metadata" table in database
+		for metadata_line_nb in metadata_dict:
+			metadata_tag = str(metadata_dict[metadata_line_nb][1])
+			metadata_result = str(metadata_dict[metadata_line_nb][2])
+			if not metadata_tag.isupper():
+				metadata_line = {'Tag': metadata_tag, 'Result': metadata_result}
+				metadata_line = pd.DataFrame(
+					metadata_line, index=[metadata_line_nb])
+
+				metadata_line.to_sql('metadata', sqlite_output, if_exists='append', index=False)
+
+		# write the statistics to typed tables, and the statistics shown in the
+		# statistics tab to a new "stats" table in database
+		vcf_stats.store_stats(sqlite_output, variant_stats)
+		vcf_stats.store_stat_values(sqlite_output, variant_stats.legacy_counts())
+
+		# chunked_vcf_len = sum(1 for row in open(decompressed_file, 'r'))
+
+		# PARSE INFO COLUMNS
+		# the info column of a vcf is long and hard to read if
+		# displayed as is, but it is composed of multiple key:value tags
+		# that we can parse as new columns, making them filterable.
+		info_cols_to_add = set()
+		chunked_vcf = pd.read_csv(decompressed_file,
+								  sep="\t",
+								  # skip rows that started with "#"
+								  skiprows=range(0, self.metadata_num - 1),
+								  # use chunk size that was set in settings
+								  chunksize=int(self.config['vcf_chunk_size']),
+								  low_memory=False,
+								  # make default data type an object (ie. string)
+								  dtype=object)
+
+		# Run through every chunk of the whole VCF and get the key out of the
+		# key:value pair and add to a set (so no duplicates will be added) that
+		# will later become new column names
+		for chunk in chunked_vcf:
+			for line in chunk["INFO"]:
+				if ";" in line:
+					line_split = line.split(";")
+					for col in line_split:
+						col_to_add = col.split("=")[0]
+						info_cols_to_add.add(col_to_add)
+
+		anno_info_cols_to_add = []
+		with open(decompressed_file, 'r') as vcf_read_obj:
+			for line in vcf_read_obj:
+				if not line.startswith('#'):
+					break
+
+				if line.startswith('##INFO=<ID=ANN'):
+					line = line.split("Functional annotations: '")[1]
+					line = line.split("|")
+					for col in line:
+						col = col.replace('"', "")
+						col = col.replace('>', "")
+						col = col.replace("'", '')
+						col = re.sub('^\s+', '', col)
+						col = re.sub('\s+$', '', col)
+						anno_info_cols_to_add.append(col)
+
+		chunked_vcf = pd.read_csv(decompressed_file,
+								  sep="\t",
+								  skiprows=range(0, self.metadata_num - 1),
+								  chunksize=int(self.config['vcf_chunk_size']),
+								  low_memory=False,
+								  # make default data type an object (ie. string)
+								  dtype=object)
+
+		known_variant_databases = self.open_known_variant_databases()
+		# variants per bin of each contig, for the karyogram
+		variant_bin_counts = None
+
+		for chunk in chunked_vcf:
+			# set the new info column names to be empty by default
+			for col in info_cols_to_add:
+				chunk[col] = "."
+
+			line_nb = 0
+			for line in chunk["INFO"]:
+				# split the INFO column by ; which separates the different
+				# key:value pairs
+				if ";" in line:
+					line_split = line.split(";")
+					# get both sides of the = to get the key and the value
+					for col in line_split:
+						col_split = col.split("=")
+						key_to_add = col_split[0]
+						# col_split will be greater than 1 if there is an = sign
+						# a = means there is a key:value pair to be extracted
+						if len(col_split) > 1:
+							data_to_add = col_split[1]
+							chunk[key_to_add].values[line_nb] = data_to_add
+						# if there is no = sign then there is no key:value pair just
+						# a tag so set it tag as a boolean column
+						else:
+							chunk[key_to_add].values[line_nb] = "True"
+				line_nb += 1
+
+			# Get rid of INFO column now that it exists as multiple columns
+			chunk = chunk.drop(columns=['INFO'])
+
+			if len(anno_info_cols_to_add) > 0:
+				for col in anno_info_cols_to_add:
+					chunk[col] = "."
+
+			line_nb = 0
+			if "ANN" in chunk:
+				for line in chunk["ANN"]:
+					line_split = line.split("|")
+					for col_num in range(0, len(anno_info_cols_to_add)):
+						current_col = anno_info_cols_to_add[col_num]
+						if len(line_split) > col_num:
+							chunk[current_col].values[line_nb] = line_split[col_num]
+					line_nb += 1
+
+				chunk = chunk.drop(columns=['ANN'])
+
+			# Rename column so we get 'CHROM' not '#CHROM' from chunk.keys()
+			chunk.rename(columns={'#CHROM': 'CHROM'}, inplace=True)
+
+			# To fix sorting problems
+			chunk['CHROM'] = chunk['CHROM'].replace('1', '01')
+			chunk['CHROM'] = chunk['CHROM'].replace('2', '02')
+			chunk['CHROM'] = chunk['CHROM'].replace('3', '03')
+			chunk['CHROM'] = chunk['CHROM'].replace('4', '04')
+			chunk['CHROM'] = chunk['CHROM'].replace('5', '05')
+			chunk['CHROM'] = chunk['CHROM'].replace('6', '06')
+			chunk['CHROM'] = chunk['CHROM'].replace('7', '07')
+			chunk['CHROM'] = chunk['CHROM'].replace('8', '08')
+			chunk['CHROM'] = chunk['CHROM'].replace('9', '09')
+
+			# annotate from dbSNP and ClinVar, unless SnpSift already did
+			if known_variant_databases is not None and 'CLNSIG' not in chunk:
+				chunk = add_known_variant_columns(chunk, *known_variant_databases)
+
+			# SET COLS WITH NUMBERS TO BE NUMERIC TYPE
+			# set columns that only contain numbers to be numeric dtype
+			# otherwise they are just strings, and can't be used with a
+			# dash separated filter
+
+			# make a list from all column names, we will later remove the
+			# non-numeric columns from the list
+			numeric_columns = list(chunk.keys())
+			#
+			chunk = chunk.replace(".", np.NaN)
+
+			# run the function for every column to remove non-numeric columns
+			for column in chunk.keys():
+				set_col_to_numeric_if_isdigit(column, chunk, numeric_columns)
+
+			# convert the remaining columns in "numeric_columns" list to numeric datatype
+			for column in numeric_columns:
+				chunk[column] = pd.to_numeric(chunk[column])
+
+			chunk_bin_counts = karyogram.count_bins(chunk['CHROM'], chunk['POS'])
+			if variant_bin_counts is None:
+				variant_bin_counts = chunk_bin_counts
+			else:
+				variant_bin_counts = variant_bin_counts.add(chunk_bin_counts, fill_value=0)
+
+			chunk.to_sql('df', sqlite_output, if_exists='append', index=False)
+
+		if known_variant_databases is not None:
+			for known_variant_database in known_variant_databases:
+				if known_variant_database is not None:
+					known_variant_database.close()
+
+		if variant_bin_counts is not None:
+			# contig names are zero padded in the database, as they are above
+			contig_lengths = {}
+			for contig, contig_length in karyogram.contig_lengths(decompressed_file).items():
+				if len(contig) == 1 and contig.isdigit():
+					contig = "0" + contig
+				contig_lengths[contig] = contig_length
+			karyogram.store_variant_bins(sqlite_output, variant_bin_counts, contig_lengths)
+
+		subset_stats.ensure_df_index(sqlite_output)
+		return sqlite_output
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+session_compare.py - Comparison of the variants of several sessions.
+
+Saved sessions (e.g. of a tumour and a normal sample, or of two releases of a
+VCF) are attached to the connection of the first one with ATTACH DATABASE, and
+compared in SQL on their variant key (CHROM, POS, REF, ALT):
+
+intersection   variants of the first session found in every other one
+difference     variants of the first session found in none of the others
+union          variants of any session, once, with a presence flag column
+               (in_<session name>) per session
+
+Every session's df is indexed on the variant key, so each variant is compared
+by index lookups in the other sessions rather than by sorting them all.
+Sessions that can't be written, e.g. read-only files, are compared without
+the index, by scanning their variants. ALT is
+compared with IS, as missing ALTs are stored as NULL. SQLite attaches at most
+10 databases by default.
+"""
+
+import os
+import re
+import sqlite3
+
+operations = ['intersection', 'difference', 'union']
+variant_key_columns = ['CHROM', 'POS', 'REF', 'ALT']
+key_index = "df_variant_key"
+attached_prefix = "compared_"
+
+
+def detach_sessions(connection):
+	"""
+	Detaches the sessions attached by a previous comparison.
+	"""
+	for database_nb, database_name, database_file in connection.execute("PRAGMA database_list;").fetchall():
+		if database_name.startswith(attached_prefix):
+			connection.execute("DETACH DATABASE " + database_name + ";")
+
+
+def ensure_key_index(connection, schema="main"):
+	"""
+	Indexes the variants of a session by their key, and returns whether they
+	are indexed. Cohort databases, whose df is a view, are already indexed on
+	it, and sessions that can't be written are left unindexed.
+	"""
+	df_type = connection.execute("SELECT type FROM " + schema + ".sqlite_master WHERE name = 'df';").fetchone()
+	if df_type is None or df_type[0] != 'table':
+		return True
+	try:
+		connection.execute("CREATE INDEX IF NOT EXISTS " + schema + "." + key_index + " ON df (" + ", ".join(variant_key_columns) + ");")
+		connection.commit()
+	except sqlite3.OperationalError:
+		# e.g. a read-only file, or a session opened read-only
+		connection.rollback()
+		return False
+	return True
+
+
+def attach_sessions(connection, session_files):
+	"""
+	Attaches session databases to a connection, replacing those of a previous
+	comparison, and indexes them and the main database by variant key where
+	they can be written. Returns the list of schema names of the compared
+	sessions, starting with main.
+	"""
+	detach_sessions(connection)
+	schemas = ["main"]
+	for session_nb, session_file in enumerate(session_files):
+		if not os.path.isfile(session_file):
+			raise FileNotFoundError("Session file does not exist: " + str(session_file))
+		schema = attached_prefix + str(session_nb + 1)
+		connection.execute("ATTACH DATABASE ? AS " + schema + ";", (session_file,))
+		schemas.append(schema)
+	for schema in schemas:
+		ensure_key_index(connection, schema)
+	return schemas
+
+
+def presence_columns(session_names):
+	"""
+	Returns the names of the presence flag columns of sessions, made of the
+	characters allowed in a column name and unique.
+	"""
+	columns = []
+	for session_name in session_names:
+		session_name = os.path.basename(session_name)
+		if session_name.endswith(".sqlite"):
+			session_name = session_name[:-len(".sqlite")]
+		column = "in_" + re.sub('[^0-9A-Za-z_]', '_', session_name)
+		unique_column, column_nb = column, 1
+		while unique_column.lower() in [existing_column.lower() for existing_column in columns]:
+			column_nb += 1
+			unique_column = column + "_" + str(column_nb)
+		columns.append(unique_column)
+	return columns
+
+
+def variant_in(schema, alias, outer_alias):
+	"""
+	Returns an EXISTS expression true if the variant of outer_alias is in the
+	df of a schema.
+	"""
+	key_match = " AND ".join(alias + "." + column + (" IS " if column == 'ALT' else " = ") + outer_alias + "." + column
+							 for column in variant_key_columns)
+	return "EXISTS (SELECT 1 FROM " + schema + ".df AS " + alias + " WHERE " + key_match + ")"
+
+
+def comparison_query(operation, schemas, session_names=None):
+	"""
+	Returns the SELECT query comparing the variants of the sessions attached as
+	schemas. Intersection and difference return the rows of the first session,
+	union the variant keys and presence flags named after session_names.
+	"""
+	if operation not in operations:
+		raise ValueError("Unknown comparison: " + str(operation))
+	if operation == 'intersection':
+		return "SELECT session_0.* FROM main.df AS session_0 WHERE " + " AND ".join(
+			variant_in(schema, "other_" + str(schema_nb), "session_0") for schema_nb, schema in enumerate(schemas) if schema_nb > 0) + ";"
+	if operation == 'difference':
+		return "SELECT session_0.* FROM main.df AS session_0 WHERE " + " AND ".join(
+			"NOT " + variant_in(schema, "other_" + str(schema_nb), "session_0") for schema_nb, schema in enumerate(schemas) if schema_nb > 0) + ";"
+
+	# each session adds the variants of none of the sessions before it, so
+	# that every variant comes once without sorting them all together, and
+	# DISTINCT drops variants repeated within a session
+	flag_columns = presence_columns(session_names if session_names is not None else schemas)
+	union_parts = []
+	for schema_nb, schema in enumerate(schemas):
+		alias = "session_" + str(schema_nb)
+		flags = []
+		for other_nb, other_schema in enumerate(schemas):
+			if other_nb < schema_nb:
+				flag = "0"
+			elif other_nb == schema_nb:
+				flag = "1"
+			else:
+				flag = variant_in(other_schema, "other_" + str(other_nb), alias)
+			flags.append(flag + " AS " + flag_columns[other_nb])
+		union_part = "SELECT DISTINCT " + ", ".join([alias + "." + column for column in variant_key_columns] + flags) + " FROM " + schema + ".df AS " + alias
+		if schema_nb > 0:
+			union_part += " WHERE " + " AND ".join("NOT " + variant_in(other_schema, "other_" + str(other_nb), alias)
+												   for other_nb, other_schema in enumerate(schemas[:schema_nb]))
+		union_parts.append(union_part)
+	return " UNION ALL ".join(union_parts) + ";"
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+subset_stats.py - Statistics of the variants matching a table filter.
+
+The statistics computed when a VCF is parsed describe the whole file. Those
+of the variants left by a filter are instead computed in the database, with
+aggregate queries over the filter's query (counts per contig, ALT values,
+variants per position range), so that no variant has to be read into pandas.
+They come out as the same dictionary as the statistics of the whole file, so
+that the statistics tab draws either the same way.
+"""
+
+import sqlite3
+
+import pandas as pd
+
+from metallaxis import vcf_stats
+
+df_index = "df_chrom_pos"
+
+
+def ensure_df_index(connection):
+	"""
+	Indexes the variants table by CHROM and POS, which the filters and the
+	statistics of each contig use. Returns False if it couldn't be indexed,
+	e.g. because the database is read-only. Cohort databases, whose df is a
+	view, are indexed on their variants table instead.
+	"""
+	df_type = connection.execute("SELECT type FROM sqlite_master WHERE name = 'df';").fetchone()
+	if df_type is None or df_type[0] != 'table':
+		return False
+	try:
+		connection.execute("CREATE INDEX IF NOT EXISTS " + df_index + " ON df (CHROM, POS);")
+		connection.commit()
+	except sqlite3.Error:
+		return False
+	return True
+
+
+def filter_source(filter_query):
+	"""
+	Returns the FROM clause of the variants matching a filter's SELECT query,
+	or of all variants if there is no filter.
+	"""
+	if filter_query is None:
+		return "df"
+	filter_query = filter_query.strip().rstrip(';').strip()
+	return "(" + filter_query + ")"
+
+
+def filtered_stat_values(connection, filter_query):
+	"""
+	Returns the dictionary of statistics, as stored in the stats table, of the
+	variants matching a filter's SELECT query, which must select the CHROM, REF
+	and ALT columns.
+	"""
+	source = filter_source(filter_query)
+	filtered_stats = vcf_stats.VcfStats()
+	contig_rows = connection.execute("SELECT CHROM, COUNT(*), SUM(LENGTH(REF) = LENGTH(ALT)), SUM(LENGTH(REF) != LENGTH(ALT)), "
+									 "SUM(CASE WHEN LENGTH(REF) = LENGTH(ALT) THEN 0 ELSE LENGTH(ALT) END) "
+									 "FROM " + source + " GROUP BY CHROM;").fetchall()
+	filtered_stats.contigs = pd.DataFrame(contig_rows, columns=['CHROM', 'variant_count', 'snp_count', 'indel_count', 'indel_alt_length'],
+										  dtype=object).set_index('CHROM').reindex(columns=vcf_stats.contig_columns).fillna(0).astype(float)
+
+	# ALT values are only counted while every ALT is a single base or symbolic,
+	# as they are for the whole file
+	multibase_alts = connection.execute("SELECT COUNT(*) FROM " + source + " WHERE LENGTH(ALT) != 1 AND ALT != '' "
+										"AND ALT NOT GLOB '*[^ACTG]*';").fetchone()[0]
+	if multibase_alts > 0:
+		filtered_stats.alt_counts = None
+	else:
+		alt_rows = connection.execute("SELECT ALT, COUNT(*) FROM " + source + " GROUP BY ALT;").fetchall()
+		filtered_stats.alt_counts = dict(alt_rows)
+	return filtered_stats.legacy_counts()
+
+
+def position_ranges(connection, filter_query, chrom, nb_ranges=12):
+	"""
+	Returns a tuple of the labels of nb_ranges ranges of positions spanning the
+	variants of a contig that match a filter, and of the number of variants in
+	each range, counted in a single pass.
+	"""
+	source = filter_source(filter_query)
+	min_pos, max_pos = connection.execute("SELECT MIN(POS), MAX(POS) FROM " + source + " WHERE CHROM == ?;", (str(chrom),)).fetchone()
+	if min_pos is None:
+		return [], []
+	range_size = max(1, int((max_pos - min_pos) / nb_ranges))
+	# ranges end at every step after the first position, and include both ends
+	range_ends = list(range(min_pos, max_pos, range_size))[1:]
+	if not range_ends:
+		return [], []
+	range_counts = connection.execute("SELECT " + ", ".join(["SUM(POS BETWEEN ? AND ?)"] * len(range_ends)) + " FROM " + source +
+									  " WHERE CHROM == ?;",
+									  [bound for range_end in range_ends for bound in (range_end - range_size, range_end)] + [str(chrom)]).fetchone()
+	range_labels = [str(range_end - range_size) + "-" + str(range_end) for range_end in range_ends]
+	return range_labels, [int(range_count or 0) for range_count in range_counts]
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+tabix.py - Random access to bgzipped VCFs through their tabix index.
+
+A bgzipped file is a series of independently compressed BGZF blocks of at most
+64Kb, and its .tbi index maps genomic bins to "virtual offsets" (the offset of
+a block in the file, shifted left by 16 bits, plus an offset in the block once
+decompressed). Looking up a position therefore only decompresses the few
+blocks that can contain it, instead of the whole file.
+"""
+
+import gzip
+import struct
+import zlib
+from collections import OrderedDict
+
+# size of the linear index windows, and of the smallest bins
+tabix_min_shift = 14
+
+
+class TabixError(Exception):
+	"""
+	Raised when a tabix index or bgzipped file can't be read.
+	"""
+	pass
+
+
+def reg2bins(beg, end):
+	"""
+	Returns the list of bins that may contain features overlapping the 0-based,
+	half open interval [beg, end).
+	"""
+	bins = [0]
+	end -= 1
+	for level_first_bin, level_shift in ((1, 26), (9, 23), (73, 20), (585, 17), (4681, 14)):
+		bins.extend(range(level_first_bin + (beg >> level_shift), level_first_bin + (end >> level_shift) + 1))
+	return bins
+
+
+def read_tabix_index(index_file):
+	"""
+	Parses a .tbi file. Returns a dictionary with the list of contig names, and
+	for each contig its bins (bin -> list of (begin, end) virtual offsets) and
+	its linear index (list of the smallest virtual offset of each 16kb window).
+	"""
+	with gzip.open(index_file, 'rb') as index_read_obj:
+		index_data = index_read_obj.read()
+	if index_data[:4] != b'TBI\x01':
+		raise TabixError(str(index_file) + " is not a tabix index")
+
+	n_ref, file_format, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from('<8i', index_data, 4)
+	offset = 36
+	names = index_data[offset:offset + l_nm].split(b'\x00')[:n_ref]
+	offset += l_nm
+
+	contigs = {}
+	for name in names:
+		bins = {}
+		n_bin, = struct.unpack_from('<i', index_data, offset)
+		offset += 4
+		for bin_nb in range(n_bin):
+			bin_id, n_chunk = struct.unpack_from('<Ii', index_data, offset)
+			offset += 8
+			chunks = struct.unpack_from('<' + str(2 * n_chunk) + 'Q', index_data, offset)
+			offset += 16 * n_chunk
+			bins[bin_id] = list(zip(chunks[0::2], chunks[1::2]))
+		n_intv, = struct.unpack_from('<i', index_data, offset)
+		offset += 4
+		linear_index = struct.unpack_from('<' + str(n_intv) + 'Q', index_data, offset)
+		offset += 8 * n_intv
+		contigs[name.decode('UTF-8')] = (bins, linear_index)
+
+	return {'contigs': contigs, 'col_seq': col_seq, 'col_beg': col_beg, 'meta': chr(meta), 'skip': skip}
+
+
+class TabixFile:
+	def __init__(self, bgzip_file, index_file=None, cached_blocks=64):
+		self.bgzip_file = bgzip_file
+		self.index = read_tabix_index(index_file or bgzip_file + ".tbi")
+		self.file_obj = open(bgzip_file, 'rb')
+		# decompressed blocks, as neighbouring lookups often need the same ones
+		self.block_cache = OrderedDict()
+		self.cached_blocks = cached_blocks
+
+	def close(self):
+		self.file_obj.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def contigs(self):
+		return list(self.index['contigs'])
+
+	def resolve_contig(self, contig):
+		"""
+		Returns the name this file uses for a contig, whether or not it prefixes
+		names with 'chr', or None if the file has no such contig.
+		"""
+		for contig_name in (contig, 'chr' + contig, contig[3:] if contig.startswith('chr') else None):
+			if contig_name in self.index['contigs']:
+				return contig_name
+		return None
+
+	def read_block(self, block_offset):
+		"""
+		Returns a tuple of the decompressed data of the BGZF block starting at
+		block_offset in the file, and the offset of the next block.
+		"""
+		if block_offset in self.block_cache:
+			self.block_cache.move_to_end(block_offset)
+			return self.block_cache[block_offset]
+
+		self.file_obj.seek(block_offset)
+		block_header = self.file_obj.read(18)
+		if len(block_header) < 18:
+			return b'', block_offset
+		if block_header[:4] != b'\x1f\x8b\x08\x04' or block_header[12:14] != b'BC':
+			raise TabixError(str(self.bgzip_file) + " is not bgzip compressed")
+		# BSIZE is the total size of the block minus one
+		block_size, = struct.unpack_from('<H', block_header, 16)
+		compressed_data = self.file_obj.read(block_size + 1 - 18)
+		# the last 8 bytes of a block are its CRC32 and uncompressed size
+		block_data = zlib.decompress(compressed_data[:-8], -15)
+		block = (block_data, block_offset + block_size + 1)
+
+		self.block_cache[block_offset] = block
+		if len(self.block_cache) > self.cached_blocks:
+			self.block_cache.popitem(last=False)
+		return block
+
+	def read_lines(self, virtual_offset):
+		"""
+		Generator returning the lines of the file from a virtual offset. Blocks
+		are only read as lines are consumed, so callers stop reading by no
+		longer iterating.
+		"""
+		block_offset, in_block_offset = virtual_offset >> 16, virtual_offset & 0xFFFF
+		partial_line = b''
+		while True:
+			block_data, next_block_offset = self.read_block(block_offset)
+			# an empty block marks the end of the file
+			if next_block_offset == block_offset:
+				break
+			block_lines = (partial_line + block_data[in_block_offset:]).split(b'\n')
+			partial_line = block_lines.pop()
+			for line in block_lines:
+				yield line.decode('UTF-8')
+			block_offset, in_block_offset = next_block_offset, 0
+		if partial_line:
+			yield partial_line.decode('UTF-8')
+
+	def fetch(self, contig, start, end):
+		"""
+		Generator returning the lines of a contig, as lists of columns, whose
+		position is within the 1-based closed interval [start, end].
+		"""
+		if contig not in self.index['contigs']:
+			return
+		bins, linear_index = self.index['contigs'][contig]
+		beg = max(0, start - 1)
+
+		# no feature starting before this offset can overlap the region
+		window_nb = min(beg >> tabix_min_shift, len(linear_index) - 1)
+		min_offset = linear_index[window_nb] if window_nb >= 0 else 0
+
+		chunks = [chunk for bin_id in reg2bins(beg, end) for chunk in bins.get(bin_id, []) if chunk[1] > min_offset]
+		if not chunks:
+			return
+		# records are sorted, so read from the first chunk until past the region
+		first_offset = max(min(chunk[0] for chunk in chunks), min_offset)
+
+		col_seq, col_beg = self.index['col_seq'] - 1, self.index['col_beg'] - 1
+		for line in self.read_lines(first_offset):
+			if not line or line.startswith(self.index['meta']):
+				continue
+			columns = line.split('\t')
+			if columns[col_seq] != contig:
+				break
+			position = int(columns[col_beg])
+			if position > end:
+				break
+			if position >= start:
+				yield columns
+
+	def find_variant(self, contig, pos, ref, alt):
+		"""
+		Returns the columns of the VCF record at (contig, pos) with the same REF
+		and an ALT matching alt, or None if there is no such record.
+		"""
+		for columns in self.fetch(contig, pos, pos):
+			if columns[3] == ref and alt in columns[4].split(','):
+				return columns
+		return None
+
+
+def info_value(info_column, key):
+	"""
+	Returns the value of a key of a VCF INFO column, or None if absent.
+	"""
+	for info_field in info_column.split(';'):
+		if info_field.startswith(key + '='):
+			return info_field[len(key) + 1:]
+	return None
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+vcf_stats.py - Vectorised statistics of the variants of a VCF.
+
+The VCF is read in chunks with pandas, and every statistic of a chunk is
+computed with column operations, then added to running totals, so that the
+whole file is never held in memory nor looped over line by line. Besides the
+SNP/indel counts per contig, this gives the transition/transversion ratio,
+the indel length histogram, QUAL and DP distributions, and breakdowns of
+multi-allelic sites and FILTER values. They are stored in typed tables of the
+session database, along with the statistics shown in the statistics tab,
+which keep their type (numbers as numbers, sets and lists as JSON) so that a
+session reads them back exactly as they were computed.
+"""
+
+import ast
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from metallaxis import approximate_stats
+
+vcf_stats_columns = ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
+# the exact statistics don't look at POS and ID, so they aren't parsed
+exact_stats_columns = ['#CHROM', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
+
+# histogram bin edges, the last bin holds everything above its start
+qual_bin_edges = np.array([0, 10, 20, 30, 40, 50, 60, 80, 100, 150, 200, 300, 500, 1000, np.inf])
+dp_bin_edges = np.array([0, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 500, 1000, np.inf])
+
+transition_pairs = {'AG', 'GA', 'CT', 'TC'}
+
+contig_columns = ['variant_count', 'snp_count', 'indel_count', 'transition_count', 'transversion_count',
+				  'multiallelic_count', 'pass_count', 'qual_sum', 'qual_count', 'indel_alt_length']
+
+
+def pad_contigs(contigs):
+	"""
+	Returns contig names with single digit contigs zero padded ('1' -> '01'),
+	so that they sort in order as text.
+	"""
+	return contigs.where(~contigs.str.match(r'^[0-9]$'), '0' + contigs)
+
+
+def numeric_values(values):
+	"""
+	Returns a float array of text values, NaN where they aren't numbers. Each
+	distinct value is only converted once, as QUAL and DP values repeat a lot.
+	"""
+	value_codes, distinct_values = pd.factorize(values)
+	try:
+		distinct_numbers = np.array(distinct_values, dtype=float)
+	except ValueError:
+		# only missing ('.') or invalid values need the slower conversion
+		distinct_numbers = pd.to_numeric(pd.Series(distinct_values, dtype=object), errors='coerce').values.astype(float)
+	return distinct_numbers[value_codes] if len(distinct_numbers) > 0 else np.full(len(values), np.nan)
+
+
+def info_dp_values(infos):
+	"""
+	Returns a float array of the DP values of INFO columns, NaN where they have
+	none.
+	"""
+	# the leading ';' makes ';DP=' match DP as the first key but not keys
+	# ending in DP (e.g. ADP), and partition is much faster than a regular
+	# expression on every line
+	return numeric_values(np.array([(';' + info).partition(';DP=')[2].partition(';')[0] or 'nan' for info in infos], dtype=object))
+
+
+def histogram(values, bin_edges):
+	"""
+	Returns the number of values in each bin, counting values below the first
+	edge in the first bin.
+	"""
+	bin_numbers = np.clip(np.searchsorted(bin_edges, values, side='right') - 1, 0, len(bin_edges) - 2)
+	return np.bincount(bin_numbers, minlength=len(bin_edges) - 1)
+
+
+def allele_pair_features(ref, alt):
+	"""
+	Returns, for a REF and ALT, whether it is a SNP (as many bases in REF as in
+	the whole ALT), the number of ALT alleles, the number of them that are
+	transitions and transversions, the length of ALT, and whether ALT is made
+	of several plain bases.
+	"""
+	ref_upper = ref.upper()
+	nb_transitions, nb_transversions = 0, 0
+	alt_alleles = alt.upper().split(',')
+	for alt_allele in alt_alleles:
+		if len(ref_upper) == 1 and len(alt_allele) == 1 and ref_upper != alt_allele and ref_upper in "ACGT" and alt_allele in "ACGT":
+			if ref_upper + alt_allele in transition_pairs:
+				nb_transitions += 1
+			else:
+				nb_transversions += 1
+	multibase_alt = len(alt) != 1 and alt != "" and set(alt).issubset(set('ACTG'))
+	return int(len(ref) == len(alt)), len(alt_alleles), nb_transitions, nb_transversions, len(alt), int(multibase_alt)
+
+
+def allele_indel_lengths(ref, alt):
+	"""
+	Returns the length differences of the ALT alleles of a REF/ALT pair that
+	are insertions (positive) or deletions (negative), ignoring symbolic
+	alleles.
+	"""
+	return [len(alt_allele) - len(ref) for alt_allele in alt.split(',')
+			if len(alt_allele) != len(ref) and not any(symbol in alt_allele for symbol in '<>[]*.')]
+
+
+def add_counts(counts, keys, key_counts):
+	"""
+	Adds the counts of keys to a dictionary of counts.
+	"""
+	for key, key_count in zip(keys, key_counts):
+		counts[key] = counts.get(key, 0) + key_count
+
+
+class VcfStats:
+	def __init__(self, approximate=False):
+		# running totals are kept in dictionaries, as pandas takes longer to
+		# align a chunk's few values than numpy takes to count them
+		self.contig_counts = {}
+		self.indel_lengths = {}
+		self.filters = {}
+		self.allele_counts = {}
+		self.qual_histogram = np.zeros(len(qual_bin_edges) - 1, dtype=np.int64)
+		self.dp_histogram = np.zeros(len(dp_bin_edges) - 1, dtype=np.int64)
+		self.missing_qual = 0
+		self.missing_dp = 0
+		self.dp_sum = 0.0
+		# ALT values are only counted while every ALT is a single base or symbolic
+		self.alt_counts = {}
+		# sketches of the statistics that are only estimated, in approximate mode
+		self.approximate = approximate_stats.ApproximateStats() if approximate else None
+
+	def add_chunk(self, chunk):
+		"""
+		Adds the variants of a chunk of the VCF, a DataFrame with at least the
+		#CHROM, REF, ALT, QUAL, FILTER and INFO columns as strings, and POS and
+		ID too in approximate mode.
+		"""
+		# a VCF has few distinct contigs, FILTERs and REF/ALT pairs, so text is
+		# only looked at once per distinct value, and every variant is then
+		# counted through integer codes with numpy
+		chrom_codes, chroms = pd.factorize(chunk['#CHROM'].values)
+		chroms = pad_contigs(pd.Series(chroms, dtype=object))
+		ref_codes, refs = pd.factorize(chunk['REF'].values)
+		alt_codes, alts = pd.factorize(chunk['ALT'].values)
+		pairs, pair_codes = np.unique(ref_codes.astype(np.int64) * len(alts) + alt_codes, return_inverse=True)
+		pair_codes = pair_codes.ravel()
+
+		pair_features = np.array([allele_pair_features(refs[pair // len(alts)], alts[pair % len(alts)]) for pair in pairs],
+								 dtype=np.int64).reshape(len(pairs), 6)
+		is_snp, nb_alts, nb_transitions, nb_transversions, alt_lengths, multibase_alt = pair_features[pair_codes].T
+		qual = numeric_values(chunk['QUAL'].values)
+		dp = info_dp_values(chunk['INFO'].values)
+		filter_codes, filters = pd.factorize(chunk['FILTER'].values)
+
+		def per_contig(weights):
+			return np.bincount(chrom_codes, weights=weights, minlength=len(chroms))
+
+		has_qual = ~np.isnan(qual)
+		# one row of contig_columns per contig
+		chunk_contigs = np.column_stack([
+			per_contig(None),
+			per_contig(is_snp),
+			per_contig(1 - is_snp),
+			per_contig(nb_transitions),
+			per_contig(nb_transversions),
+			per_contig(nb_alts > 1),
+			per_contig(filter_codes == (list(filters).index('PASS') if 'PASS' in filters else -2)),
+			per_contig(np.where(has_qual, qual, 0)),
+			per_contig(has_qual),
+			per_contig(np.where(is_snp == 1, 0, alt_lengths))])
+		# zero padding can merge contigs, like '1' and '01'
+		add_counts(self.contig_counts, chroms.values, chunk_contigs)
+
+		pair_counts = np.bincount(pair_codes, minlength=len(pairs))
+		for pair, pair_count in zip(pairs, pair_counts):
+			indel_lengths = allele_indel_lengths(refs[pair // len(alts)], alts[pair % len(alts)])
+			add_counts(self.indel_lengths, indel_lengths, [int(pair_count)] * len(indel_lengths))
+
+		for filter_value, filter_count in zip(filters, np.bincount(filter_codes, minlength=len(filters))):
+			filter_names = filter_value.split(';')
+			add_counts(self.filters, filter_names, [int(filter_count)] * len(filter_names))
+		allele_counts = np.bincount(nb_alts)
+		add_counts(self.allele_counts, np.flatnonzero(allele_counts).tolist(), allele_counts[allele_counts > 0].tolist())
+
+		self.qual_histogram += histogram(qual[has_qual], qual_bin_edges)
+		self.missing_qual += int((~has_qual).sum())
+		has_dp = ~np.isnan(dp)
+		self.dp_histogram += histogram(dp[has_dp], dp_bin_edges)
+		self.missing_dp += int((~has_dp).sum())
+		self.dp_sum += float(dp[has_dp].sum())
+		if self.approximate is not None:
+			self.approximate.add_chunk(chunk, qual, dp, alts)
+
+		if self.alt_counts is not None:
+			if multibase_alt.any():
+				self.alt_counts = None
+			else:
+				add_counts(self.alt_counts, alts, np.bincount(alt_codes, minlength=len(alts)).tolist())
+
+	@property
+	def contigs(self):
+		"""
+		DataFrame of the contig_columns totals of each contig, sorted by name.
+		"""
+		return pd.DataFrame(list(self.contig_counts.values()), index=list(self.contig_counts), columns=contig_columns,
+							dtype=float).sort_index()
+
+	@contigs.setter
+	def contigs(self, contigs):
+		self.contig_counts = {chrom: contig.values.astype(float) for chrom, contig in contigs.reindex(columns=contig_columns).iterrows()}
+
+	def total(self, column):
+		return int(self.contigs[column].sum())
+
+	def summary(self):
+		"""
+		Returns a dictionary of the genome wide statistics, with None for those
+		that can't be computed.
+		"""
+		nb_variants = self.total('variant_count')
+		nb_indels = self.total('indel_count')
+		nb_transitions, nb_transversions = self.total('transition_count'), self.total('transversion_count')
+		qual_count = self.total('qual_count')
+		dp_count = int(self.dp_histogram.sum())
+		return {
+			'variant_count': nb_variants,
+			'snp_count': self.total('snp_count'),
+			'indel_count': nb_indels,
+			'transition_count': nb_transitions,
+			'transversion_count': nb_transversions,
+			'ts_tv_ratio': nb_transitions / nb_transversions if nb_transversions > 0 else None,
+			'multiallelic_count': self.total('multiallelic_count'),
+			'pass_count': self.total('pass_count'),
+			'qual_mean': float(self.contigs['qual_sum'].sum()) / qual_count if qual_count > 0 else None,
+			'dp_mean': self.dp_sum / dp_count if dp_count > 0 else None,
+			'avg_indel_length': self.total('indel_alt_length') / nb_indels if nb_indels > 0 else None,
+			'contig_count': len(self.contigs)}
+
+	def legacy_counts(self):
+		"""
+		Returns the statistics in the dictionary format of the stats table.
+		"""
+		contigs = self.contigs.astype(int)
+		variant_stats = {"Total_SNP_Count": self.total('snp_count'), "Total_Indel_Count": self.total('indel_count')}
+		alt_types = set()
+		if self.alt_counts is not None:
+			for alt, alt_count in self.alt_counts.items():
+				alt_types.add(alt)
+				variant_stats[alt + "_Alt_Count"] = int(alt_count)
+		for chrom, contig in contigs.iterrows():
+			if contig['snp_count'] > 0:
+				variant_stats[chrom + "_Chrom_SNP_Count"] = int(contig['snp_count'])
+			if contig['indel_count'] > 0:
+				variant_stats[chrom + "_Chrom_Indel_Count"] = int(contig['indel_count'])
+			variant_stats[chrom + "_Chrom_Variant_Count"] = int(contig['variant_count'])
+
+		nb_contigs = max(1, len(contigs))
+		if self.total('indel_alt_length') > 0 and variant_stats["Total_Indel_Count"] > 0:
+			variant_stats["Avg_Indel_Length"] = round(float(self.total('indel_alt_length') / variant_stats["Total_Indel_Count"]), 3)
+		variant_stats["Avg_SNP_per_Chrom"] = int(variant_stats["Total_SNP_Count"] / nb_contigs)
+		variant_stats["Avg_Indel_per_Chrom"] = int(variant_stats["Total_Indel_Count"] / nb_contigs)
+		variant_stats["Avg_Variant_per_Chrom"] = int((variant_stats["Total_SNP_Count"] + variant_stats["Total_Indel_Count"]) / nb_contigs)
+		variant_stats["List_Chromosomes"] = set(contigs.index)
+		if alt_types != set():
+			variant_stats["ALT_Types"] = alt_types
+		return variant_stats
+
+
+def compute_stats(vcf_file, header_lines, chunk_size, progress=None, approximate=False):
+	"""
+	Returns the VcfStats of a decompressed VCF whose column header line is
+	preceded by header_lines lines. progress, if given, is called with the
+	number of variants read after each chunk. If approximate, distinct counts,
+	quantiles and a preview sample are also estimated in the same pass.
+	"""
+	vcf_stats = VcfStats(approximate)
+	nb_variants = 0
+	vcf_chunks = pd.read_csv(vcf_file, sep="\t", skiprows=header_lines, usecols=vcf_stats_columns if approximate else exact_stats_columns,
+							 chunksize=chunk_size, dtype=object, keep_default_na=False)
+	for chunk in vcf_chunks:
+		vcf_stats.add_chunk(chunk)
+		nb_variants += len(chunk)
+		if progress is not None:
+			progress(nb_variants)
+	return vcf_stats
+
+
+def store_stats(connection, vcf_stats):
+	"""
+	Writes statistics to the typed stats_* tables of a database, replacing any
+	previous ones.
+	"""
+	cursor = connection.cursor()
+	for table in ('stats_summary', 'stats_contigs', 'stats_indel_lengths', 'stats_distributions', 'stats_filters', 'stats_allele_counts',
+				  'stats_approximate', 'stats_preview'):
+		cursor.execute("DROP TABLE IF EXISTS " + table + ";")
+	cursor.execute("CREATE TABLE stats_summary (metric TEXT PRIMARY KEY, value REAL);")
+	cursor.execute("CREATE TABLE stats_contigs (CHROM TEXT PRIMARY KEY, variant_count INTEGER, snp_count INTEGER, indel_count INTEGER, "
+				   "transition_count INTEGER, transversion_count INTEGER, multiallelic_count INTEGER, pass_count INTEGER, "
+				   "qual_mean REAL);")
+	cursor.execute("CREATE TABLE stats_indel_lengths (length INTEGER PRIMARY KEY, count INTEGER);")
+	cursor.execute("CREATE TABLE stats_distributions (metric TEXT, bin_start REAL, bin_end REAL, count INTEGER);")
+	cursor.execute("CREATE TABLE stats_filters (filter TEXT PRIMARY KEY, count INTEGER);")
+	cursor.execute("CREATE TABLE stats_allele_counts (alt_count INTEGER PRIMARY KEY, count INTEGER);")
+
+	cursor.executemany("INSERT INTO stats_summary VALUES (?, ?);", list(vcf_stats.summary().items()))
+	cursor.executemany("INSERT INTO stats_contigs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",
+					   [(str(chrom), int(contig['variant_count']), int(contig['snp_count']), int(contig['indel_count']),
+						 int(contig['transition_count']), int(contig['transversion_count']), int(contig['multiallelic_count']),
+						 int(contig['pass_count']), contig['qual_sum'] / contig['qual_count'] if contig['qual_count'] > 0 else None)
+						for chrom, contig in vcf_stats.contigs.iterrows()])
+	cursor.executemany("INSERT INTO stats_indel_lengths VALUES (?, ?);",
+					   [(int(length), int(count)) for length, count in sorted(vcf_stats.indel_lengths.items())])
+	for metric, bin_edges, counts, missing in (('QUAL', qual_bin_edges, vcf_stats.qual_histogram, vcf_stats.missing_qual),
+												('DP', dp_bin_edges, vcf_stats.dp_histogram, vcf_stats.missing_dp)):
+		# values that are missing are counted in a bin without bounds
+		cursor.executemany("INSERT INTO stats_distributions VALUES (?, ?, ?, ?);",
+						   [(metric, float(bin_start), float(bin_end) if np.isfinite(bin_end) else None, int(count))
+							for bin_start, bin_end, count in zip(bin_edges[:-1], bin_edges[1:], counts)] +
+						   [(metric, None, None, int(missing))])
+	cursor.executemany("INSERT INTO stats_filters VALUES (?, ?);", [(str(filter_value), int(count)) for filter_value, count in vcf_stats.filters.items()])
+	cursor.executemany("INSERT INTO stats_allele_counts VALUES (?, ?);",
+					   [(int(alt_count), int(count)) for alt_count, count in sorted(vcf_stats.allele_counts.items())])
+	connection.commit()
+	if vcf_stats.approximate is not None:
+		approximate_stats.store_estimates(connection, vcf_stats.approximate)
+
+
+def store_stat_values(connection, stat_values):
+	"""
+	Writes a dictionary of statistics to the stats table, numbers as they are
+	and anything else as JSON, replacing any previous statistics.
+	"""
+	stat_rows = []
+	for tag, value in stat_values.items():
+		if isinstance(value, (set, frozenset)):
+			stat_rows.append((str(tag), 'set', None, json.dumps(sorted(value))))
+		elif isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+			stat_rows.append((str(tag), 'number', value.item() if isinstance(value, np.generic) else value, None))
+		else:
+			stat_rows.append((str(tag), 'json', None, json.dumps(value)))
+	cursor = connection.cursor()
+	cursor.execute("DROP TABLE IF EXISTS stats;")
+	# Value has no declared type, so integers and floats are kept as given
+	cursor.execute("CREATE TABLE stats (Tag TEXT PRIMARY KEY, Kind TEXT, Value, Json TEXT);")
+	cursor.executemany("INSERT INTO stats VALUES (?, ?, ?, ?);", stat_rows)
+	connection.commit()
+
+
+def load_stat_values(connection):
+	"""
+	Returns the dictionary of statistics stored in the stats table. Sessions
+	saved before statistics were typed hold them as text, which is parsed as a
+	Python literal; values that can't be parsed are left out.
+	"""
+	stat_values = {}
+	try:
+		stat_rows = connection.execute("SELECT Tag, Kind, Value, Json FROM stats;").fetchall()
+	except sqlite3.OperationalError:
+		for tag, result in connection.execute("SELECT Tag, Result FROM stats;"):
+			try:
+				stat_values[tag] = ast.literal_eval(result)
+			except (ValueError, SyntaxError):
+				# sets were truncated to 200 characters, and kept as text they
+				# would be taken for sets of characters
+				pass
+		return stat_values
+
+	for tag, kind, value, json_value in stat_rows:
+		if kind == 'number':
+			stat_values[tag] = value
+		elif kind == 'set':
+			stat_values[tag] = set(json.loads(json_value))
+		else:
+			stat_values[tag] = json.loads(json_value)
+	return stat_values
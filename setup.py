@@ -23,7 +23,6 @@ setup(
 		'numpy',
 		'PyQt5',
 		'requests',
-		'wget',
 		'matplotlib'
 	],
 	classifiers=[
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+conftest.py - Fixtures shared by the tests.
+
+stub_server starts a local HTTP server whose responses are written by the
+test, so that the ENSEMBL client and the downloads are tested without network
+access.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		self.server.requests.append((self.command, self.path, dict(self.headers)))
+		self.server.respond(self)
+
+	do_HEAD = do_GET
+
+	def send_body(self, status, body, headers=None):
+		"""
+		Sends a complete response, without its body for HEAD requests.
+		"""
+		self.send_response(status)
+		for header, value in (headers or {}).items():
+			self.send_header(header, value)
+		if 'Content-Length' not in (headers or {}):
+			self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		if self.command != 'HEAD':
+			self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+@pytest.fixture
+def stub_server():
+	"""
+	Returns a function starting a server that answers each request by calling
+	respond(handler), and returning its base URL. The server's requests
+	attribute lists the (method, path, headers) of the requests it received.
+	"""
+	servers = []
+
+	def start_server(respond):
+		server = ThreadingHTTPServer(("127.0.0.1", 0), StubRequestHandler)
+		server.daemon_threads = True
+		server.respond = respond
+		server.requests = []
+		threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+		servers.append(server)
+		server.url = "http://127.0.0.1:" + str(server.server_address[1])
+		return server
+
+	yield start_server
+	for server in servers:
+		server.shutdown()
+		server.server_close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+test_annotation.py - Tests of the sharded annotation, with cat and sed standing
+in for SnpEff and SnpSift.
+"""
+
+import os
+
+import pytest
+
+from metallaxis import annotation
+
+vcf_header = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+# the first stage passes the shard through, the second adds a header line and
+# an INFO tag to every record, as the annotators do
+stub_stages = [["cat", "{input}"],
+			   ["sed", "-e", "/^#CHROM/i ##stub_annotation=yes", "-e", "/^#/!s/$/;STUB=1/", "{input}"]]
+
+
+def write_vcf(vcf_file, nb_records):
+	records = ["1\t" + str(100 + record_nb) + "\trs" + str(record_nb) + "\tA\tG\t50\tPASS\tDP=" + str(record_nb) + "\n"
+			   for record_nb in range(nb_records)]
+	with open(vcf_file, 'w') as vcf_write_obj:
+		vcf_write_obj.write(vcf_header + "".join(records))
+	return records
+
+
+def test_split_vcf(tmp_path):
+	vcf_file = str(tmp_path / "variants.vcf")
+	records = write_vcf(vcf_file, 100)
+	shard_dir = tmp_path / "shards"
+	shard_dir.mkdir()
+
+	shard_files, shard_records = annotation.split_vcf(vcf_file, str(shard_dir), 4)
+	assert len(shard_files) == 4 and sum(shard_records) == 100
+	shard_lines = []
+	for shard_file, nb_records in zip(shard_files, shard_records):
+		with open(shard_file) as shard_read_obj:
+			lines = shard_read_obj.readlines()
+		# every shard has the full header
+		assert "".join(lines[:2]) == vcf_header
+		assert len(lines) == 2 + nb_records
+		shard_lines += lines[2:]
+	assert shard_lines == records
+
+
+def test_annotate_sharded_keeps_order_and_header(tmp_path):
+	vcf_file = str(tmp_path / "variants.vcf")
+	records = write_vcf(vcf_file, 200)
+	output_file = str(tmp_path / "annotated.vcf")
+	progress_calls = []
+
+	annotation.annotate_sharded(vcf_file, output_file, stub_stages, 8, nb_workers=3, working_dir=str(tmp_path),
+								progress=lambda annotated_records, total_records: progress_calls.append((annotated_records, total_records)))
+	with open(output_file) as output_read_obj:
+		lines = output_read_obj.readlines()
+	# a single header, with the line added by the annotator, then every record in order
+	assert lines[:3] == ["##fileformat=VCFv4.2\n", "##stub_annotation=yes\n", vcf_header.splitlines(True)[1]]
+	assert lines[3:] == [record[:-1] + ";STUB=1\n" for record in records]
+	assert progress_calls[-1] == (200, 200)
+	# the shards are removed
+	assert sorted(os.listdir(str(tmp_path))) == ["annotated.vcf", "variants.vcf"]
+
+
+def test_annotate_sharded_without_records(tmp_path):
+	vcf_file = str(tmp_path / "variants.vcf")
+	write_vcf(vcf_file, 0)
+	output_file = str(tmp_path / "annotated.vcf")
+
+	annotation.annotate_sharded(vcf_file, output_file, stub_stages, 8, nb_workers=2, working_dir=str(tmp_path))
+	with open(output_file) as output_read_obj:
+		assert output_read_obj.read() == "##fileformat=VCFv4.2\n##stub_annotation=yes\n" + vcf_header.splitlines(True)[1]
+
+
+def test_failing_stage(tmp_path):
+	vcf_file = str(tmp_path / "variants.vcf")
+	write_vcf(vcf_file, 50)
+	output_file = str(tmp_path / "annotated.vcf")
+	failing_stages = stub_stages + [["sh", "-c", "cat > /dev/null; echo database not found >&2; exit 3"]]
+
+	with pytest.raises(annotation.AnnotationError, match="exit code 3:\ndatabase not found"):
+		annotation.annotate_sharded(vcf_file, output_file, failing_stages, 8, nb_workers=2, working_dir=str(tmp_path))
+	assert sorted(os.listdir(str(tmp_path))) == ["variants.vcf"]
+
+
+def test_stage_memory():
+	stages = annotation.snpeff_snpsift_stages("snpEff.jar", "SnpSift.jar", "GRCh38.99", "dbsnp.vcf.gz", "clinvar.vcf.gz")
+	# only SnpEff shares the budget, both SnpSift JVMs get 1Gb
+	assert annotation.stage_memory(stages) == (1, 2)
+	assert annotation.job_memory(16, 2, stages) == 6
+	# SnpEff needs its minimum on top of the SnpSift JVMs
+	assert annotation.chain_memory(stages) == annotation.min_memory_per_jvm + 2
+	assert annotation.chain_memory(stages[:1]) == annotation.min_memory_per_jvm
+
+
+def test_annotation_workers(monkeypatch):
+	monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+	stages = annotation.snpeff_snpsift_stages("snpEff.jar", "SnpSift.jar", "GRCh38.99", "dbsnp.vcf.gz", "clinvar.vcf.gz")
+	# as many chains as fit in 16Gb, each SnpEff getting an even share of what is left
+	assert annotation.annotation_workers(16, 8, stages[:1]) == (4, 4)
+	assert annotation.annotation_workers(16, 8, stages) == (2, 6)
+	assert annotation.annotation_workers(2, 8, stages) == (1, 1)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+test_bloom.py - Tests of the Bloom filter of known variants.
+"""
+
+import gzip
+import os
+import random
+
+import numpy as np
+import pytest
+
+from metallaxis import bloom
+
+vcf_header = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+nb_known_variants = 20000
+
+
+def random_variants(nb_variants, seed):
+	random_generator = random.Random(seed)
+	return [(random_generator.choice(["1", "2", "X", "MT"]), random_generator.randint(1, 10 ** 8),
+			 random_generator.choice("ACGT"), random_generator.choice("ACGT") + random_generator.choice(["", "A", "TT"]))
+			for variant_nb in range(nb_variants)]
+
+
+def write_vcf(vcf_file, variants, gzipped=False):
+	vcf_write_obj = gzip.open(vcf_file, 'wt') if gzipped else open(vcf_file, 'w')
+	with vcf_write_obj:
+		vcf_write_obj.write(vcf_header)
+		for chrom, pos, ref, alt in variants:
+			vcf_write_obj.write("\t".join([chrom, str(pos), ".", ref, alt, ".", "PASS", "."]) + "\n")
+
+
+def contains_variants(bloom_filter, variants):
+	chroms, positions, refs, alts = zip(*variants)
+	return bloom_filter.contains_variants(chroms, positions, refs, alts)
+
+
+@pytest.fixture(scope="module")
+def known_variants():
+	return random_variants(nb_known_variants, seed=1)
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["plain", "gzipped"])
+def dbsnp_filter(request, tmp_path_factory, known_variants):
+	filter_dir = tmp_path_factory.mktemp("bloom")
+	vcf_file = str(filter_dir / ("dbsnp.vcf.gz" if request.param else "dbsnp.vcf"))
+	write_vcf(vcf_file, known_variants, gzipped=request.param)
+	filter_file = str(filter_dir / "dbsnp.bloom")
+	assert bloom.build_bloom_filter(vcf_file, filter_file, false_positive_rate=0.01, chunk_size=3000) == nb_known_variants
+	return vcf_file, filter_file
+
+
+def test_count_records(dbsnp_filter):
+	vcf_file, filter_file = dbsnp_filter
+	assert bloom.count_records(vcf_file) == (nb_known_variants, 2)
+
+
+def test_no_false_negatives(dbsnp_filter, known_variants):
+	vcf_file, filter_file = dbsnp_filter
+	with bloom.BloomFilter(filter_file) as bloom_filter:
+		assert bloom_filter.nb_variants == nb_known_variants
+		assert contains_variants(bloom_filter, known_variants).all()
+
+
+def test_false_positive_rate(dbsnp_filter, known_variants):
+	vcf_file, filter_file = dbsnp_filter
+	known_keys = set(known_variants)
+	novel_variants = [variant for variant in random_variants(50000, seed=2) if variant not in known_keys]
+	with bloom.BloomFilter(filter_file) as bloom_filter:
+		false_positive_rate = contains_variants(bloom_filter, novel_variants).mean()
+	# the filter is sized for 10% more variants than records, so stays under the requested 1%
+	assert false_positive_rate < 0.015
+
+
+def test_false_positive_rate_follows_setting(tmp_path, known_variants):
+	vcf_file = str(tmp_path / "dbsnp.vcf")
+	write_vcf(vcf_file, known_variants)
+	filter_file = str(tmp_path / "dbsnp.bloom")
+	bloom.build_bloom_filter(vcf_file, filter_file, false_positive_rate=0.2)
+
+	novel_variants = random_variants(50000, seed=3)
+	with bloom.BloomFilter(filter_file) as bloom_filter:
+		false_positive_rate = contains_variants(bloom_filter, novel_variants).mean()
+	assert 0.08 < false_positive_rate < 0.25
+
+
+def test_contig_names_are_normalised(dbsnp_filter, known_variants):
+	vcf_file, filter_file = dbsnp_filter
+	variant = next(variant for variant in known_variants if variant[0] == "1")
+	mitochondrial_variant = next(variant for variant in known_variants if variant[0] == "MT")
+	with bloom.BloomFilter(filter_file) as bloom_filter:
+		# sessions store contigs zero padded, other VCFs prefix them with chr
+		for chrom in ("1", "01", "chr1"):
+			assert contains_variants(bloom_filter, [(chrom,) + variant[1:]]).all()
+		for chrom in ("MT", "M", "chrM"):
+			assert contains_variants(bloom_filter, [(chrom,) + mitochondrial_variant[1:]]).all()
+
+
+def test_multiallelic_variants(tmp_path):
+	vcf_file = str(tmp_path / "dbsnp.vcf")
+	write_vcf(vcf_file, [("1", 100, "A", "C,G"), ("2", 200, "T", "A")])
+	filter_file = str(tmp_path / "dbsnp.bloom")
+	# each ALT of a multi-allelic record is added
+	assert bloom.build_bloom_filter(vcf_file, filter_file, false_positive_rate=1e-6) == 3
+
+	with bloom.BloomFilter(filter_file) as bloom_filter:
+		assert list(bloom_filter.contains_variants(["1", "1", "1", "2"], [100, 100, 100, 200], ["A", "A", "A", "T"], ["G", "T", "T,C", "C"])) == [True, False, True, False]
+		assert bloom_filter.contains_variants([], [], [], []).dtype == np.bool_
+
+
+def test_progress(tmp_path, known_variants):
+	vcf_file = str(tmp_path / "dbsnp.vcf")
+	write_vcf(vcf_file, known_variants)
+	progress_calls = []
+	bloom.build_bloom_filter(vcf_file, str(tmp_path / "dbsnp.bloom"), chunk_size=7000,
+							 progress=lambda added_records, total_records: progress_calls.append((added_records, total_records)))
+	assert progress_calls == [(7000, nb_known_variants), (14000, nb_known_variants), (nb_known_variants, nb_known_variants)]
+
+
+def test_is_filter_current(tmp_path):
+	vcf_file = str(tmp_path / "dbsnp.vcf")
+	write_vcf(vcf_file, random_variants(100, seed=4))
+	filter_file = str(tmp_path / "dbsnp.bloom")
+	assert not bloom.is_filter_current(filter_file, vcf_file)
+
+	bloom.build_bloom_filter(vcf_file, filter_file)
+	assert bloom.is_filter_current(filter_file, vcf_file)
+	assert not os.path.exists(filter_file + ".building")
+
+	# a new release of the VCF needs a new filter
+	write_vcf(vcf_file, random_variants(101, seed=4))
+	os.utime(vcf_file, (os.path.getatime(vcf_file), os.path.getmtime(vcf_file) + 10))
+	assert not bloom.is_filter_current(filter_file, vcf_file)
+
+
+def test_invalid_filter_file(tmp_path):
+	vcf_file = str(tmp_path / "dbsnp.vcf")
+	write_vcf(vcf_file, random_variants(100, seed=5))
+	filter_file = str(tmp_path / "dbsnp.bloom")
+	with open(filter_file, 'wb') as filter_write_obj:
+		filter_write_obj.write(b"not a filter")
+
+	with pytest.raises(ValueError):
+		bloom.BloomFilter(filter_file)
+	assert not bloom.is_filter_current(filter_file, vcf_file)
+
+
+def test_filter_size():
+	nb_bits, nb_hashes = bloom.filter_size(1000000, 0.01)
+	# about 9.6 bits and 7 hashes per variant for a 1% false positive rate
+	assert 9.5e6 < nb_bits < 9.7e6
+	assert nb_bits % 8 == 0
+	assert nb_hashes == 7
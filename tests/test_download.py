@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+test_download.py - Tests of the resumable, parallel downloads against a stub server.
+"""
+
+import hashlib
+import os
+import random
+
+import pytest
+
+from metallaxis import download
+
+payload = bytes(random.Random(1).getrandbits(8) for byte_nb in range(10000))
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+	# so that a 10kb file is downloaded in several segments
+	monkeypatch.setattr(download, 'download_chunk_size', 1024)
+
+
+def file_server(stub_server, accepts_ranges=True, md5=None):
+	"""
+	Starts a server of payload at /db.vcf.gz. md5, if given, is published at
+	/db.vcf.gz.md5. While the server's drop_after is set to a tuple of a byte
+	offset and a size, a range request starting at that offset is answered
+	with that many bytes before the connection drops.
+	"""
+	def respond(handler):
+		if handler.path == "/db.vcf.gz.md5" and md5 is not None:
+			handler.send_body(200, (md5 + "  db.vcf.gz\n").encode('UTF-8'))
+		elif handler.path != "/db.vcf.gz":
+			handler.send_body(404, b"Not found")
+		elif handler.command == 'HEAD' or 'Range' not in handler.headers or not accepts_ranges:
+			handler.send_body(200, payload, {'Accept-Ranges': "bytes"} if accepts_ranges else {})
+		else:
+			range_start, range_end = [int(offset) for offset in handler.headers['Range'][len("bytes="):].split("-")]
+			range_body = payload[range_start:range_end + 1]
+			headers = {'Content-Range': "bytes " + str(range_start) + "-" + str(range_end) + "/" + str(len(payload))}
+			drop_after = handler.server.drop_after
+			if drop_after is not None and range_start == drop_after[0]:
+				handler.send_response(206)
+				handler.send_header('Content-Range', headers['Content-Range'])
+				handler.send_header('Content-Length', str(len(range_body)))
+				handler.end_headers()
+				handler.wfile.write(range_body[:drop_after[1]])
+				handler.close_connection = True
+			else:
+				handler.send_body(206, range_body, headers)
+
+	server = stub_server(respond)
+	server.drop_after = None
+	return server
+
+
+def range_requests(server):
+	return [request_headers['Range'] for method, path, request_headers in server.requests if method == 'GET' and 'Range' in request_headers]
+
+
+def test_parallel_download(stub_server, tmp_path):
+	server = file_server(stub_server)
+	output_path = str(tmp_path / "db.vcf.gz")
+	progress_calls = []
+
+	download.download_file(server.url + "/db.vcf.gz", output_path, nb_segments=4,
+						   progress=lambda downloaded_bytes, total_bytes: progress_calls.append((downloaded_bytes, total_bytes)))
+	with open(output_path, 'rb') as output_read_obj:
+		assert output_read_obj.read() == payload
+	assert sorted(range_requests(server)) == ["bytes=0-2499", "bytes=2500-4999", "bytes=5000-7499", "bytes=7500-9999"]
+	assert progress_calls[-1] == (len(payload), len(payload))
+	assert sorted(os.listdir(str(tmp_path))) == ["db.vcf.gz"]
+
+
+def test_interrupted_download_resumes(stub_server, tmp_path):
+	server = file_server(stub_server)
+	output_path = str(tmp_path / "db.vcf.gz")
+	# the third segment stops after 2000 of its 2500 bytes
+	server.drop_after = (5000, 2000)
+	with pytest.raises(download.DownloadError, match="resume"):
+		download.download_file(server.url + "/db.vcf.gz", output_path, nb_segments=4)
+	assert not os.path.exists(output_path)
+	part_sizes = [os.path.getsize(output_path + ".part" + str(segment_nb)) for segment_nb in range(4)]
+	assert part_sizes[2] < 2500
+
+	server.drop_after = None
+	nb_first_requests = len(range_requests(server))
+	download.download_file(server.url + "/db.vcf.gz", output_path, nb_segments=4)
+	with open(output_path, 'rb') as output_read_obj:
+		assert output_read_obj.read() == payload
+	# only the missing bytes of unfinished segments are requested again
+	expected_ranges = ["bytes=" + str(segment_start + part_size) + "-" + str(segment_start + 2499)
+					   for segment_start, part_size in zip([0, 2500, 5000, 7500], part_sizes) if part_size < 2500]
+	assert sorted(range_requests(server)[nb_first_requests:]) == expected_ranges
+	assert sorted(os.listdir(str(tmp_path))) == ["db.vcf.gz"]
+
+
+def test_state_of_another_file_is_discarded(stub_server, tmp_path):
+	server = file_server(stub_server)
+	output_path = str(tmp_path / "db.vcf.gz")
+	with open(output_path + ".download", 'w') as state_write_obj:
+		state_write_obj.write('{"url": "http://example.org/old.vcf.gz", "size": 5, "segments": 1, "ranges": true}')
+	with open(output_path + ".part0", 'wb') as part_write_obj:
+		part_write_obj.write(b"stale")
+
+	download.download_file(server.url + "/db.vcf.gz", output_path, nb_segments=4)
+	with open(output_path, 'rb') as output_read_obj:
+		assert output_read_obj.read() == payload
+
+
+def test_download_without_ranges(stub_server, tmp_path):
+	server = file_server(stub_server, accepts_ranges=False)
+	output_path = str(tmp_path / "db.vcf.gz")
+
+	download.download_file(server.url + "/db.vcf.gz", output_path, nb_segments=4)
+	with open(output_path, 'rb') as output_read_obj:
+		assert output_read_obj.read() == payload
+	assert range_requests(server) == []
+
+
+def test_md5_mismatch(stub_server, tmp_path):
+	server = file_server(stub_server, md5="0" * 32)
+	output_path = str(tmp_path / "db.vcf.gz")
+
+	with pytest.raises(download.DownloadError, match="md5"):
+		download.ensure_downloaded(server.url + "/db.vcf.gz", output_path)
+	assert os.listdir(str(tmp_path)) == []
+
+
+def test_md5_match(stub_server, tmp_path):
+	server = file_server(stub_server, md5=hashlib.md5(payload).hexdigest().upper())
+	output_path = str(tmp_path / "db.vcf.gz")
+
+	download.ensure_downloaded(server.url + "/db.vcf.gz", output_path)
+	assert download.file_md5(output_path) == hashlib.md5(payload).hexdigest()
+
+
+def test_ensure_downloaded_keeps_complete_files(stub_server, tmp_path):
+	server = file_server(stub_server)
+	output_path = str(tmp_path / "db.vcf.gz")
+	with open(output_path, 'wb') as output_write_obj:
+		output_write_obj.write(b"x" * len(payload))
+
+	download.ensure_downloaded(server.url + "/db.vcf.gz", output_path)
+	assert [method for method, path, request_headers in server.requests] == ['HEAD']
+	with open(output_path, 'rb') as output_read_obj:
+		assert output_read_obj.read() == b"x" * len(payload)
+
+
+def test_ensure_downloaded_replaces_truncated_files(stub_server, tmp_path):
+	server = file_server(stub_server)
+	output_path = str(tmp_path / "db.vcf.gz")
+	with open(output_path, 'wb') as output_write_obj:
+		output_write_obj.write(payload[:3000])
+
+	download.ensure_downloaded(server.url + "/db.vcf.gz", output_path)
+	with open(output_path, 'rb') as output_read_obj:
+		assert output_read_obj.read() == payload
+
+
+def test_unreachable_server(tmp_path):
+	with pytest.raises(download.DownloadError, match="Could not reach"):
+		download.download_file("http://127.0.0.1:1/db.vcf.gz", str(tmp_path / "db.vcf.gz"))
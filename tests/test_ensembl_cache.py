@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+test_ensembl_cache.py - Tests of the on-disk cache of ENSEMBL responses.
+"""
+
+import json
+import time
+
+from metallaxis import ensembl_cache
+
+
+def gene(gene_id, start, end):
+	return {'gene_id': gene_id, 'start': start, 'end': end}
+
+
+def test_merge_intervals():
+	assert ensembl_cache.merge_intervals([(50, 60), (1, 10), (11, 20), (15, 30)]) == [(1, 30), (50, 60)]
+
+
+def test_lookup_returns_cached_genes_and_gaps(tmp_path):
+	response_cache = ensembl_cache.ResponseCache(str(tmp_path / "cache.sqlite"))
+	response_cache.store("homo_sapiens", "GRCh38", "1", 1000, 2000, [gene("A", 900, 1100), gene("B", 1900, 2500)])
+	response_cache.store("homo_sapiens", "GRCh38", "1", 5000, 6000, [gene("C", 5500, 5600)])
+
+	genes, gaps = response_cache.lookup("homo_sapiens", "GRCh38", "1", 1500, 5700)
+	assert sorted(cached_gene['gene_id'] for cached_gene in genes) == ["B", "C"]
+	assert gaps == [(2001, 4999)]
+
+	genes, gaps = response_cache.lookup("homo_sapiens", "GRCh38", "1", 1000, 2000)
+	assert sorted(cached_gene['gene_id'] for cached_gene in genes) == ["A", "B"]
+	assert gaps == []
+
+
+def test_lookup_is_keyed_by_assembly_and_contig(tmp_path):
+	response_cache = ensembl_cache.ResponseCache(str(tmp_path / "cache.sqlite"))
+	response_cache.store("homo_sapiens", "GRCh38", "1", 1000, 2000, [gene("A", 900, 1100)])
+
+	assert response_cache.lookup("homo_sapiens", "GRCh37", "1", 1000, 2000) == ([], [(1000, 2000)])
+	assert response_cache.lookup("homo_sapiens", "GRCh38", "2", 1000, 2000) == ([], [(1000, 2000)])
+
+
+def test_lookup_is_shared_between_instances(tmp_path):
+	ensembl_cache.ResponseCache(str(tmp_path / "cache.sqlite")).store("homo_sapiens", "GRCh38", "1", 1000, 2000, [gene("A", 900, 1100)])
+
+	genes, gaps = ensembl_cache.ResponseCache(str(tmp_path / "cache.sqlite")).lookup("homo_sapiens", "GRCh38", "1", 1000, 2000)
+	assert [cached_gene['gene_id'] for cached_gene in genes] == ["A"]
+	assert gaps == []
+
+
+def test_expired_responses_are_ignored_and_evicted(tmp_path, monkeypatch):
+	response_cache = ensembl_cache.ResponseCache(str(tmp_path / "cache.sqlite"), ttl_days=1)
+	response_cache.store("homo_sapiens", "GRCh38", "1", 1000, 2000, [gene("A", 900, 1100)])
+
+	two_days_later = time.time() + 2 * 24 * 60 * 60
+	monkeypatch.setattr(ensembl_cache.time, 'time', lambda: two_days_later)
+	assert response_cache.lookup("homo_sapiens", "GRCh38", "1", 1000, 2000) == ([], [(1000, 2000)])
+	response_cache.evict()
+	assert response_cache.info() == (0, 0)
+
+
+def test_least_recently_used_responses_are_evicted_first(tmp_path, monkeypatch):
+	clock = [1000000.0]
+	monkeypatch.setattr(ensembl_cache.time, 'time', lambda: clock[0])
+	# a little over two responses fit
+	response_size = len(json.dumps([gene("A", 1500, 1600)]))
+	response_cache = ensembl_cache.ResponseCache(str(tmp_path / "cache.sqlite"), max_size_mb=(2.5 * response_size) / (1024 * 1024))
+
+	response_cache.store("homo_sapiens", "GRCh38", "1", 1000, 2000, [gene("A", 1500, 1600)])
+	clock[0] += 1
+	response_cache.store("homo_sapiens", "GRCh38", "1", 3000, 4000, [gene("B", 3500, 3600)])
+	clock[0] += 1
+	# the first response becomes the most recently used
+	response_cache.lookup("homo_sapiens", "GRCh38", "1", 1000, 2000)
+	clock[0] += 1
+	response_cache.store("homo_sapiens", "GRCh38", "1", 5000, 6000, [gene("C", 5500, 5600)])
+
+	assert response_cache.info()[0] == 2
+	assert response_cache.lookup("homo_sapiens", "GRCh38", "1", 1000, 2000)[1] == []
+	assert response_cache.lookup("homo_sapiens", "GRCh38", "1", 3000, 4000)[1] == [(3000, 4000)]
+	assert response_cache.lookup("homo_sapiens", "GRCh38", "1", 5000, 6000)[1] == []
+
+
+def test_clear(tmp_path):
+	response_cache = ensembl_cache.ResponseCache(str(tmp_path / "cache.sqlite"))
+	response_cache.store("homo_sapiens", "GRCh38", "1", 1000, 2000, [gene("A", 900, 1100)])
+	assert response_cache.info()[0] == 1
+	response_cache.clear()
+	assert response_cache.info() == (0, 0)
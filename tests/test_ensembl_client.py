@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+test_ensembl_client.py - Tests of the ENSEMBL REST client against a stub server.
+"""
+
+import json
+import socket
+import time
+
+import pytest
+
+from metallaxis import ensembl_client
+
+
+def json_body(value):
+	return json.dumps(value).encode('UTF-8')
+
+
+def test_get_decodes_json(stub_server):
+	server = stub_server(lambda handler: handler.send_body(200, json_body({'path': handler.path})))
+	client = ensembl_client.EnsemblClient(server.url + "/", requests_per_second=1000)
+
+	assert client.get("/info/ping") == {'path': "/info/ping"}
+	assert client.overlap_genes("homo_sapiens", "1", 1000, 2000) == {'path': "/overlap/region/homo_sapiens/1:1000-2000?feature=gene"}
+	assert server.requests[0][2]['Accept'] == "application/json"
+
+
+def test_retry_after_is_honoured(stub_server):
+	def respond(handler):
+		if len(handler.server.requests) == 1:
+			handler.send_body(429, b"Too many requests", {'Retry-After': "0.5"})
+		else:
+			handler.send_body(200, json_body([]))
+
+	server = stub_server(respond)
+	# the backoff would wait far longer than the server asked
+	client = ensembl_client.EnsemblClient(server.url, backoff=30, requests_per_second=1000)
+
+	start_time = time.monotonic()
+	assert client.get("/overlap/region/homo_sapiens/1:1-2") == []
+	elapsed_time = time.monotonic() - start_time
+	assert len(server.requests) == 2
+	assert 0.5 <= elapsed_time < 5
+
+
+def test_rate_limit_reset_delays_next_request(stub_server):
+	server = stub_server(lambda handler: handler.send_body(200, json_body([]), {'X-RateLimit-Remaining': "0", 'X-RateLimit-Reset': "0.5"}))
+	client = ensembl_client.EnsemblClient(server.url, requests_per_second=1000)
+
+	client.get("/info/ping")
+	start_time = time.monotonic()
+	client.get("/info/ping")
+	assert time.monotonic() - start_time >= 0.5
+
+
+def test_server_errors_are_retried_then_raised(stub_server):
+	server = stub_server(lambda handler: handler.send_body(503, b"Service unavailable"))
+	client = ensembl_client.EnsemblClient(server.url, retries=2, backoff=0.01, requests_per_second=1000)
+
+	with pytest.raises(ensembl_client.EnsemblError, match="status 503"):
+		client.get("/info/ping")
+	assert len(server.requests) == 3
+
+
+def test_server_error_then_success(stub_server):
+	def respond(handler):
+		if len(handler.server.requests) < 3:
+			handler.send_body(500, b"Internal error")
+		else:
+			handler.send_body(200, json_body({'ping': 1}))
+
+	server = stub_server(respond)
+	client = ensembl_client.EnsemblClient(server.url, retries=4, backoff=0.01, requests_per_second=1000)
+
+	assert client.get("/info/ping") == {'ping': 1}
+	assert len(server.requests) == 3
+
+
+def test_client_errors_are_not_retried(stub_server):
+	server = stub_server(lambda handler: handler.send_body(400, b"Unknown species"))
+	client = ensembl_client.EnsemblClient(server.url, retries=4, backoff=0.01, requests_per_second=1000)
+
+	with pytest.raises(ensembl_client.EnsemblError, match="Unknown species"):
+		client.get("/overlap/region/martian/1:1-2")
+	assert len(server.requests) == 1
+
+
+def test_unreachable_server():
+	# a port nothing listens on
+	with socket.socket() as free_socket:
+		free_socket.bind(("127.0.0.1", 0))
+		port = free_socket.getsockname()[1]
+	client = ensembl_client.EnsemblClient("http://127.0.0.1:" + str(port), retries=1, backoff=0.01, requests_per_second=1000)
+
+	with pytest.raises(ensembl_client.EnsemblError, match="Could not reach ENSEMBL"):
+		client.get("/info/ping")
+
+
+def test_overlap_genes_many_keeps_region_order(stub_server):
+	def respond(handler):
+		region = handler.path.split("/")[-1].split("?")[0]
+		# answer the first regions last
+		time.sleep(0.2 if region.startswith("1:1-") else 0)
+		handler.send_body(200, json_body([{'region': region}]))
+
+	server = stub_server(respond)
+	client = ensembl_client.EnsemblClient(server.url, max_workers=4, requests_per_second=1000)
+
+	regions = [(1, 100), (200, 300), (400, 500), (600, 700)]
+	genes = client.overlap_genes_many("homo_sapiens", "1", regions)
+	assert genes == [[{'region': "1:" + str(start) + "-" + str(stop)}] for start, stop in regions]
+	assert len(server.requests) == 4
+
+
+def test_rate_limiter_spaces_requests():
+	rate_limiter = ensembl_client.RateLimiter(20)
+	start_time = time.monotonic()
+	for request_nb in range(6):
+		rate_limiter.wait()
+	# the first request starts at once, the others 1/20s apart
+	assert time.monotonic() - start_time >= 5 / 20
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+test_session_compare.py - Tests of the comparison of the variants of sessions.
+"""
+
+import pathlib
+import sqlite3
+
+import pytest
+
+from metallaxis import session_compare
+
+tumour_variants = [("01", 100, "A", "G", "PASS"), ("01", 200, "C", None, "PASS"), ("X", 300, "G", "T", "q10")]
+normal_variants = [("01", 100, "A", "G", "PASS"), ("01", 200, "C", None, "q10"), ("02", 400, "T", "C", "PASS")]
+
+
+def write_session(session_file, variants):
+	connection = sqlite3.connect(session_file)
+	connection.execute("CREATE TABLE df (CHROM TEXT, POS INTEGER, REF TEXT, ALT TEXT, FILTER TEXT);")
+	connection.executemany("INSERT INTO df VALUES (?, ?, ?, ?, ?);", variants)
+	connection.commit()
+	connection.close()
+
+
+def is_indexed(session_file):
+	connection = sqlite3.connect(session_file)
+	try:
+		return connection.execute("SELECT 1 FROM sqlite_master WHERE name = ?;", (session_compare.key_index,)).fetchone() is not None
+	finally:
+		connection.close()
+
+
+@pytest.fixture
+def sessions(tmp_path):
+	tumour_file, normal_file = str(tmp_path / "tumour.sqlite"), str(tmp_path / "normal.sqlite")
+	write_session(tumour_file, tumour_variants)
+	write_session(normal_file, normal_variants)
+	return tumour_file, normal_file
+
+
+def compare(connection, operation, other_files, session_names=None):
+	schemas = session_compare.attach_sessions(connection, other_files)
+	return connection.execute(session_compare.comparison_query(operation, schemas, session_names)).fetchall()
+
+
+def test_comparisons(sessions):
+	tumour_file, normal_file = sessions
+	connection = sqlite3.connect(tumour_file)
+	# missing ALTs match each other
+	assert compare(connection, 'intersection', [normal_file]) == tumour_variants[:2]
+	assert compare(connection, 'difference', [normal_file]) == tumour_variants[2:]
+	assert sorted(compare(connection, 'union', [normal_file], ["tumour", "normal"]), key=str) == sorted([
+		("01", 100, "A", "G", 1, 1), ("01", 200, "C", None, 1, 1), ("X", 300, "G", "T", 1, 0), ("02", 400, "T", "C", 0, 1)], key=str)
+	connection.close()
+	assert is_indexed(tumour_file) and is_indexed(normal_file)
+
+
+def test_read_only_sessions_are_compared_unindexed(sessions):
+	tumour_file, normal_file = sessions
+	connection = sqlite3.connect(pathlib.Path(tumour_file).as_uri() + "?mode=ro", uri=True)
+	assert compare(connection, 'intersection', [normal_file]) == tumour_variants[:2]
+	connection.close()
+	# only the session that could be written was indexed
+	assert not is_indexed(tumour_file) and is_indexed(normal_file)
+
+
+def test_sessions_that_cant_be_written(sessions):
+	tumour_file, normal_file = sessions
+	connection = sqlite3.connect(tumour_file)
+	connection.execute("PRAGMA query_only = ON;")
+	assert compare(connection, 'difference', [normal_file]) == tumour_variants[2:]
+	connection.close()
+	assert not is_indexed(tumour_file) and not is_indexed(normal_file)
+
+
+def test_presence_columns():
+	assert session_compare.presence_columns(["runs/tumour.sqlite", "normal-1.sqlite", "other/tumour.sqlite"]) == [
+		"in_tumour", "in_normal_1", "in_tumour_2"]
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+test_tabix.py - Tests of the tabix lookups on a bgzipped, indexed VCF.
+
+The fixture VCF is bgzipped in small blocks and indexed here, following the
+BGZF and tabix specifications, so that the tests don't need htslib.
+"""
+
+import gzip
+import random
+import struct
+import zlib
+
+import pytest
+
+from metallaxis import tabix
+
+vcf_header = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+bgzf_eof = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def bgzf_block(block_data):
+	compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+	compressed_data = compressor.compress(block_data) + compressor.flush()
+	block_size = 18 + len(compressed_data) + 8
+	return (b'\x1f\x8b\x08\x04' + b'\x00' * 4 + b'\x00\xff' + struct.pack('<H', 6) + b'BC' + struct.pack('<HH', 2, block_size - 1) +
+			compressed_data + struct.pack('<II', zlib.crc32(block_data), len(block_data)))
+
+
+def reg2bin(beg, end):
+	"""
+	Returns the smallest bin containing the 0-based, half open interval [beg, end).
+	"""
+	end -= 1
+	for level_first_bin, level_shift in ((4681, 14), (585, 17), (73, 20), (9, 23), (1, 26)):
+		if beg >> level_shift == end >> level_shift:
+			return level_first_bin + (beg >> level_shift)
+	return 0
+
+
+def write_indexed_vcf(vcf_file, records, block_size=1024):
+	"""
+	Writes records, lists of VCF columns sorted by contig and position, to a
+	bgzipped VCF cut into blocks of block_size bytes (so that lines run across
+	blocks), and writes its tabix index next to it.
+	"""
+	vcf_data = vcf_header.encode('UTF-8')
+	line_offsets = []
+	for record in records:
+		line_offsets.append(len(vcf_data))
+		vcf_data += ("\t".join(record) + "\n").encode('UTF-8')
+	line_offsets.append(len(vcf_data))
+
+	block_offsets = []
+	with open(vcf_file, 'wb') as vcf_write_obj:
+		for block_start in range(0, len(vcf_data), block_size):
+			block_offsets.append(vcf_write_obj.tell())
+			vcf_write_obj.write(bgzf_block(vcf_data[block_start:block_start + block_size]))
+		end_offset = vcf_write_obj.tell()
+		vcf_write_obj.write(bgzf_eof)
+
+	def virtual_offset(data_offset):
+		if data_offset == len(vcf_data):
+			return end_offset << 16
+		return (block_offsets[data_offset // block_size] << 16) | (data_offset % block_size)
+
+	contigs = {}
+	for record_nb, record in enumerate(records):
+		bins, linear_index = contigs.setdefault(record[0], ({}, {}))
+		beg = int(record[1]) - 1
+		end = beg + len(record[3])
+		chunk = [virtual_offset(line_offsets[record_nb]), virtual_offset(line_offsets[record_nb + 1])]
+		bin_chunks = bins.setdefault(reg2bin(beg, end), [])
+		if bin_chunks and bin_chunks[-1][1] == chunk[0]:
+			bin_chunks[-1][1] = chunk[1]
+		else:
+			bin_chunks.append(chunk)
+		for window_nb in range(beg >> 14, ((end - 1) >> 14) + 1):
+			linear_index.setdefault(window_nb, chunk[0])
+
+	names = b''.join(contig.encode('UTF-8') + b'\x00' for contig in contigs)
+	index_data = b'TBI\x01' + struct.pack('<8i', len(contigs), 2, 1, 2, 0, ord('#'), 0, len(names)) + names
+	for bins, linear_index in contigs.values():
+		index_data += struct.pack('<i', len(bins))
+		for bin_id, bin_chunks in bins.items():
+			index_data += struct.pack('<Ii', bin_id, len(bin_chunks))
+			for chunk_begin, chunk_end in bin_chunks:
+				index_data += struct.pack('<QQ', chunk_begin, chunk_end)
+		# windows without records take the offset of the window before them
+		offsets, previous_offset = [], 0
+		for window_nb in range(max(linear_index) + 1):
+			previous_offset = linear_index.get(window_nb, previous_offset)
+			offsets.append(previous_offset)
+		index_data += struct.pack('<i', len(offsets)) + struct.pack('<' + str(len(offsets)) + 'Q', *offsets)
+	with gzip.open(vcf_file + ".tbi", 'wb') as index_write_obj:
+		index_write_obj.write(index_data)
+
+
+def random_records(seed=1):
+	"""
+	Returns sorted records spread over a few megabases of two contigs, with
+	clusters, long gaps, deletions and multi-allelic records.
+	"""
+	random_generator = random.Random(seed)
+	records = []
+	for contig in ("1", "2"):
+		position = 1
+		for record_nb in range(1500):
+			position += random_generator.choice([1, 7, 50, 400, 3000, 20000])
+			ref = random_generator.choice(["A", "C", "G", "T", "ACGTACGT"])
+			alt = ",".join(random_generator.sample(["A", "C", "G", "T"], random_generator.choice([1, 1, 2])))
+			records.append([contig, str(position), "rs" + contig + str(record_nb), ref, alt, ".", "PASS",
+							"RS=" + contig + str(record_nb) + ";CLNSIG=" + random_generator.choice(["Benign", "Pathogenic"])])
+	return records
+
+
+@pytest.fixture(scope="module")
+def indexed_vcf(tmp_path_factory):
+	records = random_records()
+	vcf_file = str(tmp_path_factory.mktemp("tabix") / "variants.vcf.gz")
+	write_indexed_vcf(vcf_file, records)
+	return vcf_file, records
+
+
+def test_bgzipped_fixture_is_gzip(indexed_vcf):
+	vcf_file, records = indexed_vcf
+	with gzip.open(vcf_file, 'rt') as vcf_read_obj:
+		assert vcf_read_obj.read().count("\n") == len(records) + 2
+
+
+def test_fetch_matches_a_scan(indexed_vcf):
+	vcf_file, records = indexed_vcf
+	random_generator = random.Random(2)
+	with tabix.TabixFile(vcf_file, cached_blocks=4) as tabix_file:
+		for region_nb in range(200):
+			contig = random_generator.choice(["1", "2"])
+			start = random_generator.randint(1, 5000000)
+			end = start + random_generator.choice([0, 10, 1000, 50000, 2000000])
+			expected = [record for record in records if record[0] == contig and start <= int(record[1]) <= end]
+			assert list(tabix_file.fetch(contig, start, end)) == expected
+
+
+def test_fetch_reads_few_blocks(indexed_vcf):
+	vcf_file, records = indexed_vcf
+	with tabix.TabixFile(vcf_file, cached_blocks=0) as tabix_file:
+		read_blocks = []
+		read_block = tabix_file.read_block
+		tabix_file.read_block = lambda block_offset: read_blocks.append(block_offset) or read_block(block_offset)
+
+		record = records[len(records) * 3 // 4]
+		assert record in list(tabix_file.fetch(record[0], int(record[1]), int(record[1])))
+		# the file has over a hundred blocks
+		assert 1 <= len(read_blocks) <= 3
+
+
+def test_fetch_whole_contig(indexed_vcf):
+	vcf_file, records = indexed_vcf
+	with tabix.TabixFile(vcf_file) as tabix_file:
+		assert list(tabix_file.fetch("2", 1, 2 ** 29 - 1)) == [record for record in records if record[0] == "2"]
+		assert list(tabix_file.fetch("3", 1, 1000)) == []
+
+
+def test_find_variant(indexed_vcf):
+	vcf_file, records = indexed_vcf
+	with tabix.TabixFile(vcf_file) as tabix_file:
+		for record in records[::97]:
+			for alt in record[4].split(","):
+				assert tabix_file.find_variant(record[0], int(record[1]), record[3], alt) == record
+			assert tabix_file.find_variant(record[0], int(record[1]), record[3], "N") is None
+			assert tabix_file.find_variant(record[0], int(record[1]), "NNN", record[4].split(",")[0]) is None
+
+
+def test_resolve_contig(indexed_vcf):
+	vcf_file, records = indexed_vcf
+	with tabix.TabixFile(vcf_file) as tabix_file:
+		assert tabix_file.contigs() == ["1", "2"]
+		assert tabix_file.resolve_contig("1") == "1"
+		assert tabix_file.resolve_contig("chr2") == "2"
+		assert tabix_file.resolve_contig("X") is None
+
+
+def test_reg2bins_contains_record_bins():
+	random_generator = random.Random(3)
+	for interval_nb in range(1000):
+		beg = random_generator.randint(0, 2 ** 28)
+		end = beg + random_generator.randint(1, 2 ** random_generator.randint(0, 20))
+		assert reg2bin(beg, end) in tabix.reg2bins(beg, end)
+
+
+def test_invalid_files(tmp_path, indexed_vcf):
+	vcf_file, records = indexed_vcf
+	not_an_index = tmp_path / "variants.vcf.gz.tbi"
+	with gzip.open(str(not_an_index), 'wb') as index_write_obj:
+		index_write_obj.write(b'not an index')
+	with pytest.raises(tabix.TabixError):
+		tabix.TabixFile(vcf_file, str(not_an_index))
+
+	# a plain gzipped VCF isn't made of BGZF blocks
+	gzipped_vcf = str(tmp_path / "gzipped.vcf.gz")
+	with open(vcf_file, 'rb') as bgzip_read_obj, gzip.open(gzipped_vcf, 'wb') as gzip_write_obj:
+		gzip_write_obj.write(gzip.decompress(bgzip_read_obj.read()))
+	with tabix.TabixFile(gzipped_vcf, vcf_file + ".tbi") as tabix_file:
+		with pytest.raises(tabix.TabixError):
+			list(tabix_file.fetch("1", 1, 1000))
+
+
+def test_info_value():
+	assert tabix.info_value("RS=123;CLNSIG=Pathogenic;DB", "CLNSIG") == "Pathogenic"
+	assert tabix.info_value("RS=123;CLNSIG=Pathogenic;DB", "RS") == "123"
+	assert tabix.info_value("RS=123;CLNSIGCONF=Benign", "CLNSIG") is None
+	assert tabix.info_value("DB", "DB") is None
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""\
+test_vcf_stats.py - Tests of the vectorised statistics of a VCF.
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from metallaxis import vcf_stats
+
+vcf_header = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def test_pad_contigs():
+	contigs = pd.Series(["1", "9", "10", "X", "chr1", "01"], dtype=object)
+	assert list(vcf_stats.pad_contigs(contigs)) == ["01", "09", "10", "X", "chr1", "01"]
+
+
+def test_info_dp_values():
+	infos = np.array(["DP=7", "AF=0.5;DP=12.5;DB", "ADP=9", "ADP=9;DP=3", ".", "DP=abc", "DB;DP="], dtype=object)
+	np.testing.assert_array_equal(vcf_stats.info_dp_values(infos), [7, 12.5, np.nan, 3, np.nan, np.nan, np.nan])
+
+
+def test_numeric_values():
+	np.testing.assert_array_equal(vcf_stats.numeric_values(np.array(["50", ".", "12.5", "50", "x"], dtype=object)),
+								  [50, np.nan, 12.5, 50, np.nan])
+	assert len(vcf_stats.numeric_values(np.array([], dtype=object))) == 0
+
+
+def test_compute_stats(tmp_path):
+	vcf_file = str(tmp_path / "variants.vcf")
+	records = [["1", "100", ".", "A", "G", "50", "PASS", "DP=10"],
+			   ["01", "200", ".", "C", "A,T", ".", "q10;s50", "ADP=4"],
+			   ["2", "300", ".", "AT", "A", "20", "PASS", "DB;DP=30"],
+			   ["X", "400", ".", "G", "<DEL>", "70", ".", "."]]
+	with open(vcf_file, 'w') as vcf_write_obj:
+		vcf_write_obj.write(vcf_header + "".join("\t".join(record) + "\n" for record in records))
+
+	# chunks of 2 records, so that contigs 1 and 01 merge within a chunk, and
+	# totals are added across chunks
+	variant_stats = vcf_stats.compute_stats(vcf_file, 1, 2)
+	summary = variant_stats.summary()
+	assert (summary['variant_count'], summary['snp_count'], summary['indel_count']) == (4, 1, 3)
+	assert (summary['transition_count'], summary['transversion_count'], summary['multiallelic_count']) == (2, 1, 1)
+	assert summary['qual_mean'] == (50 + 20 + 70) / 3
+	assert summary['dp_mean'] == 20
+	assert list(variant_stats.contigs.index) == ["01", "02", "X"]
+	assert variant_stats.contigs.loc["01", 'variant_count'] == 2
+	assert variant_stats.filters == {'PASS': 2, 'q10': 1, 's50': 1, '.': 1}
+	assert variant_stats.allele_counts == {1: 3, 2: 1}
+	assert variant_stats.indel_lengths == {-1: 1}
+	assert variant_stats.dp_histogram.sum() == 2 and variant_stats.missing_dp == 2
+
+	legacy_counts = variant_stats.legacy_counts()
+	assert legacy_counts["List_Chromosomes"] == {"01", "02", "X"}
+	assert legacy_counts["01_Chrom_Variant_Count"] == 2
+	# every ALT is a single base, a list of them or symbolic, so they are counted
+	assert legacy_counts["ALT_Types"] == {"G", "A,T", "A", "<DEL>"}
+
+
+def test_load_legacy_stat_values():
+	connection = sqlite3.connect(":memory:")
+	connection.execute("CREATE TABLE stats (Tag TEXT, Result TEXT);")
+	# sessions from before typed statistics hold text, cut to 200 characters
+	truncated_alt_types = str(set("ACGT" + str(alt_nb) for alt_nb in range(100)))[:200] + "..."
+	connection.executemany("INSERT INTO stats VALUES (?, ?);", [("Total_SNP_Count", "12"), ("List_Chromosomes", "{'01', 'X'}"),
+																	("ALT_Types", truncated_alt_types)])
+	assert vcf_stats.load_stat_values(connection) == {"Total_SNP_Count": 12, "List_Chromosomes": {"01", "X"}}